@@ -1,8 +1,9 @@
 import numpy as np
 
 
-def generate_fsd_matrix(FI):
+def generate_fsd_matrix(FI, N_sizeBins=5):
     # function to generate the FSD matrix (generates a fragemntation matrix based on the selected fragmentation style determined by FI)
+    # Rows are the fragmenting size bins and columns the recieving size bins (smallest size bin first). The parameterization is given for 5 size bins: with fewer bins the matrix is its upper left block and with more bins the bigger size bins fragment as the biggest of the 5 size bins, i.e. the same fractions go to the three next smaller size bins and the rest to the smallest size bin (erosion, FI = 0)
     # Initialize a 5x5 matrix with zeros
     matrix = np.zeros((5, 5))
     c1 = 0.2
@@ -25,7 +26,16 @@ def generate_fsd_matrix(FI):
     matrix[4, 0] = matrix[3, 0] + (0.5 * matrix[4, 1]) + (0.25 * matrix[4, 2])
     matrix[4, 3] = 1 - matrix[4, 0] - matrix[4, 1] - matrix[4, 2]
 
-    return matrix
+    if N_sizeBins <= 5:
+        return matrix[:N_sizeBins, :N_sizeBins].copy()
+
+    fsd = np.zeros((N_sizeBins, N_sizeBins))
+    fsd[:5, :5] = matrix
+    for i in range(5, N_sizeBins):
+        fsd[i, 0] = matrix[4, 0]
+        fsd[i, i - 3 : i] = matrix[4, 1:4]
+
+    return fsd
 
 
 # function to convert mass to number
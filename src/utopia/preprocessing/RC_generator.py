@@ -3,7 +3,143 @@ import pandas as pd
 import os
 import numpy as np
 from utopia.globalConstants import *
-from utopia.helpers import generate_fsd_matrix
+from utopia.preprocessing.dry_deposition_MS import (
+    ReynoldsNumberFromStokes,
+    kineticCstdrySettlingNewtonSphere,
+    get_settling,
+)
+
+
+# Factors of the degradation half-life of free MPs in surface water for each MP form and compartment (see discorporation)
+discorporation_form_factors = {"freeMP": 1, "heterMP": 10, "biofMP": 0.5, "heterBiofMP": 5}
+discorporation_compartment_factors = {
+    "Ocean_Surface_Water": 1,
+    "Ocean_Mixed_Water": 10,
+    "Ocean_Column_Water": 10,
+    "Coast_Surface_Water": 1,
+    "Coast_Column_Water": 10,
+    "Surface_Freshwater": 1,
+    "Bulk_Freshwater": 10,
+    "Sediment_Freshwater": 100,
+    "Sediment_Ocean": 100,
+    "Sediment_Coast": 100,
+    "Beaches_Soil_Surface": 10,
+    "Beaches_Deep_Soil": 100,
+    "Background_Soil_Surface": 10,
+    "Background_Soil": 100,
+    "Impacted_Soil_Surface": 10,
+    "Impacted_Soil": 100,
+    "Air": 1000,
+}
+
+# Factors of the fragmentation half-life of free MPs in surface water for each MP form and compartment (see fragmentation)
+fragmentation_form_factors = {"freeMP": 1, "heterMP": 100, "biofMP": 2, "heterBiofMP": 200}
+fragmentation_compartment_factors = {
+    "Ocean_Surface_Water": 1,
+    "Ocean_Mixed_Water": 10,
+    "Ocean_Column_Water": 10,
+    "Coast_Surface_Water": 1,
+    "Coast_Column_Water": 10,
+    "Surface_Freshwater": 1,
+    "Bulk_Freshwater": 10,
+    "Sediment_Freshwater": 100,
+    "Sediment_Ocean": 100,
+    "Sediment_Coast": 100,
+    "Beaches_Soil_Surface": 10,
+    "Beaches_Deep_Soil": 100,
+    "Background_Soil_Surface": 10,
+    "Background_Soil": 100,
+    "Impacted_Soil_Surface": 10,
+    "Impacted_Soil": 100,
+    "Air": 0,
+}
+
+# Attachment efficiency of MPs to SPM for each MP form (see heteroaggregation)
+alpha_heter = {
+    "freeMP": 0.01,
+    "heterMP": 0,
+    "biofMP": 0.02,
+    "heterBiofMP": 0,
+}  # REF value: Besseling et al. 2017
+
+# Time of biofilm growth for each compartment and MP forms where biofouling is considered (see biofouling)
+t_biof_growth_days_comp = {
+    "Ocean_Surface_Water": 10,
+    "Ocean_Mixed_Water": 30,
+    "Ocean_Column_Water": 300,
+    "Coast_Surface_Water": 10,
+    "Coast_Column_Water": 30,
+    "Surface_Freshwater": 10,
+    "Bulk_Freshwater": 30,
+    "Sediment_Freshwater": 0,
+    "Sediment_Ocean": 0,
+    "Sediment_Coast": 0,
+    "Beaches_Soil_Surface": 0,
+    "Beaches_Deep_Soil": 0,
+    "Background_Soil_Surface": 0,
+    "Background_Soil": 0,
+    "Impacted_Soil_Surface": 0,
+    "Impacted_Soil": 0,
+    "Air": 0,
+}
+biofouling_form_factors = {
+    "freeMP": 1,
+    "heterMP": 1,
+    "biofMP": 0,
+    "heterBiofMP": 0,
+}  # indicates in wich aggregation states the biofouling process is considered
+
+# Rate of transfer from sediment to water when no depth parameter is available, taken from SimpleBox for Plastics model (placeholder values, to be revisited)
+sediment_resuspension_rates = {
+    "Sediment_Freshwater": 1e-9,
+    "Sediment_Coast": 1e-10,
+    "Sediment_Ocean": 1e-11,
+}
+
+# Ratio of the heteroaggregate breakup to the heteroaggregation rate constant of the parent free or biofouled MPs (placeholder, see heteroaggregate_breackup)
+heteroaggregate_breakup_factor = 1 / 1000000000
+
+# Vertical mixing velocities of the water compartments in m/s (see mixing)
+mixing_velocity_ocean_up_m_s = 0.0138
+mixing_velocity_ocean_down_m_s = 3.167e-8
+mixing_velocity_coast_m_s = 0.0138
+mixing_velocity_freshwater_m_s = 0.0067
+
+# Burial rates of the sediments without a settling balance, taken from SimpleBox for Plastics model (placeholder values, see burial)
+burial_rates = {"Sediment_Coast": 1e-9, "Sediment_Ocean": 5e-10}
+
+# Soil aerosol suspension velocity (m/h) and density of the soil particles (kg/m3) (see soil_air_resuspension)
+soil_air_resuspension_m_h = 10e-10
+soil_particle_density_kg_m3 = 2500
+
+# Soil side solid phase convection mass transfer coefficient (m/h) from the OECD tool and fraction of it going to the center of the earth (see soil_convection and sequestration_deep_soils)
+MTCsconv_m_h = 4.54e-7
+deep_soil_sequestration_fraction = 0.05
+
+# Soil solids runoff rate (m/h) of each surface soil and fraction of its runoff going to [Coast_Surface_Water, Surface_Freshwater] (see runoff_transport)
+runoff_rates_m_h = {
+    "Beaches_Soil_Surface": 2.3e-8,
+    "Background_Soil_Surface": 2.3e-8,
+    "Impacted_Soil_Surface": 2.3e-8,
+}
+runoff_fractions = {
+    "Impacted_Soil_Surface": [0, 1],
+    "Background_Soil_Surface": [0, 1],
+    "Beaches_Soil_Surface": [1, 0],
+}
+
+# Ratio of the beaching rate to the advective transport rate of the coastal surface water (see beaching)
+beaching_advection_ratio = 1 / 30
+
+# Height (m) used for the dry deposition rate constant: half of the planetary boundary layer of 1000 m (see dry_deposition)
+dry_deposition_height_m = 500
+
+# Time between rain events and duration of the rain events in seconds (see wet_deposition)
+t_dry_s = 120 * 60 * 60
+t_wet_s = 12 * 60 * 60
+
+# Marine aerosol suspension velocity (m/h) (see sea_spray_aerosol)
+sea_spray_aerosol_m_h = 8e-9
 
 
 def discorporation(particle, model):
@@ -17,33 +153,13 @@ def discorporation(particle, model):
 
     # 3) Size: The degradation rate is scaled by the surface area to volume ratio, so that smaller particles degrade faster. In this case scale the taken degradation rate of the 50um particles since we use the data from Pfohl et al. 2022 (degradation rate of 6.3 x 10-6 h-1 for particles of TPU-ether arom in the size range between 50-200um corresponds to a T_half_deg of aprox 12 years (4584 days). We assume this value as discorporation rate for the 50 um MP plastics in free form)
 
-    MP_form_factors = {"freeMP": 1, "heterMP": 10, "biofMP": 0.5, "heterBiofMP": 5}
-    compartment_factors = {
-        "Ocean_Surface_Water": 1,
-        "Ocean_Mixed_Water": 10,
-        "Ocean_Column_Water": 10,
-        "Coast_Surface_Water": 1,
-        "Coast_Column_Water": 10,
-        "Surface_Freshwater": 1,
-        "Bulk_Freshwater": 10,
-        "Sediment_Freshwater": 100,
-        "Sediment_Ocean": 100,
-        "Sediment_Coast": 100,
-        "Beaches_Soil_Surface": 10,
-        "Beaches_Deep_Soil": 100,
-        "Background_Soil_Surface": 10,
-        "Background_Soil": 100,
-        "Impacted_Soil_Surface": 10,
-        "Impacted_Soil": 100,
-        "Air": 1000,
-    }
     MP_size_deg_factors = (50**2) / (particle.diameter_um**2)
 
     # degradation half-life of MPs used as input is in days
     t_half_d = (
         model.t_half_deg_free
-        * compartment_factors[particle.Pcompartment.Cname]
-        * MP_form_factors[particle.Pform]
+        * discorporation_compartment_factors[particle.Pcompartment.Cname]
+        * discorporation_form_factors[particle.Pform]
         * MP_size_deg_factors
     )
     # degradation rate constant
@@ -65,30 +181,10 @@ def fragmentation(particle, model):
 
     # 3) Size: Bigger particles fragment faster than smaller particles. The fragmentation rate is scaled by the particle diameter.
 
-    MP_form_factors = {"freeMP": 1, "heterMP": 100, "biofMP": 2, "heterBiofMP": 200}
-    compartment_factors = {
-        "Ocean_Surface_Water": 1,
-        "Ocean_Mixed_Water": 10,
-        "Ocean_Column_Water": 10,
-        "Coast_Surface_Water": 1,
-        "Coast_Column_Water": 10,
-        "Surface_Freshwater": 1,
-        "Bulk_Freshwater": 10,
-        "Sediment_Freshwater": 100,
-        "Sediment_Ocean": 100,
-        "Sediment_Coast": 100,
-        "Beaches_Soil_Surface": 10,
-        "Beaches_Deep_Soil": 100,
-        "Background_Soil_Surface": 10,
-        "Background_Soil": 100,
-        "Impacted_Soil_Surface": 10,
-        "Impacted_Soil": 100,
-        "Air": 0,
-    }
     t_frag_d = (
         float(model.t_frag_gen_FreeSurfaceWater)
-        * MP_form_factors[particle.Pform]
-        * compartment_factors[particle.Pcompartment.Cname]
+        * fragmentation_form_factors[particle.Pform]
+        * fragmentation_compartment_factors[particle.Pcompartment.Cname]
     )
 
     if t_frag_d == 0:
@@ -102,11 +198,10 @@ def fragmentation(particle, model):
         )
 
     # The distribution of mass is expressed via the fragment size distribution matrix fsd (https://microplastics-cluster.github.io/fragment-mnp/advanced-usage/fragment-size-distribution.html) that is estimated from the fragmentation style of the plastic type (FI).
-    # In this matrix the smallest size fraction is in the first possition and we consider no fragmentation for this size class
-    fsd = generate_fsd_matrix(model.FI)
-    size_positions = {chr(i): i - ord("a") for i in range(ord("a"), ord("e") + 1)}
+    # In this matrix the smallest size fraction is in the first possition and we consider no fragmentation for this size class. The matrix only depends on FI and the number of size bins so it is computed once per model (model.fsd_matrix)
+    size_position = ord(particle.Pcode[0]) - ord("a")
 
-    k_frag = frag_rate * fsd[size_positions[particle.Pcode[0]]]
+    k_frag = frag_rate * model.fsd_matrix[size_position]
 
     return k_frag.tolist()
 
@@ -168,13 +263,12 @@ def settling(particle, model):
 
     # settlingMethod = "Stokes"
 
-    vSet_m_s = calculate_settling_velocity(
-        particle=particle, 
-        d_p=particle.diameter_m, 
+    vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+        shape=particle.Pshape,
+        d_p=particle.diameter_m,
         rho_p=particle.Pdensity_kg_m3,
         rho_f=w_den_kg_m3,
-        mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-        g=g_m_s2,
+        mu=mu_w_21C_kg_ms,
     )
 
     if vSet_m_s > 0:
@@ -248,13 +342,12 @@ def rising(particle, model):
         else:
             w_den_kg_m3 = density_seaWater_kg_m3
 
-        vrise_m_s = calculate_settling_velocity(
-            particle=particle, 
+        vrise_m_s = model.hydrodynamics_cache.settling_velocity(
+            shape=particle.Pshape,
             d_p=particle.diameter_m,
             rho_p=particle.Pdensity_kg_m3,
             rho_f=w_den_kg_m3,
-            mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-            g=g_m_s2,
+            mu=mu_w_21C_kg_ms,
         )
 
     else:
@@ -278,13 +371,6 @@ def heteroaggregation(particle, model):
 
     # Assumptions: Heteroaggegation happens to free and biofouled particles. It is hypothesized that biofilm increases the attachment efficiency of a plastic particle, reflected in two times higher values of alpha_heter for biofiouled plastic particles compared to the pristine form. We assumed there is no heteroaggregation in the sediment or any soil compartment and neither in air (this is already reflected in the particle, if the particle belongs to any of these compartments there wont be heteroaggregation included as process for the particle).
 
-    alpha_heter = {
-        "freeMP": 0.01,
-        "heterMP": 0,
-        "biofMP": 0.02,
-        "heterBiofMP": 0,
-    }  # REF value: Besseling et al. 2017
-
     # heteroaggregation rate constants
     """heteroaggregation requires to particles to collide and interact favorably for the collision to result in attachment
     the heteroaggregation rate constants is therefore composed of two parts, 1) a collision rate constant and 2) and attachement efficiency (alpha) (representing the probability of attachement).
@@ -313,22 +399,20 @@ def heteroaggregation(particle, model):
     else:
         w_den_kg_m3 = density_seaWater_kg_m3
 
-    MP_vSet_m_s = calculate_settling_velocity(
-        particle=particle, 
+    MP_vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+        shape=particle.Pshape,
         d_p=particle.diameter_m,
         rho_p=particle.Pdensity_kg_m3,
         rho_f=w_den_kg_m3,
-        mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-        g=g_m_s2,
+        mu=mu_w_21C_kg_ms,
     )
 
-    SPM_vSet_m_s = calculate_settling_velocity(
-        particle=model.spm, 
+    SPM_vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+        shape=model.spm.Pshape,
         d_p=model.spm.radius_m * 2,
         rho_p=model.spm.Pdensity_kg_m3,
         rho_f=w_den_kg_m3,
-        mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-        g=g_m_s2,
+        mu=mu_w_21C_kg_ms,
     )
 
     k_diffSettling = (
@@ -365,13 +449,6 @@ def heteroaggregate_breackup(particle, model):
 
     # Kbreackup is calculated based on Kheter of the free and biofouled MPs
 
-    alpha_heter = {
-        "freeMP": 0.01,
-        "heterMP": 0,
-        "biofMP": 0.02,
-        "heterBiofMP": 0,
-    }  # REF value: Besseling et al. 2017
-
     # first the different collision mechanisms are calculated
 
     k_peri = (
@@ -394,22 +471,20 @@ def heteroaggregate_breackup(particle, model):
     else:
         w_den_kg_m3 = density_seaWater_kg_m3
 
-    MP_vSet_m_s = calculate_settling_velocity(
-        particle=particle, 
+    MP_vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+        shape=particle.Pshape,
         d_p=particle.diameter_m,
         rho_p=particle.Pdensity_kg_m3,
         rho_f=w_den_kg_m3,
-        mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-        g=g_m_s2,
+        mu=mu_w_21C_kg_ms,
     )
 
-    SPM_vSet_m_s = calculate_settling_velocity(
-        particle=model.spm,
+    SPM_vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+        shape=model.spm.Pshape,
         d_p=model.spm.radius_m * 2,
         rho_p=model.spm.Pdensity_kg_m3,
         rho_f=w_den_kg_m3,
-        mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-        g=g_m_s2,
+        mu=mu_w_21C_kg_ms,
     )
 
     k_diffSettling = (
@@ -431,7 +506,7 @@ def heteroaggregate_breackup(particle, model):
         k_hetAgg = float(alpha) * k_coll * SPM_concNum_part_m3
         # the pseudo first-order heteroaggregation rate constant
 
-        k_aggBreakup = (1 / 1000000000) * k_hetAgg
+        k_aggBreakup = heteroaggregate_breakup_factor * k_hetAgg
     elif particle.Pform == "heterBiofMP":
         alpha = alpha_heter["biofMP"]
 
@@ -442,7 +517,7 @@ def heteroaggregate_breackup(particle, model):
         k_hetAgg = float(alpha) * k_coll * SPM_concNum_part_m3
         # the pseudo first-order heteroaggregation rate constant
 
-        k_aggBreakup = (1 / 1000000000) * k_hetAgg
+        k_aggBreakup = heteroaggregate_breakup_factor * k_hetAgg
     else:
         k_aggBreakup = 0
 
@@ -476,19 +551,19 @@ def mixing(particle, model):
 
     # Assuming that vertical mixing of freshwater compartments is in the minutes timescale. The water in the surface will take 2 min to travel 5 m, half way trhough the mix layer (10m deep). 2m/5min = 0.4 m/min= 0.0067 m/s
 
-    flowRate_mixUP_ocean_m3_s = 0.0138 * float(
+    flowRate_mixUP_ocean_m3_s = mixing_velocity_ocean_up_m_s * float(
         model.dict_comp["Ocean_Mixed_Water"].CsurfaceArea_m2
     )
 
-    flowRate_mixDown_ocean_m3_s = 3.167e-8 * float(
+    flowRate_mixDown_ocean_m3_s = mixing_velocity_ocean_down_m_s * float(
         model.dict_comp["Ocean_Mixed_Water"].CsurfaceArea_m2
     )
 
-    flowRate_mix_coast_m3_s = 0.0138 * float(
+    flowRate_mix_coast_m3_s = mixing_velocity_coast_m_s * float(
         model.dict_comp["Coast_Column_Water"].CsurfaceArea_m2
     )
 
-    flowRateMix_freshWater_m3_s = 0.0067 * float(
+    flowRateMix_freshWater_m3_s = mixing_velocity_freshwater_m_s * float(
         model.dict_comp["Bulk_Freshwater"].CsurfaceArea_m2
     )
 
@@ -530,35 +605,9 @@ def biofouling(particle, model):
 
     # 2) Aggregation state: Biofouling is modelled to occur in free and heteroaggregated particles
 
-    t_biof_growth_days_comp = {
-        "Ocean_Surface_Water": 10,
-        "Ocean_Mixed_Water": 30,
-        "Ocean_Column_Water": 300,
-        "Coast_Surface_Water": 10,
-        "Coast_Column_Water": 30,
-        "Surface_Freshwater": 10,
-        "Bulk_Freshwater": 30,
-        "Sediment_Freshwater": 0,
-        "Sediment_Ocean": 0,
-        "Sediment_Coast": 0,
-        "Beaches_Soil_Surface": 0,
-        "Beaches_Deep_Soil": 0,
-        "Background_Soil_Surface": 0,
-        "Background_Soil": 0,
-        "Impacted_Soil_Surface": 0,
-        "Impacted_Soil": 0,
-        "Air": 0,
-    }
-    MP_form_factor = {
-        "freeMP": 1,
-        "heterMP": 1,
-        "biofMP": 0,
-        "heterBiofMP": 0,
-    }  # indicates in wich aggregation states the biofouling process is considered
-
     t_biof_growth_d = (
         t_biof_growth_days_comp[particle.Pcompartment.Cname]
-        * MP_form_factor[particle.Pform]
+        * biofouling_form_factors[particle.Pform]
     )
     if t_biof_growth_d == 0:
         k_biof = 0
@@ -586,14 +635,8 @@ def defouling(particle, model):
 
 def sediment_resuspension(particle, model):
     # When no depth parameter available assign transfer sediment to water rate taken from SimpleBox for Plastics model
-    # Currently placeholder values. To be revisited
-    resusp_dict = {
-        "Sediment_Freshwater": 1e-9, 
-        "Sediment_Coast": 1e-10,
-        "Sediment_Ocean": 1e-11,
-    }
-
-    k_resusp = resusp_dict[particle.Pcompartment.Cname]
+    # Currently placeholder values. To be revisited (sediment_resuspension_rates)
+    k_resusp = sediment_resuspension_rates[particle.Pcompartment.Cname]
 
     return k_resusp
 
@@ -607,7 +650,7 @@ def burial(particle, model):
     # which is referred to the Full Multi v3.0 parameterization
     
     resusp_dict = {
-        "Sediment_Freshwater": 1e-9,
+        "Sediment_Freshwater": sediment_resuspension_rates["Sediment_Freshwater"],
         # "Sediment_Coast": 1e-10,
         # "Sediment_Ocean": 1e-11,
     }
@@ -626,13 +669,12 @@ def burial(particle, model):
     # calculate the settling velocity using the rc_settling module
     if particle.Pcompartment.Cname in resusp_dict:
 
-        vSet_m_s = calculate_settling_velocity(
-            particle=particle, 
+        vSet_m_s = model.hydrodynamics_cache.settling_velocity(
+            shape=particle.Pshape,
             d_p=particle.diameter_m,
             rho_p=particle.Pdensity_kg_m3,
             rho_f=w_den_kg_m3,
-            mu=mu_w_21C_kg_ms, #mu_w_21C_mPas,
-            g=g_m_s2,
+            mu=mu_w_21C_kg_ms,
         )
         
         water_compartment_name = sediment_to_water[particle.Pcompartment.Cname]
@@ -651,11 +693,8 @@ def burial(particle, model):
         if k_burial < 0:
             k_burial = 0
     
-    elif particle.Pcompartment.Cname == "Sediment_Coast":
-        k_burial = 1e-9 # assign burial rate taken from SimpleBox for Plastics model
-    
-    elif particle.Pcompartment.Cname == "Sediment_Ocean":
-        k_burial = 5e-10 # assign burial rate taken from SimpleBox for Plastics model
+    elif particle.Pcompartment.Cname in burial_rates:
+        k_burial = burial_rates[particle.Pcompartment.Cname] # assign burial rate taken from SimpleBox for Plastics model
 
     else:
         k_burial = 0
@@ -667,8 +706,8 @@ def burial(particle, model):
 def soil_air_resuspension(particle, model):
     # REF: global average soil-air 6x10^-10 m/h  and max value 10^-7 m/h. Qureshi et al. (2009) ## We should include a density factor. This transfer velocity was estimated by dividing estimates of vertical soil aerosol suspension fluxes by the density of the soil particles (2500kgm-3). We will make the sar_rate density dependent using the particle density.
 
-    sar_rate = (10e-10 / 60) / 60  # m/s
-    ssr_flow = sar_rate * 2500  # kg/m2s
+    sar_rate = (soil_air_resuspension_m_h / 60) / 60  # m/s
+    ssr_flow = sar_rate * soil_particle_density_kg_m3  # kg/m2s
 
     k_sa_reusp = (ssr_flow / particle.Pdensity_kg_m3) / float(
         particle.Pcompartment.Cdepth_m
@@ -680,7 +719,7 @@ def soil_air_resuspension(particle, model):
 def soil_convection(particle, model):
     # Mixing of soil particles via bioturbation and freeze/thaw cycles
 
-    MTCsconv = 4.54e-7
+    MTCsconv = MTCsconv_m_h
     # From the OECD Tool: MTCsconv = 4.54 * 10 ^-7 (m/h)'soil side solid phase convection MTC
 
     k_soil_convection = (MTCsconv / (60 * 60)) / float(particle.Pcompartment.Cdepth_m)
@@ -726,29 +765,16 @@ def runoff_transport(particle, model):
 
     # REF: BETR global approach for MTCsoilrunoff = 2.3 * 10 ^ -8  (m/h) 'soil solids runoff rate  (Scheringer, P230)
 
-    runooff_dict = {
-        "Beaches_Soil_Surface": 2.3e-8,
-        "Background_Soil_Surface": 2.3e-8,
-        "Impacted_Soil_Surface": 2.3e-8,
-    }
     runoff_rate = (
-        runooff_dict[particle.Pcompartment.Cname]
+        runoff_rates_m_h[particle.Pcompartment.Cname]
         / float(particle.Pcompartment.Cdepth_m)
     ) / (60 * 60)
 
-    # The total amount of runoff will be distributed into the recieving compartments according to the following matrix
-    fro = np.array([[0, 1], [0, 1], [1, 0]])
-    # number row corresponds to the soil emiting compartment
-    soilSurf_dic = {
-        "Impacted_Soil_Surface": 0,
-        "Background_Soil_Surface": 1,
-        "Beaches_Soil_Surface": 2,
-    }
-    # column number corresponds to the recieving compartment
+    # The total amount of runoff will be distributed into the recieving compartments according to the fractions of runoff_fractions (one per recieving compartment)
 
     # In this example of fro all runoff goes to surface freshwater. To be discussed later
 
-    k_runoff = runoff_rate * fro[soilSurf_dic[particle.Pcompartment.Cname]]
+    k_runoff = runoff_rate * np.array(runoff_fractions[particle.Pcompartment.Cname])
     k_runoff = k_runoff.tolist()
 
     return k_runoff
@@ -763,7 +789,7 @@ def beaching(particle, model):
         k_adv = float(particle.Pcompartment.waterFlow_m3_s) / float(
             particle.Pcompartment.Cvolume_m3
         )
-        k_beaching = (1 / 30) * k_adv
+        k_beaching = beaching_advection_ratio * k_adv
     else:
         k_beaching = 0
 
@@ -778,12 +804,6 @@ def wind_trasport(particle, model):
 
 
 def dry_deposition(particle, model):
-    from utopia.preprocessing.dry_deposition_MS import (
-        ReynoldsNumberFromStokes,
-        kineticCstdrySettlingNewtonSphere,
-        get_settling,
-    )
-
     # particles depossition from air to soil or water compartments
     air_v_m_s = 2  # Assuming average wind speed of 2 m/s
 
@@ -874,16 +894,10 @@ def dry_deposition(particle, model):
 
     # dd_rate = 7.91e-6
 
-    dd_rate_dict = {
-        "e": v_dd / 500,
-        "d": v_dd / 500,
-        "c": v_dd / 500,
-        "b": v_dd / 500,
-        "a": v_dd / 500,
-    }
     # Half of the air column depth (500m) is used to calculate the dry deposition rate constant. Assuming a planetary boundary hight of 1000m (Potentially make it different for different size classes)
+    dd_rate = v_dd / dry_deposition_height_m
     k_dry_depossition = [
-        dd_rate_dict[particle.Pcode[0]]
+        dd_rate
         * (
             float(model.dict_comp[c].CsurfaceArea_m2)
             / float(model.dict_comp["Air"].CsurfaceArea_m2)
@@ -902,20 +916,12 @@ def wet_deposition(particle, model):
     # The rate constant for wet deposition for all sizes and densities is assumed to be the same.
     # seconds REF: Table 6.5 in the Handbook of Chemical Mass Transport in the Environment (2011). Recommended Generic Yearly Average Values of time between Rain Events (tdry=120 h) and Duration of Rain Events (twet=12 h)
 
-    t_dry = 120 * 60 * 60
-    t_wet = 12 * 60 * 60  # seconds
+    t_dry = t_dry_s
+    t_wet = t_wet_s  # seconds
     k_wet = 2 * (t_dry + t_wet) / (t_dry**2)
 
-    wd_rate_dict = {
-        "e": k_wet,
-        "d": k_wet,
-        "c": k_wet,
-        "b": k_wet,
-        "a": k_wet,
-    }
-
     k_wet_depossition = [
-        wd_rate_dict[particle.Pcode[0]]
+        k_wet
         * (
             float(model.dict_comp[c].CsurfaceArea_m2)
             / float(model.dict_comp["Air"].CsurfaceArea_m2)
@@ -931,21 +937,13 @@ def sea_spray_aerosol(particle, model):
     # particles resuspension from ocean and coastal surface waters to air
     # REF: Qureshi et al. (2009) estimated globally and temporally averaged suspension velocities are 6 × 10−10 m h−1 for soil aerosol suspension and 8 × 10−9 m h−1 for marine aerosol suspension (Qureshi et al., 2009)
 
-    ssa_rate = 8e-9 / 60 / 60
+    ssa_rate = sea_spray_aerosol_m_h / 60 / 60
     ssa_flow = ssa_rate * 2250  # kg/m2s_flow
     k_sea_spray_aerosol = (ssa_flow / particle.Pdensity_kg_m3) / float(
         particle.Pcompartment.Cdepth_m
     )
 
-    ssa_rate_dict = {
-        "a": ssa_rate,
-        "b": ssa_rate,
-        "c": ssa_rate,
-        "d": ssa_rate,
-        "e": ssa_rate,
-    }
-
-    k_sea_spray_aerosol = ssa_rate_dict[particle.Pcode[0]] / float(
+    k_sea_spray_aerosol = ssa_rate / float(
         particle.Pcompartment.Cdepth_m
     )
 
@@ -968,11 +966,11 @@ def sequestration_deep_soils(particle, model):
 
     # From The OECD tool: MTC3sink = 0.05 * MTCsconv (m/h)soil solids convection to the center of the earth. MTCsconv = 4.54 * 10 ^-7 (m/h)'soil side solid phase convection MTC
 
-    MTCsconv = 4.54e-7
+    MTCsconv = MTCsconv_m_h
 
     # K_burial=MTC3sink (m/s) *SA (m2)/V(m3)
 
-    k_sequestration_deep_soils = (0.05 * MTCsconv / (60 * 60)) / float(
+    k_sequestration_deep_soils = (deep_soil_sequestration_fraction * MTCsconv / (60 * 60)) / float(
         particle.Pcompartment.Cdepth_m
     )
 
@@ -0,0 +1,368 @@
+"""Array based engine of the rate constants: each process is computed for all the species of the system at once from arrays of the particle and compartment properties, with the same equations as the per particle functions of RC_generator.py"""
+
+import math
+import numpy as np
+from utopia.globalConstants import *
+from utopia.preprocessing.RC_generator import (
+    discorporation_form_factors,
+    discorporation_compartment_factors,
+    fragmentation_form_factors,
+    fragmentation_compartment_factors,
+    alpha_heter,
+    t_biof_growth_days_comp,
+    biofouling_form_factors,
+    sediment_resuspension_rates,
+    heteroaggregate_breakup_factor,
+    mixing_velocity_ocean_up_m_s,
+    mixing_velocity_ocean_down_m_s,
+    mixing_velocity_coast_m_s,
+    mixing_velocity_freshwater_m_s,
+    burial_rates,
+    soil_air_resuspension_m_h,
+    soil_particle_density_kg_m3,
+    MTCsconv_m_h,
+    deep_soil_sequestration_fraction,
+    runoff_rates_m_h,
+    runoff_fractions,
+    beaching_advection_ratio,
+    dry_deposition_height_m,
+    t_dry_s,
+    t_wet_s,
+    sea_spray_aerosol_m_h,
+)
+from utopia.preprocessing.dry_deposition_MS import get_settling_arrays
+
+
+def compartment_property(compartment, name):
+    """Compartment property as float (the compartment inputs are read as strings), NaN when not given."""
+    value = getattr(compartment, name, None)
+    return np.nan if value is None else float(value)
+
+
+def species_properties(model):
+    """Arrays of the particle and compartment properties of all the species of the system (in the order of model.system_particle_object_list). The compartment properties are parsed once per compartment and broadcast to its species.
+
+    Parameters
+    ----------
+    model : utopiaModel with the model objects generated
+
+    Returns
+    -------
+    Dictionary of arrays: size (size bin code), size_index (position of the size bin in the fragment size distribution matrix), form (MP form), comp (compartment name), shape, diameter_m, radius_m, diameter_um, density_kg_m3 and the compartment properties depth_m, volume_m3, surfaceArea_m2, waterFlow_m3_s, SPM_mgL, T_K and G
+    """
+    particles = model.system_particle_object_list
+    properties = {
+        "size": np.array([p.Pcode[0] for p in particles]),
+        "form": np.array([p.Pform for p in particles]),
+        "comp": np.array([p.Pcompartment.Cname for p in particles]),
+        "shape": np.array([p.Pshape for p in particles]),
+        "diameter_m": np.array([p.diameter_m for p in particles], dtype=float),
+        "radius_m": np.array([float(p.radius_m) for p in particles]),
+        "diameter_um": np.array([float(p.diameter_um) for p in particles]),
+        "density_kg_m3": np.array([p.Pdensity_kg_m3 for p in particles], dtype=float),
+    }
+    properties["size_index"] = np.array([ord(s) - ord("a") for s in properties["size"]])
+
+    compartments = list(model.dict_comp.keys())
+    comp_index = np.array([compartments.index(c) for c in properties["comp"]])
+    for attribute, name in [
+        ("Cdepth_m", "depth_m"),
+        ("Cvolume_m3", "volume_m3"),
+        ("CsurfaceArea_m2", "surfaceArea_m2"),
+        ("waterFlow_m3_s", "waterFlow_m3_s"),
+        ("SPM_mgL", "SPM_mgL"),
+        ("T_K", "T_K"),
+        ("G", "G"),
+    ]:
+        values = np.array(
+            [compartment_property(model.dict_comp[c], attribute) for c in compartments]
+        )
+        properties[name] = values[comp_index]
+
+    return properties
+
+
+def lookup(table, keys, default=0):
+    """Array of the values of a dictionary for an array of keys."""
+    return np.array([table.get(k, default) for k in keys], dtype=float)
+
+
+def water_density(comp):
+    """Density of the water of each compartment (freshwater or seawater)."""
+    return np.where(
+        np.char.find(comp.astype(str), "Freshwater") >= 0,
+        density_w_21C_kg_m3,
+        density_seaWater_kg_m3,
+    )
+
+
+def water_settling_velocity(s, model):
+    """Settling velocity (m/s, negative for rising particles) of each species in the water of its compartment, from the hydrodynamics cache of the model (missing velocities are computed for all the species in one call of calculate_settling_velocity_arrays)."""
+    return model.hydrodynamics_cache.settling_velocities(
+        s["shape"],
+        s["diameter_m"],
+        s["density_kg_m3"],
+        water_density(s["comp"]),
+        mu_w_21C_kg_ms,
+    )
+
+
+def spm_settling_velocity(rho_f, model):
+    """Settling velocity (m/s) of the SPM particles for each water density."""
+    return model.hydrodynamics_cache.settling_velocities(
+        model.spm.Pshape,
+        model.spm.radius_m * 2,
+        model.spm.Pdensity_kg_m3,
+        rho_f,
+        mu_w_21C_kg_ms,
+    )
+
+
+def discorporation(s, model):
+    MP_size_deg_factors = (50**2) / (s["diameter_um"] ** 2)
+    t_half_d = (
+        model.t_half_deg_free
+        * lookup(discorporation_compartment_factors, s["comp"])
+        * lookup(discorporation_form_factors, s["form"])
+        * MP_size_deg_factors
+    )
+    return math.log(2) / (t_half_d * 24 * 60 * 60)
+
+
+def fragmentation(s, model):
+    t_frag_d = (
+        float(model.t_frag_gen_FreeSurfaceWater)
+        * lookup(fragmentation_form_factors, s["form"])
+        * lookup(fragmentation_compartment_factors, s["comp"])
+    )
+    with np.errstate(divide="ignore"):
+        frag_rate = np.where(
+            t_frag_d == 0,
+            0,
+            (1 / (t_frag_d * 24 * 60 * 60))
+            * s["diameter_um"]
+            / model.big_bin_diameter_um,
+        )
+    return frag_rate[:, None] * model.fsd_matrix[s["size_index"]]
+
+
+def collision_rate(s, model):
+    """Collision rate constant of each species with the SPM particles (perikinetic, orthokinetic and differential settling contributions, see RC_generator.heteroaggregation)."""
+    r = s["radius_m"]
+    r_spm = model.spm.radius_m
+    k_peri = (
+        (2 * k_B_J_K * s["T_K"]) / (3 * mu_w_21C_kg_ms) * (r + r_spm) ** 2 / (r * r_spm)
+    )
+    k_ortho = 4 / 3 * s["G"] * (r + r_spm) ** 3
+
+    rho_f = water_density(s["comp"])
+    spm_velocity = spm_settling_velocity(
+        [density_w_21C_kg_m3, density_seaWater_kg_m3], model
+    )
+    SPM_vSet_m_s = np.where(
+        rho_f == density_w_21C_kg_m3, spm_velocity[0], spm_velocity[1]
+    )
+    k_diffSettling = math.pi * (r + r_spm) ** 2 * np.abs(s["vSet_m_s"] - SPM_vSet_m_s)
+    return k_peri + k_ortho + k_diffSettling
+
+
+def spm_number_concentration(s, model):
+    """SPM number concentration (particles/m3) in the compartment of each species (spm.calc_numConc)."""
+    return s["SPM_mgL"] / 1000 / model.spm.Pdensity_kg_m3 / model.spm.Pvolume_m3
+
+
+def heteroaggregation(s, model):
+    alpha = lookup(alpha_heter, s["form"])
+    k_hetAgg = alpha * collision_rate(s, model) * spm_number_concentration(s, model)
+    return np.where(alpha == 0, 0, k_hetAgg)
+
+
+def heteroaggregate_breackup(s, model):
+    # Breakup of heteroaggregates from the heteroaggregation rate constant of the parent free or biofouled MPs
+    alpha = lookup(
+        {"heterMP": alpha_heter["freeMP"], "heterBiofMP": alpha_heter["biofMP"]},
+        s["form"],
+    )
+    k_hetAgg = alpha * collision_rate(s, model) * spm_number_concentration(s, model)
+    return np.where(alpha == 0, 0, heteroaggregate_breakup_factor * k_hetAgg)
+
+
+def settling(s, model):
+    vSet_m_s = s["vSet_m_s"]
+    return np.where(vSet_m_s > 0, vSet_m_s / s["depth_m"], 0)
+
+
+def rising(s, model):
+    lower_water = np.isin(
+        s["comp"],
+        [
+            "Ocean_Mixed_Water",
+            "Ocean_Column_Water",
+            "Coast_Column_Water",
+            "Bulk_Freshwater",
+        ],
+    )
+    vrise_m_s = np.where(lower_water, s["vSet_m_s"], 0)
+    return np.where(vrise_m_s < 0, -vrise_m_s / s["depth_m"], 0)
+
+
+def advective_transport(s, model):
+    return s["waterFlow_m3_s"] / s["volume_m3"]
+
+
+def mixing(s, model):
+    flowRate_mixUP_ocean_m3_s = mixing_velocity_ocean_up_m_s * float(
+        model.dict_comp["Ocean_Mixed_Water"].CsurfaceArea_m2
+    )
+    flowRate_mixDown_ocean_m3_s = mixing_velocity_ocean_down_m_s * float(
+        model.dict_comp["Ocean_Mixed_Water"].CsurfaceArea_m2
+    )
+    flowRate_mix_coast_m3_s = mixing_velocity_coast_m_s * float(
+        model.dict_comp["Coast_Column_Water"].CsurfaceArea_m2
+    )
+    flowRateMix_freshWater_m3_s = mixing_velocity_freshwater_m_s * float(
+        model.dict_comp["Bulk_Freshwater"].CsurfaceArea_m2
+    )
+    flow_m3_s = {
+        "Ocean_Column_Water": flowRate_mixDown_ocean_m3_s,
+        "Ocean_Surface_Water": flowRate_mixUP_ocean_m3_s,
+        "Coast_Column_Water": flowRate_mix_coast_m3_s,
+        "Coast_Surface_Water": flowRate_mix_coast_m3_s,
+        "Surface_Freshwater": flowRateMix_freshWater_m3_s,
+        "Bulk_Freshwater": flowRateMix_freshWater_m3_s,
+    }
+    k_mix = (lookup(flow_m3_s, s["comp"]) / s["volume_m3"]).tolist()
+    k_mix_up = (flowRate_mixUP_ocean_m3_s / s["volume_m3"]).tolist()
+    k_mix_down = (flowRate_mixDown_ocean_m3_s / s["volume_m3"]).tolist()
+    # The Ocean Mixed Water mixes up (to the surface) and down (to the column water)
+    return [
+        [k_mix_up[i], k_mix_down[i]] if comp == "Ocean_Mixed_Water" else k_mix[i]
+        for i, comp in enumerate(s["comp"])
+    ]
+
+
+def biofouling(s, model):
+    t_biof_growth_d = lookup(t_biof_growth_days_comp, s["comp"]) * lookup(
+        biofouling_form_factors, s["form"]
+    )
+    with np.errstate(divide="ignore"):
+        return np.where(t_biof_growth_d == 0, 0, 1 / t_biof_growth_d / 24 / 60 / 60)
+
+
+def defouling(s, model):
+    return np.zeros(len(s["comp"]))
+
+
+def sediment_resuspension(s, model):
+    return lookup(sediment_resuspension_rates, s["comp"])
+
+
+def burial(s, model):
+    # Burial in Sediment_Freshwater balances settling from Bulk_Freshwater and resuspension, for the other sediments rates from SimpleBox for Plastics model
+    k_set = np.where(
+        s["vSet_m_s"] > 0,
+        s["vSet_m_s"] / float(model.dict_comp["Bulk_Freshwater"].Cdepth_m),
+        0,
+    )
+    k_burial_freshwater = np.maximum(
+        k_set - sediment_resuspension_rates["Sediment_Freshwater"], 0
+    )
+    return np.where(
+        s["comp"] == "Sediment_Freshwater",
+        k_burial_freshwater,
+        lookup(burial_rates, s["comp"]),
+    )
+
+
+def soil_air_resuspension(s, model):
+    sar_rate = (soil_air_resuspension_m_h / 60) / 60  # m/s
+    ssr_flow = sar_rate * soil_particle_density_kg_m3  # kg/m2s
+    return (ssr_flow / s["density_kg_m3"]) / s["depth_m"]
+
+
+def soil_convection(s, model):
+    return (MTCsconv_m_h / (60 * 60)) / s["depth_m"]
+
+
+def percolation(s, model):
+    return np.zeros(len(s["comp"]))
+
+
+def runoff_transport(s, model):
+    runoff_rate = (lookup(runoff_rates_m_h, s["comp"]) / s["depth_m"]) / (60 * 60)
+    # Fraction of the runoff of each surface soil going to Coast_Surface_Water and Surface_Freshwater
+    fractions = np.array([runoff_fractions.get(c, [0, 0]) for c in s["comp"]])
+    return runoff_rate[:, None] * fractions
+
+
+def beaching(s, model):
+    k_adv = s["waterFlow_m3_s"] / s["volume_m3"]
+    return np.where(
+        s["comp"] == "Coast_Surface_Water", beaching_advection_ratio * k_adv, 0
+    )
+
+
+def wind_trasport(s, model):
+    return np.zeros(len(s["comp"]))
+
+
+def surface_area_ratios(model):
+    """Ratio of the surface area of each surface compartment to the air surface area (distribution of the atmospheric deposition)."""
+    return np.array(
+        [
+            float(model.dict_comp[c].CsurfaceArea_m2)
+            / float(model.dict_comp["Air"].CsurfaceArea_m2)
+            for c in list(model.dict_comp.keys())
+            if "Surface" in c
+        ]
+    )
+
+
+def dry_deposition(s, model):
+    # Settling velocities in air of all the airborne species at once
+    in_air = s["comp"] == "Air"
+    v_dd = np.zeros(len(s["comp"]))
+    v_dd[in_air] = get_settling_arrays(
+        s["diameter_m"][in_air], s["density_kg_m3"][in_air]
+    )
+    # Half of the air column depth is used to calculate the dry deposition rate constant (see RC_generator.dry_deposition), distributed to the surface compartments (columns) according to their surface area
+    return (v_dd / dry_deposition_height_m)[:, None] * surface_area_ratios(model)
+
+
+def wet_deposition(s, model):
+    k_wet = 2 * (t_dry_s + t_wet_s) / (t_dry_s**2)
+    return np.full((len(s["comp"]), 1), k_wet) * surface_area_ratios(model)
+
+
+def sea_spray_aerosol(s, model):
+    ssa_rate = sea_spray_aerosol_m_h / 60 / 60
+    return ssa_rate / s["depth_m"]
+
+
+def sequestration_deep_soils(s, model):
+    return (deep_soil_sequestration_fraction * MTCsconv_m_h / (60 * 60)) / s["depth_m"]
+
+
+def rate_constants_arrays(model):
+    """Computes every process of the system for all the species at once.
+
+    Parameters
+    ----------
+    model : utopiaModel with the model objects generated
+
+    Returns
+    -------
+    Dictionary {process: list of the rate constants of all the species} (a number or a list per species, as returned by the functions of RC_generator). The values of the species whose compartment does not have the process are not meaningful.
+    """
+    s = species_properties(model)
+    s["vSet_m_s"] = water_settling_velocity(s, model)
+
+    processes = []
+    for comp in model.dict_comp.values():
+        processes += [p for p in comp.processess if p not in processes]
+
+    values = {}
+    for process in processes:
+        result = globals()[process](s, model)
+        values[process] = result if isinstance(result, list) else result.tolist()
+    return values
@@ -76,7 +76,7 @@ def dragCoefficient(d, rho, Rep):
     ]
 
     Cd = np.piecewise(Rep, Rep_conditions, Cd_functions)
-    
+
     # Cd = 24.0 * (1.0 + (0.15 * Rep**0.687)) / Rep
     # Cd = Cd + 0.42 / (1.0 + (42500.0/ (Rep**1.16)))
     return Cd
@@ -146,3 +146,34 @@ def get_settling(initial_Settling, d, rho, initial_Rep):
     reynolds = ReynoldsNumberFromVg(d, rho, final_settling_velocity)
 
     return final_settling_velocity
+
+
+# Settling velocities of arrays of particles in air, iterated as in get_settling
+# with a convergence mask so that each particle stops at its own iteration
+def get_settling_arrays(d, rho, tolerance=0.001, max_iterations=20):
+    d = np.asarray(d, dtype=float)
+    rho = np.asarray(rho, dtype=float)
+    d, rho = np.broadcast_arrays(d, rho)
+
+    # Initial guess from the Reynolds number of the Stokes settling velocity
+    settling = kineticCstdrySettlingNewtonSphere(
+        d, rho, ReynoldsNumberFromStokes(d, rho)
+    )
+    settling = np.array(settling, dtype=float)
+
+    active = np.flatnonzero(np.ones(d.shape, dtype=bool))
+    for iteration in range(max_iterations):
+        if active.size == 0:
+            break
+        d_a = d.flat[active]
+        rho_a = rho.flat[active]
+        settling_old = settling.flat[active]
+        reynolds = ReynoldsNumberFromVg(d_a, rho_a, settling_old)
+        settling_new = kineticCstdrySettlingNewtonSphere(d_a, rho_a, reynolds)
+        settling.flat[active] = settling_new
+
+        # Only the particles that have not converged are iterated further
+        cvg = abs((settling_new - settling_old) / settling_new)
+        active = active[~(cvg < tolerance)]
+
+    return settling
@@ -3,6 +3,8 @@
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from utopia.preprocessing.rate_constant_table import RateConstantTable
 
 
 def fillInteractions_fun_OOP(system_particle_object_list, SpeciesList, dict_comp):
@@ -35,48 +37,231 @@ def fillInteractions_fun_OOP(system_particle_object_list, SpeciesList, dict_comp
     return interactions_df_sol.transpose()
 
 
-def eliminationProcesses(system_particle_object_list, SpeciesList):
-    # Estimate losses (diagonal):the diagonal of the dataframe corresponds to the losses of each species
-    # Add soil_convection as elimination process from deep soil compartments
+def fillInteractions_sparse(
+    system_particle_object_list, SpeciesList, dict_comp, rate_constants=None
+):
+    """Sparse assembly of the matrix of interactions. Equivalent to fillInteractions_fun_OOP but, instead of evaluating every pair of species, the non-zero interactions are emitted as (recieving species, emitting species, rate) triplets following the compartment connexions. The rate constants are read from the RateConstantTable rate_constants (by default built from the RateConstants of the particles). Returns a scipy CSR matrix with the same layout as the interactions dataframe (rows: recieving species, columns: emitting species)."""
+
+    surfComp_list = [c for c in dict_comp if "Surface" in c]
+    if rate_constants is None:
+        rate_constants = RateConstantTable.from_particles(system_particle_object_list)
+
+    # Asign loose rates (diagonal)
+    elimination_rates = eliminationProcesses(
+        system_particle_object_list, SpeciesList, rate_constants
+    )
 
-    """create the array of values for the diagonal wich is the sum of all RC corresponding to one species:"""
+    n_species = len(SpeciesList)
+    rows = list(range(n_species))
+    cols = list(range(n_species))
+    values = list(elimination_rates)
+
+    # Asign interactions rates (off-diagonal). The fragmentation block is filled in one scatter
+    for sp_idx, process, position, k, recievers in interaction_entries(
+        system_particle_object_list,
+        surfComp_list,
+        rate_constants,
+        fragmentation=False,
+    ):
+        if k == 0:
+            continue
+        for rec_idx in recievers:
+            rows.append(rec_idx)
+            cols.append(sp_idx)
+            values.append(k)
+
+    frag_rows, frag_cols, frag_values = fragmentation_triplets(
+        system_particle_object_list, rate_constants
+    )
+    rows = np.concatenate([rows, frag_rows])
+    cols = np.concatenate([cols, frag_cols])
+    values = np.concatenate([values, frag_values])
 
-    diag_list = []
+    # Duplicated triplets (several processess between the same pair of species) are summed up
+    interactions_matrix = sparse.coo_matrix(
+        (values, (rows, cols)), shape=(n_species, n_species)
+    ).tocsr()
 
-    for sp in system_particle_object_list:
-        dict_sp = sp.RateConstants
+    return interactions_matrix
 
-        # replace none values
-        for k in dict_sp.keys():
-            if dict_sp[k] == None:
-                dict_sp[k] = 0
-            else:
-                pass
-
-        losses = []
-        for (
-            i
-        ) in (
-            dict_sp.keys()
-        ):  # Do we need to remove fragmentation of smallest size bin and only take into consideration desintegration?? # It should be anyways = to zero
-            if i == "k_fragmentation":
-                if type(dict_sp[i]) == tuple:
-                    losses.append(dict_sp[i][0])
-                else:
-                    losses.append(dict_sp[i])
 
-            elif type(dict_sp[i]) == tuple or type(dict_sp[i]) == list:
-                losses.append(sum(dict_sp[i]))
-            elif type(dict_sp[i]) == dict:
-                losses.append(sum(dict_sp[i].values()))
+def interactions_update(
+    system_particle_object_list, dict_comp, factors, rate_constants=None
+):
+    """Change of the matrix of interactions when some rate constants are multiplied by a factor, without reassembling the matrix.
+
+    Parameters
+    ----------
+    system_particle_object_list : list of particle objects with their rate constants
+    dict_comp : dictionary of the model compartments
+    factors : dictionary {(process, compartment name): factor} of the rate constants to modify. The compartment can be None to modify the process in all compartments; when both are given the factor of the compartment replaces the one of all compartments for that compartment (factors are not multiplied)
+    rate_constants : RateConstantTable of the system (default: built from the RateConstants of the particles)
+
+    Returns
+    -------
+    scipy CSC matrix with the change of the matrix of interactions (non-zero only in the columns of the emitting species whose rate constants change)
+    """
+    surfComp_list = [c for c in dict_comp if "Surface" in c]
+    n_species = len(system_particle_object_list)
+
+    rows = []
+    cols = []
+    values = []
+    matched = set()
+    for sp_idx, process, position, k, recievers in interaction_entries(
+        system_particle_object_list, surfComp_list, rate_constants
+    ):
+        comp = system_particle_object_list[sp_idx].Pcompartment.Cname
+        keys = [key for key in [(process, comp), (process, None)] if key in factors]
+        if not keys:
+            continue
+        matched.update(keys)
+        # The compartment specific factor takes precedence over the factor of the process in all compartments
+        delta_k = (factors[keys[0]] - 1) * k
+        if delta_k == 0:
+            continue
+        # The emitting species loses delta_k more (diagonal) and each reciever gets it
+        rows.append(sp_idx)
+        cols.append(sp_idx)
+        values.append(-delta_k)
+        for rec_idx in recievers:
+            rows.append(rec_idx)
+            cols.append(sp_idx)
+            values.append(delta_k)
+
+    unknown = [key for key in factors if key not in matched]
+    if unknown:
+        raise ValueError("Rate constants not found in the system: " + str(unknown))
+
+    return sparse.coo_matrix(
+        (values, (rows, cols)), shape=(n_species, n_species)
+    ).tocsc()
+
+
+# Change of aggregation state (MP form code) of the recieving species for each inbox process
+form_transitions = {
+    "k_heteroaggregation": {"A": "B", "C": "D"},
+    "k_heteroaggregate_breackup": {"B": "A", "D": "C"},
+    "k_biofouling": {"A": "C", "B": "D"},
+    "k_defouling": {"C": "A", "D": "B"},
+}
+
+# Position of the recieving compartment in the rate constants given as lists
+list_positions = {
+    "k_mixing": {"Ocean_Surface_Water": 0, "Ocean_Column_Water": 1},
+    "k_runoff_transport": {"Coast_Surface_Water": 0, "Surface_Freshwater": 1},
+}
+
+
+def interaction_entries(
+    system_particle_object_list, surfComp_list, rate_constants=None, fragmentation=True
+):
+    """Generator over every rate constant entry of every particle. Yields tuples (emitting species index, process, position, rate constant, list of recieving species indexes). The position is the index of the rate constant within the list of rate constants of the process (0 for single values). Entries with an empty list of recieving species are pure losses (e.g. discorporation or burial) and only contribute to the diagonal of the matrix of interactions. The rate constants are read from the RateConstantTable rate_constants (by default built from the RateConstants of the particles). With fragmentation=False the fragmentation entries are skipped (see fragmentation_triplets)."""
+    if rate_constants is None:
+        rate_constants = RateConstantTable.from_particles(system_particle_object_list)
+
+    species_index = {}
+    for idx, p in enumerate(system_particle_object_list):
+        species_index[
+            (p.Pcode[0], p.Pcode[1], p.Pcompartment.Cname, p.Pcode.split("_")[1])
+        ] = idx
+
+    surfComp_dict = {key: index for index, key in enumerate(surfComp_list)}
+
+    for sp_idx, sp in enumerate(system_particle_object_list):
+        size, form = sp.Pcode[0], sp.Pcode[1]
+        box = sp.Pcode.split("_")[1]
+        comp = sp.Pcompartment.Cname
+
+        for process, rates, is_list in rate_constants.entries(sp_idx):
+            if process == "k_fragmentation" and not fragmentation:
+                continue
+            recievers = [[] for _ in rates]
+
+            if process == "k_fragmentation":
+                # Fragments go to the smaller size bins of the same MP form in the same compartment. The position in the list corresponds to the recieving size bin (fragment size distribution matrix)
+                for position in range(len(rates)):
+                    rec_size = chr(ord("a") + position)
+                    rec = species_index.get((rec_size, form, comp, box))
+                    if rec_size != size and rec is not None:
+                        recievers[position].append(rec)
+
+            elif process in form_transitions:
+                if form in form_transitions[process]:
+                    rec = species_index.get(
+                        (size, form_transitions[process][form], comp, box)
+                    )
+                    if rec is not None:
+                        recievers[0].append(rec)
+
             else:
-                losses.append(dict_sp[i])
+                # Transport processess: recieving compartments are the ones connected through the process
+                proc = process[2:]
+                for rec_comp, connexion in sp.Pcompartment.connexions.items():
+                    if type(connexion) == list:
+                        if proc not in connexion:
+                            continue
+                    elif proc != connexion:
+                        continue
+
+                    rec = species_index.get((size, form, rec_comp, box))
+                    if rec is None:
+                        continue
+
+                    if not is_list:
+                        recievers[0].append(rec)
+                    elif proc in ["dry_deposition", "wet_deposition"]:
+                        recievers[surfComp_dict[rec_comp]].append(rec)
+                    elif rec_comp in list_positions.get(process, {}):
+                        recievers[list_positions[process][rec_comp]].append(rec)
+
+            for position, k in enumerate(rates):
+                yield sp_idx, process, position, k, recievers[position]
+
+
+def fragmentation_triplets(system_particle_object_list, rate_constants):
+    """Off-diagonal fragmentation entries of the matrix of interactions for any number of size bins, in one scatter of the fragmentation rate constants (species x recieving size bin, i.e. the fragmentation rate of each species times its row of the fragment size distribution matrix). Each species fragments into the species of the recieving size bins with the same MP form, compartment and box, so the block has the structure of a Kronecker product of an identity over (form, compartment, box) and the fragment size distribution matrix.
+
+    Returns
+    -------
+    rows, cols, values : arrays of the recieving species, emitting species and rate constants of the non-zero entries
+    """
+    if "k_fragmentation" not in rate_constants.process_index:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+
+    groups = {}
+    group = np.array(
+        [
+            groups.setdefault(
+                (p.Pcode[1], p.Pcompartment.Cname, p.Pcode.split("_")[1]), len(groups)
+            )
+            for p in system_particle_object_list
+        ]
+    )
+    size = np.array([ord(p.Pcode[0]) - ord("a") for p in system_particle_object_list])
+    k_frag = rate_constants.values[:, rate_constants.process_index["k_fragmentation"]]
 
-        losses_all = [sum(e) if isinstance(e, list) else e for e in losses]
+    # Species index of each (form, compartment, box) group and size bin (-1 when the species does not exist)
+    n_species = len(system_particle_object_list)
+    species = np.full((len(groups), max(size.max() + 1, k_frag.shape[1])), -1)
+    species[group, size] = np.arange(n_species)
 
-        diag_list.append(-(sum(losses_all)))
+    rows = species[group, : k_frag.shape[1]]
+    cols = np.broadcast_to(np.arange(n_species)[:, None], rows.shape)
+    keep = (rows >= 0) & (rows != cols) & (k_frag != 0)
+    return rows[keep], cols[keep], k_frag[keep]
 
-    return diag_list
+
+def eliminationProcesses(system_particle_object_list, SpeciesList, rate_constants=None):
+    # Estimate losses (diagonal):the diagonal of the dataframe corresponds to the losses of each species
+    # Add soil_convection as elimination process from deep soil compartments
+
+    """create the array of values for the diagonal wich is the sum of all RC corresponding to one species (all the processes and recieving targets of the RateConstantTable, by default built from the RateConstants of the particles):"""
+
+    if rate_constants is None:
+        rate_constants = RateConstantTable.from_particles(system_particle_object_list)
+
+    return (-rate_constants.total()).tolist()
 
 
 def inboxProcess(sp1, sp2, surfComp_list):
@@ -87,13 +272,11 @@ def inboxProcess(sp1, sp2, surfComp_list):
         if sp1.Pcode[1:] == sp2.Pcode[1:] and sp1.Pcode[0] != sp2.Pcode[0]:
 
             # We reformulate fractionation as it is not a happening only for consecutive size Bins(bigger to next smaller) but using the fragment size distribution matrix (https://microplastics-cluster.github.io/fragment-mnp/advanced-usage/fragment-size-distribution.html)
-            # We have to select the fragmentation rate corresponding to the recieving size bin from the size_dict
+            # We have to select the fragmentation rate corresponding to the recieving size bin (position of its size code)
 
             # In this matrix the smallest size fraction is in the first possition and we consider no fragmentation for this size class
 
-            size_dict = {chr(i): i - ord("a") for i in range(ord("a"), ord("e") + 1)}
-
-            fsd_index = size_dict[sp1.Pcode[0]]
+            fsd_index = ord(sp1.Pcode[0]) - ord("a")
 
             if type(sp2.RateConstants["k_fragmentation"]) is tuple:
                 frag = sp2.RateConstants["k_fragmentation"]
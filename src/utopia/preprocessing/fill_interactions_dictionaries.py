@@ -83,13 +83,11 @@ def inboxProcess_dict(sp1, sp2, surfComp_list):
         if sp1.Pcode[1:] == sp2.Pcode[1:] and sp1.Pcode[0] != sp2.Pcode[0]:
 
             # We reformulate fractionation as it is not a happening only for consecutive size Bins(bigger to next smaller) but using the fragment size distribution matrix (https://microplastics-cluster.github.io/fragment-mnp/advanced-usage/fragment-size-distribution.html)
-            # We have to select the fragmentation rate corresponding to the recieving size bin from the size_dict
+            # We have to select the fragmentation rate corresponding to the recieving size bin (position of its size code)
 
             # In this matrix the smallest size fraction is in the first possition and we consider no fragmentation for this size class
 
-            size_dict = {chr(i): i - ord("a") for i in range(ord("a"), ord("e") + 1)}
-
-            fsd_index = size_dict[sp1.Pcode[0]]
+            fsd_index = ord(sp1.Pcode[0]) - ord("a")
 
             if type(sp2.RateConstants["k_fragmentation"]) is tuple:
                 frag = sp2.RateConstants["k_fragmentation"]
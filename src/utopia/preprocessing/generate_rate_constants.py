@@ -1,8 +1,24 @@
 import utopia.preprocessing.RC_generator as RC_generator
+from utopia.preprocessing.RC_vectorized import rate_constants_arrays
+from utopia.preprocessing.rate_constant_table import RateConstantTable
 
 
 def generate_rate_constants(model):
-    """Generates rate constants for all processes for each particle in the system."""
+    """Generates rate constants for all processes for each particle in the system. Each process is computed once for all the species (RC_vectorized.py) and the values are assigned to the particles and stored in the RateConstantTable of the model (model.rate_constants)."""
+    values = rate_constants_arrays(model)
+    for i, particle in enumerate(model.system_particle_object_list):
+        particle.RateConstants = {
+            "k_" + p: values[p][i] for p in particle.Pcompartment.processess
+        }
+    model.rate_constants = RateConstantTable.from_particles(
+        model.system_particle_object_list
+    )
+
+    return model
+
+
+def generate_rate_constants_per_particle(model):
+    """Generates rate constants for all processes for each particle in the system, calling the functions of RC_generator.py particle by particle."""
     for particle in model.system_particle_object_list:
         particle.RateConstants = dict.fromkeys(
             ["k_" + p for p in particle.Pcompartment.processess]
@@ -12,5 +28,8 @@ def generate_rate_constants(model):
             particle.RateConstants[process] = getattr(RC_generator, proc)(
                 particle, model
             )
+    model.rate_constants = RateConstantTable.from_particles(
+        model.system_particle_object_list
+    )
 
     return model
@@ -0,0 +1,115 @@
+"""Columnar store of the rate constants of all the species of the system"""
+
+import numpy as np
+
+
+class RateConstantTable:
+    """Rate constants of all the species of the system in one dense array of shape (species, process, recieving target). Processes with a single rate constant use the first target; processes given as lists (fragmentation to each size bin, dry and wet deposition to each surface compartment, mixing of the Ocean Mixed Water and runoff transport) use one target per element of the list. Undefined entries are zero.
+
+    Attributes
+    ----------
+    processes : list of the process names ("k_" + process) of the system
+    process_index : dictionary {process: index} of the process axis
+    values : float array (species, process, target) of the rate constants (1/s)
+    widths : int array (species, process) with the number of elements of the processes given as lists, 0 for single values and -1 for the processes that the species does not have
+    species_processes : list with the indexes of the processes of each species, in the order of its rate constants dictionary
+    """
+
+    def __init__(self, processes, values, widths, species_processes):
+        self.processes = list(processes)
+        self.process_index = {p: j for j, p in enumerate(self.processes)}
+        self.values = values
+        self.widths = widths
+        self.species_processes = species_processes
+
+    @classmethod
+    def from_rate_constants(cls, rate_constants):
+        """Table from a list with the rate constants dictionary of each species (values can be numbers, None, lists or tuples as returned by the functions of RC_generator.py)."""
+        processes = []
+        for rc in rate_constants:
+            processes += [p for p in rc if p not in processes]
+        process_index = {p: j for j, p in enumerate(processes)}
+
+        entries = []
+        n_targets = 1
+        for rc in rate_constants:
+            species_entries = []
+            for process, rate in rc.items():
+                if rate is None:
+                    rate = 0
+                if process == "k_fragmentation" and type(rate) is tuple:
+                    rate = rate[0]
+                if isinstance(rate, (list, tuple, np.ndarray)):
+                    rate = [float(r) for r in rate]
+                    n_targets = max(n_targets, len(rate))
+                species_entries.append((process_index[process], rate))
+            entries.append(species_entries)
+
+        values = np.zeros((len(rate_constants), len(processes), n_targets))
+        widths = np.full((len(rate_constants), len(processes)), -1)
+        for i, species_entries in enumerate(entries):
+            for j, rate in species_entries:
+                if isinstance(rate, list):
+                    values[i, j, : len(rate)] = rate
+                    widths[i, j] = len(rate)
+                else:
+                    values[i, j, 0] = rate
+                    widths[i, j] = 0
+
+        return cls(processes, values, widths, [[j for j, r in e] for e in entries])
+
+    @classmethod
+    def from_particles(cls, system_particle_object_list):
+        """Table from the RateConstants dictionaries of the particles."""
+        return cls.from_rate_constants(
+            [p.RateConstants for p in system_particle_object_list]
+        )
+
+    def entries(self, i):
+        """Rate constants of species i: list of tuples (process, list of rate constants, True if the process is given as a list)."""
+        return [
+            (
+                self.processes[j],
+                self.values[i, j, : max(self.widths[i, j], 1)].tolist(),
+                self.widths[i, j] > 0,
+            )
+            for j in self.species_processes[i]
+        ]
+
+    def rate_constants(self, i, scale=1):
+        """Rate constants dictionary of species i (lists for the processes given as lists), optionally multiplied by scale (i.e. the mass of the species to get its output flows)."""
+        return {
+            process: [k * scale for k in rates] if is_list else rates[0] * scale
+            for process, rates, is_list in self.entries(i)
+        }
+
+    def rate(self, i, process, position=0):
+        """Rate constant of species i for a process (element position of the processes given as lists)."""
+        return float(self.values[i, self.process_index[process], position])
+
+    def column(self, process, position=0):
+        """Array with the rate constant of a process for all the species (zero for the species that do not have it)."""
+        if process not in self.process_index:
+            return np.zeros(len(self.values))
+        return self.values[:, self.process_index[process], position]
+
+    def total(self, processes=None):
+        """Array with the sum of the rate constants of all the targets of the given processes (default all the processes of each species) for each species. The sums are sequential (cumulative sums) in the order of the processes of each species, so they are equal to summing its rate constants dictionary."""
+        target_sums = np.cumsum(self.values, axis=2)[:, :, -1]
+        if processes is None:
+            # Processes of each species first (in the order of its dictionary), followed by the ones it does not have (zeros)
+            order = np.array(
+                [
+                    sp + [j for j in range(len(self.processes)) if j not in sp]
+                    for sp in self.species_processes
+                ]
+            )
+            target_sums = np.take_along_axis(target_sums, order, axis=1)
+        else:
+            columns = [
+                self.process_index[p] for p in processes if p in self.process_index
+            ]
+            target_sums = target_sums[:, columns]
+        if target_sums.shape[1] == 0:
+            return np.zeros(len(self.values))
+        return np.cumsum(target_sums, axis=1)[:, -1]
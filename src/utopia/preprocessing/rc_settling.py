@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 def calculate_settling_velocity(particle, d_p, rho_p, rho_f, mu, g=9.81):
@@ -165,3 +166,161 @@ def calculate_rising_velocity(particle, d_p, rho_p, rho_f, mu, g=9.81):
 
     else:
         raise ValueError("Unsupported particle shape: {}".format(particle.Pshape))
+
+
+def calculate_settling_velocity_arrays(
+    shape, d_p, rho_p, rho_f, mu, g=9.81, max_iterations=10, rtol=1e-12
+):
+    """
+    Estimates the settling velocities of a population of particles in water, with the same equations as calculate_settling_velocity for arrays of particle and fluid properties (broadcast together).
+    The drag coefficient iteration of the intermediate regime is done for all the particles at once, each particle is updated until its velocity converges (relative change below rtol) or max_iterations is reached.
+
+    Parameters:
+    shape : Particle shapes ("sphere" or fiber like shapes)
+    d_p   : Particle equivalent diameters (m)
+    rho_p : Particle densities (kg/m³)
+    rho_f : Fluid densities (kg/m³)
+    mu    : Dynamic viscosities of the fluid (Pa·s or kg/(m·s))
+    g     : Gravitational acceleration (m/s²) (default: 9.81 m/s²)
+    max_iterations : Maximum number of iterations of the drag coefficient (default: 10 as in calculate_settling_velocity)
+    rtol  : Relative tolerance of the velocity for the convergence of each particle
+
+    Returns:
+    v_s   : Settling velocities (m/s), negative for rising particles
+    regime: Flow regime used for each particle ("Stokes", "Intermediate" or "Newton")
+    Re    : Reynolds numbers of the particles at their settling velocity
+    """
+    shape, d_p, rho_p, rho_f, mu = np.broadcast_arrays(
+        np.asarray(shape),
+        np.asarray(d_p, dtype=float),
+        np.asarray(rho_p, dtype=float),
+        np.asarray(rho_f, dtype=float),
+        np.asarray(mu, dtype=float),
+    )
+    sphere = shape == "sphere"
+    # Limit of the Stokes regime and drag coefficient of the Newton regime for spheres and fibers (ref. DOI: 10.1016/j.envres.2023.115783)
+    Re_limit = np.where(sphere, 0.1, 1)
+    Cd_newton = np.where(sphere, 0.44, 0.86)
+
+    # Stokes' Law
+    v_s_stokes = g * (1 / 18) * ((rho_p - rho_f) / mu) * (d_p**2)
+    Re_stokes = (rho_f * v_s_stokes * d_p) / mu
+    stokes = Re_stokes < Re_limit
+
+    # Intermediate regime, iterative approach since Cd depends on Re
+    v_s = v_s_stokes.copy()
+    Re = Re_stokes.copy()
+    active = np.flatnonzero(~stokes)
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+        Re[active] = (rho_f[active] * v_s[active] * d_p[active]) / mu[active]
+        Re_a = Re[active]
+        Cd = np.where(
+            sphere[active],
+            np.maximum((24 / Re_a) * (1 + 0.15 * Re_a**0.687), 0.44),
+            np.maximum(19 * (Re_a ** (-0.6)), 0.86),
+        )
+        v_new = np.sqrt(
+            (4 * g * d_p[active] * (rho_p[active] - rho_f[active]))
+            / (3 * Cd * rho_f[active])
+        )
+        converged = np.abs(v_new - v_s[active]) <= rtol * v_new
+        v_s[active] = v_new
+        active = active[~converged]
+
+    intermediate = ~stokes & (Re >= Re_limit) & (Re < 1000)
+    newton = ~stokes & ~intermediate
+
+    # Newton's Law
+    v_s[newton] = np.sqrt(
+        (4 * g * d_p[newton] * (rho_p[newton] - rho_f[newton]))
+        / (3 * Cd_newton[newton] * rho_f[newton])
+    )
+
+    regime = np.where(
+        stokes, "Stokes", np.where(intermediate, "Intermediate", "Newton")
+    )
+    return v_s, regime, (rho_f * v_s * d_p) / mu
+
+
+def calculate_rising_velocity_arrays(
+    shape, d_p, rho_p, rho_f, mu, g=9.81, max_iterations=10, rtol=1e-12
+):
+    """
+    Estimates the rising velocities of a population of particles in water (positive for particles lighter than the fluid), as calculate_rising_velocity for arrays of particle and fluid properties. See calculate_settling_velocity_arrays for the parameters.
+
+    Returns:
+    v_r   : Rising velocities (m/s), negative for settling particles
+    regime: Flow regime used for each particle ("Stokes", "Intermediate" or "Newton")
+    Re    : Reynolds numbers of the particles at their settling velocity
+    """
+    v_s, regime, Re = calculate_settling_velocity_arrays(
+        shape, d_p, rho_p, rho_f, mu, g, max_iterations, rtol
+    )
+    return -v_s, regime, Re
+
+
+class HydrodynamicsCache:
+    """
+    Cache of the settling velocities of the particles in water, keyed on (shape, d_p, rho_p, rho_f, mu), shared by the rate constants of settling, rising, heteroaggregation, heteroaggregate breakup and burial (the SPM velocity only depends on the fluid density so it is computed once per water type).
+    Velocities that are not in the cache are computed with calculate_settling_velocity_arrays. The cache is cleared when the physical inputs of the model change (see check_inputs).
+    """
+
+    def __init__(self, g=9.81):
+        self.g = g
+        self.velocities = {}
+        self.hits = 0
+        self.misses = 0
+        self.inputs_hash = None
+
+    @staticmethod
+    def key(shape, d_p, rho_p, rho_f, mu):
+        return (str(shape), float(d_p), float(rho_p), float(rho_f), float(mu))
+
+    def settling_velocity(self, shape, d_p, rho_p, rho_f, mu):
+        """Settling velocity (m/s) of one particle, negative for rising particles."""
+        return float(
+            self.settling_velocities([shape], [d_p], [rho_p], [rho_f], [mu])[0]
+        )
+
+    def settling_velocities(self, shape, d_p, rho_p, rho_f, mu):
+        """Settling velocities (m/s) of arrays of particles (broadcast together). All the velocities missing from the cache are computed in one call of calculate_settling_velocity_arrays."""
+        arrays = np.broadcast_arrays(
+            np.asarray(shape),
+            np.asarray(d_p, dtype=float),
+            np.asarray(rho_p, dtype=float),
+            np.asarray(rho_f, dtype=float),
+            np.asarray(mu, dtype=float),
+        )
+        keys = [self.key(*k) for k in zip(*(a.ravel().tolist() for a in arrays))]
+        missing = list(dict.fromkeys(k for k in keys if k not in self.velocities))
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        if missing:
+            v_s, regime, Re = calculate_settling_velocity_arrays(
+                *(np.array(values) for values in zip(*missing)), g=self.g
+            )
+            self.velocities.update(zip(missing, v_s.tolist()))
+        return np.array([self.velocities[k] for k in keys]).reshape(arrays[0].shape)
+
+    def stats(self):
+        """Number of hits and misses of the cache since it was last cleared, hit rate and number of cached velocities."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.velocities),
+        }
+
+    def clear(self):
+        self.velocities = {}
+        self.hits = 0
+        self.misses = 0
+
+    def check_inputs(self, inputs_hash):
+        """Clears the cache when the hash of the physical inputs of the model differs from the one of the cached velocities."""
+        if inputs_hash != self.inputs_hash:
+            self.clear()
+            self.inputs_hash = inputs_hash
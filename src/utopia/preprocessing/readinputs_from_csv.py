@@ -1,6 +1,7 @@
 # reads inputs from csv files and instantiates compartments and sets interactions between them
 
 import csv
+import string
 import pandas as pd
 import numpy as np
 from utopia.preprocessing.objects_generation import *
@@ -179,7 +180,10 @@ def generate_particles_from_df(particles_df):
 def generate_system_species_list(
     system_particle_object_list, MPforms_list, compartmentNames_list, boxNames_list
 ):
-    particle_sizes_coding = {"mp1": "a", "mp2": "b", "mp3": "c", "mp4": "d", "mp5": "e"}
+    # Size bins mp1, mp2, ... are coded a, b, ... (smallest first)
+    particle_sizes_coding = {
+        "mp" + str(i + 1): code for i, code in enumerate(string.ascii_lowercase)
+    }
 
     particle_forms_coding = dict(zip(MPforms_list, ["A", "B", "C", "D"]))
 
@@ -190,7 +194,7 @@ def generate_system_species_list(
     def particle_nameCoding(particle, boxNames_list):
         # if len(boxNames_list) != 1:
 
-        particle_sizeCode = particle_sizes_coding[particle.Pname[0:3]]
+        particle_sizeCode = particle_sizes_coding[particle.Pname.split("_")[0]]
         particle_formCode = particle_forms_coding[particle.Pform]
         particle_compartmentCode = particle_compartmentCoding[
             particle.Pcompartment.Cname
@@ -135,23 +135,23 @@ def Exposure_indicators_calculation(model):
 
     # NOTE! When the mass is only present in one size fraction then the Pov has to be equal to the overall Pov and mas and number Pov should be the same
 
-    size_list = ["a", "b", "c", "d", "e"]
+    # Output flows of each species from the table of rate constants of the model and the steady state masses (fragmentation flows summed over all the recieving size bins)
+    rate_constants = model.model.rate_constants
+    particles = model.model.system_particle_object_list
+    mass_g_SS = np.array([p.Pmass_g_SS for p in particles])
+    species_size = np.array([p.Pcode[0] for p in particles])
+    species_comp = np.array([p.Pcompartment.Cname for p in particles])
+    in_boundaries = ~np.isin(species_comp, comp_outBoundares)
+    k_discorporation_fragmentation = rate_constants.total(
+        ["k_fragmentation", "k_discorporation"]
+    )
+
+    size_list = list(model.model.size_dict.keys())
     Pov_size_dict_years = {}
     for size in size_list:
-        discorporation_fargmentation_flows = []
-        for k in model.tables_outputFlows_mass:
-            if k != "Ocean_Column_Water" and k != "Sediment_Ocean":
-                outputFlow_df = model.tables_outputFlows_mass[k]
-                sliced_df = outputFlow_df[outputFlow_df.index.str[0] == size]
-                discorporation_fargmentation_flows.append(
-                    sum(
-                        [
-                            ele if type(ele) != list else sum(ele)
-                            for ele in sliced_df.k_fragmentation
-                        ]
-                    )
-                    + sum(sliced_df.k_discorporation)
-                )
+        discorporation_fargmentation_flows = (
+            k_discorporation_fragmentation * mass_g_SS
+        )[in_boundaries & (species_size == size)]
 
         mass_sizeFraction = sum(
             Results_extended_EI[Results_extended_EI.index.str[0] == size].mass_g
@@ -206,19 +206,20 @@ def Exposure_indicators_calculation(model):
             flow_mix_up_number = []
             flow_rising_mass = []
             flow_rising_number = []
-            for p in model.model.system_particle_object_list:
+            rate_constants = model.model.rate_constants
+            for i, p in enumerate(model.model.system_particle_object_list):
                 if p.Pcompartment.Cname == "Ocean_Mixed_Water":
-                    flow_mix_down_mass.append(
-                        p.RateConstants["k_mixing"][1] * p.Pmass_g_SS
-                    )
-                    flow_mix_down_number.append(
-                        p.RateConstants["k_mixing"][1] * p.Pnum_SS
-                    )
+                    # Mixing down is the second rate constant of the Ocean Mixed Water
+                    k_mix_down = rate_constants.rate(i, "k_mixing", 1)
+                    flow_mix_down_mass.append(k_mix_down * p.Pmass_g_SS)
+                    flow_mix_down_number.append(k_mix_down * p.Pnum_SS)
                 elif p.Pcompartment.Cname == "Ocean_Column_Water":
-                    flow_mix_up_mass.append(p.RateConstants["k_mixing"] * p.Pmass_g_SS)
-                    flow_mix_up_number.append(p.RateConstants["k_mixing"] * p.Pnum_SS)
-                    flow_rising_mass.append(p.RateConstants["k_rising"] * p.Pmass_g_SS)
-                    flow_rising_number.append(p.RateConstants["k_rising"] * p.Pnum_SS)
+                    k_mix_up = rate_constants.rate(i, "k_mixing")
+                    k_rising = rate_constants.rate(i, "k_rising")
+                    flow_mix_up_mass.append(k_mix_up * p.Pmass_g_SS)
+                    flow_mix_up_number.append(k_mix_up * p.Pnum_SS)
+                    flow_rising_mass.append(k_rising * p.Pmass_g_SS)
+                    flow_rising_number.append(k_rising * p.Pnum_SS)
 
             systemloss_flows_mass.append(
                 sum(model.tables_outputFlows_mass[k].k_discorporation)
@@ -287,11 +288,7 @@ def Exposure_indicators_calculation(model):
             )
             / (
                 direct_emiss
-                + sum(
-                    sum(val) if isinstance(val, (list, np.ndarray)) else val
-                    for x in model.tables_outputFlows_mass[c].columns
-                    for val in model.tables_outputFlows_mass[c][x]
-                )
+                + sum((rate_constants.total() * mass_g_SS)[species_comp == c])
             )
             / 60
             / 60
@@ -324,6 +321,31 @@ def Exposure_indicators_calculation(model):
 
     # Overall residence time specific to each size class (mass and number independent):
 
+    # System loss rate constants of each species: fragmentation and discorporation plus the losses through the system boundaries (sequestration in deep soils, burial in freshwater and coast sediments and the net flow from the Ocean Mixed Water to the deep ocean, where mixing up and rising from the Ocean Column Water are substracted)
+    systemloss_rate_size = np.select(
+        [
+            np.isin(
+                species_comp, ["Beaches_Deep_Soil", "Background_Soil", "Impacted_Soil"]
+            ),
+            np.isin(species_comp, ["Sediment_Freshwater", "Sediment_Coast"]),
+            species_comp == "Ocean_Mixed_Water",
+            species_comp == "Ocean_Column_Water",
+            species_comp == "Sediment_Ocean",
+        ],
+        [
+            k_discorporation_fragmentation
+            + rate_constants.total(["k_sequestration_deep_soils"]),
+            k_discorporation_fragmentation + rate_constants.total(["k_burial"]),
+            # Mixing down is the second rate constant of the Ocean Mixed Water
+            k_discorporation_fragmentation
+            + rate_constants.total(["k_settling"])
+            + rate_constants.column("k_mixing", 1),
+            -rate_constants.total(["k_mixing", "k_rising"]),
+            0,
+        ],
+        default=k_discorporation_fragmentation,
+    )
+
     Tov_size_dict_years = {}
     for size in size_list:
 
@@ -335,78 +357,7 @@ def Exposure_indicators_calculation(model):
             Tov_size_dict_years[model.model.size_dict[size]] = "NaN"
             continue
 
-        systemloss_flows_size = []
-        for k in model.tables_outputFlows_mass:
-            outputFlow_df = model.tables_outputFlows_mass[k]
-            sliced_df = outputFlow_df[outputFlow_df.index.str[0] == size]
-            if k in ["Beaches_Deep_Soil", "Background_Soil", "Impacted_Soil"]:
-                systemloss_flows_size.append(
-                    sum(
-                        [
-                            ele if type(ele) != list else sum(ele)
-                            for ele in sliced_df.k_fragmentation
-                        ]
-                    )
-                    + sum(sliced_df.k_discorporation)
-                    + sum(sliced_df.k_sequestration_deep_soils)
-                )
-            elif k in ["Sediment_Freshwater", "Sediment_Coast"]:
-                systemloss_flows_size.append(
-                    sum(
-                        [
-                            ele if type(ele) != list else sum(ele)
-                            for ele in sliced_df.k_fragmentation
-                        ]
-                    )
-                    + sum(sliced_df.k_discorporation)
-                    + sum(sliced_df.k_burial)
-                )
-            elif k == "Ocean_Mixed_Water":
-                # Calculate net flow lossess from the Ocean Midex water compartment through deep ocean
-                flow_mix_down = []
-                flow_mix_up = []
-                flow_rising = []
-                for p in model.model.system_particle_object_list:
-                    if p.Pcode[0] == size:
-                        if p.Pcompartment.Cname == "Ocean_Mixed_Water":
-                            flow_mix_down.append(
-                                p.RateConstants["k_mixing"][1] * p.Pmass_g_SS
-                            )
-                        elif p.Pcompartment.Cname == "Ocean_Column_Water":
-                            flow_mix_up.append(
-                                p.RateConstants["k_mixing"] * p.Pmass_g_SS
-                            )
-                            flow_rising.append(
-                                p.RateConstants["k_rising"] * p.Pmass_g_SS
-                            )
-
-                systemloss_flows_size.append(
-                    sum(
-                        [
-                            ele if type(ele) != list else sum(ele)
-                            for ele in sliced_df.k_fragmentation
-                        ]
-                    )
-                    + sum(sliced_df.k_discorporation)
-                    + sum(sliced_df.k_settling)
-                    + sum(flow_mix_down)
-                    - sum(flow_mix_up)
-                    - sum(flow_rising)
-                )
-
-            elif k != "Ocean_Column_Water" and k != "Sediment_Ocean":
-                systemloss_flows_size.append(
-                    sum(
-                        [
-                            ele if type(ele) != list else sum(ele)
-                            for ele in sliced_df.k_fragmentation
-                        ]
-                    )
-                    + sum(sliced_df.k_discorporation)
-                )
-
-            else:
-                pass
+        systemloss_flows_size = (systemloss_rate_size * mass_g_SS)[species_size == size]
 
         Tov_size_sec = mass_sizeFraction / sum(systemloss_flows_size)
         Tov_size_days = Tov_size_sec / 86400
@@ -1,38 +1,20 @@
 """Functions to check the mass balance of the model"""
 
+import numpy as np
+
 
 def massBalance(model):
     # Estimate looses: loss processess=[discorporation, burial]
     # Lossess also from fragmentation of the smallest size bin
     # k_soil_convection is only a loss process when coming from the deeper soil compartments and I need to take the second value of the list.,"k_soil_convection"
     loss_processess = ["k_discorporation", "k_burial", "k_sequestration_deep_soils"]
-    elimination_rates = []
-
-    # Estimate outflows
-
-    for p in model.system_particle_object_list:
-
-        if p.Pcode[0] == "a":
-            elimination_rates.append(
-                sum(
-                    [
-                        p.RateConstants[e]
-                        for e in loss_processess
-                        if e in p.RateConstants
-                    ]
-                )
-                + sum(p.RateConstants["k_fragmentation"])
-            )
-        else:
-            elimination_rates.append(
-                sum(
-                    [
-                        p.RateConstants[e]
-                        for e in loss_processess
-                        if e in p.RateConstants
-                    ]
-                )
-            )
+
+    # Estimate outflows (fragmentation of the smallest size bin "a" is also a loss)
+    rate_constants = model.rate_constants
+    smallest = np.array([p.Pcode[0] == "a" for p in model.system_particle_object_list])
+    elimination_rates = rate_constants.total(loss_processess) + np.where(
+        smallest, rate_constants.total(["k_fragmentation"]), 0
+    )
     # mass at Steady state
     m_ss = model.R["mass_g"]
 
@@ -15,7 +15,19 @@ from utopia.results_processing.emission_fractions_calculation import *
 class ResultsProcessor:
     """Provides functionalities for restructuring, analysing and plotting the UTOPIA model results."""
 
+    # Attribute of the model with the results of the runs that are not steady state runs
+    time_results = {"Dynamic": "R_dynamic", "Periodic": "R_periodic"}
+
     def __init__(self, model):
+        # The results processing (flows, exposure indicators and emission fractions) is based on the steady state results (R)
+        if model.solver != "SteadyState":
+            raise ValueError(
+                "Results can only be processed for steady state runs (solver SteadyState). The results of the "
+                + model.solver
+                + " run are in the "
+                + self.time_results.get(model.solver, "R")
+                + " attribute of the model"
+            )
         self.processed_results = {}  # empty dictionary to store results
         self.model = model
         self.R = model.R
@@ -82,9 +94,10 @@ class ResultsProcessor:
         for p in self.model.system_particle_object_list:
             inflows_p_mass = []
             inflows_p_num = []
-            emission_rate_g_s = self.model.emiss_dict_g_s[p.Pcompartment.Cname][
-                p.Pcode[0]
-            ]
+            # Size bins without an entry in the emissions dictionary are not emitted
+            emission_rate_g_s = self.model.emiss_dict_g_s[p.Pcompartment.Cname].get(
+                p.Pcode[0], 0
+            )
             emission_rate_num_s = mass_to_num(
                 emission_rate_g_s, p.Pvolume_m3, p.Pdensity_kg_m3
             )
@@ -359,21 +372,11 @@ class ResultsProcessor:
 
         self.surfComp_list = [c for c in self.model.dict_comp if "Surface" in c]
         """Estimate flows corresponding to each mode process based on the model results."""
-        # Outflows ( in mass and particle number)
-        for p in self.model.system_particle_object_list:
-            p.outFlow_mass_g_s = {}
-            p.outFlow_number_g_s = {}
-            for c in p.RateConstants:
-                if type(p.RateConstants[c]) == list:
-                    p.outFlow_mass_g_s[c] = [
-                        R * p.Pmass_g_SS for R in p.RateConstants[c]
-                    ]
-                    p.outFlow_number_g_s[c] = [
-                        R * p.Pnum_SS for R in p.RateConstants[c]
-                    ]
-                else:
-                    p.outFlow_mass_g_s[c] = p.RateConstants[c] * p.Pmass_g_SS
-                    p.outFlow_number_g_s[c] = p.RateConstants[c] * p.Pnum_SS
+        # Outflows ( in mass and particle number) from the table of rate constants of the model
+        rate_constants = self.model.rate_constants
+        for i, p in enumerate(self.model.system_particle_object_list):
+            p.outFlow_mass_g_s = rate_constants.rate_constants(i, p.Pmass_g_SS)
+            p.outFlow_number_g_s = rate_constants.rate_constants(i, p.Pnum_SS)
 
         # Tables of output flows per compartmet
         tables_outputFlows_mass = {}
@@ -0,0 +1,496 @@
+# This file contains the functions that solve the time dependent (dynamic) ODEs for the system of particles: dM/dt = A·M + E(t), where A is the matrix of interactions and E the emissions
+
+from utopia.solver_steady_state import emission_vector
+from utopia.preprocessing.fill_interactions_df import interactions_update
+import pandas as pd
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy import sparse
+from scipy.linalg import expm
+from scipy.sparse.linalg import eigs, splu, gmres, LinearOperator
+
+
+def emission_schedule_segments(model, emission_schedule, t_end_s):
+    """Converts an emission schedule into a list of (t_start_s, t_end_s, emissions vector) segments of constant emissions covering the simulation time from 0 to t_end_s.
+
+    emission_schedule can be:
+    - None: constant emissions from model.emiss_dict_g_s
+    - list of (t_start_s, emissions) pairs where emissions is an emissions dictionary (same structure as model.emiss_dict_g_s) or a vector of emissions per species (g/s). Each emission applies from its start time until the start of the next one (no emissions before the first start time)
+    """
+    if emission_schedule is None:
+        emission_schedule = [(0, model.emiss_dict_g_s)]
+
+    steps = sorted(emission_schedule, key=lambda step: step[0])
+    segments = []
+    if steps[0][0] > 0:
+        segments.append(
+            (0, min(steps[0][0], t_end_s), np.zeros(len(model.SpeciesList)))
+        )
+    for i, (t_start_s, emissions) in enumerate(steps):
+        if i + 1 < len(steps):
+            t_stop_s = steps[i + 1][0]
+        else:
+            t_stop_s = t_end_s
+        t_start_s = max(t_start_s, 0)
+        if t_stop_s <= t_start_s or t_start_s >= t_end_s:
+            continue
+        segments.append(
+            (t_start_s, min(t_stop_s, t_end_s), emissions_to_vector(model, emissions))
+        )
+
+    return segments
+
+
+def emissions_to_vector(model, emissions):
+    """Returns the vector of emissions per species (g/s) for an emissions dictionary or vector."""
+    if isinstance(emissions, dict):
+        return emission_vector(model, emissions)
+    q_mass_g_s = np.asarray(emissions, dtype=float)
+    if q_mass_g_s.shape != (len(model.SpeciesList),):
+        raise ValueError(
+            "Emissions vector must have one value per species ("
+            + str(len(model.SpeciesList))
+            + ")"
+        )
+    return q_mass_g_s
+
+
+def solver_dynamic(
+    model,
+    output_times_s,
+    emission_schedule=None,
+    initial_mass_g=None,
+    method="BDF",
+    rtol=1e-6,
+    atol=1e-12,
+):
+    """Integrates the mass of all species in time with a stiff implicit method (BDF or Radau) using the sparse matrix of interactions as analytic Jacobian.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+    output_times_s : times (s) at which the mass of the species is returned
+    emission_schedule : None (constant emissions from model.emiss_dict_g_s), list of (t_start_s, emissions) pairs of piecewise constant emissions (see emission_schedule_segments) or smooth function of time returning an emissions dictionary or vector of emissions per species (g/s). Step changes of emissions should be given as list so that the integrator is restarted at each change
+    initial_mass_g : vector of mass per species at time 0 (default all zeros)
+    method : "BDF" or "Radau"
+    rtol, atol : relative and absolute (g) tolerances of the integrator
+
+    Returns
+    -------
+    Dataframe of mass (g) per species (rows) at each output time (columns)
+    """
+    if method not in ["BDF", "Radau"]:
+        raise ValueError("Only the stiff methods BDF and Radau are supported")
+
+    output_times_s = np.asarray(output_times_s, dtype=float)
+    if np.any(output_times_s < 0) or np.any(np.diff(output_times_s) < 0):
+        raise ValueError("Output times must be positive and sorted")
+
+    A = model.interactions_matrix.tocsc()
+    n_species = A.shape[0]
+    if initial_mass_g is None:
+        m_t = np.zeros(n_species)
+    else:
+        m_t = np.asarray(initial_mass_g, dtype=float)
+
+    t_end_s = output_times_s[-1]
+
+    if callable(emission_schedule):
+        # Emissions given as function of time: single integration over the whole time span
+        def dMdt(t, m):
+            return A @ m + emissions_to_vector(model, emission_schedule(t))
+
+        segments = [(0, t_end_s, dMdt)]
+    else:
+        segments = []
+        for t_start_s, t_stop_s, q_mass_g_s in emission_schedule_segments(
+            model, emission_schedule, t_end_s
+        ):
+            segments.append((t_start_s, t_stop_s, lambda t, m, q=q_mass_g_s: A @ m + q))
+
+    masses = np.zeros((n_species, len(output_times_s)))
+    masses[:, output_times_s == 0] = m_t[:, None]
+
+    # Each segment of constant emissions is integrated separately so that the integrator does not step over the emission changes
+    for t_start_s, t_stop_s, dMdt in segments:
+        if t_stop_s <= t_start_s:
+            continue
+        in_segment = (output_times_s > t_start_s) & (output_times_s <= t_stop_s)
+        t_eval = np.append(output_times_s[in_segment], t_stop_s)
+
+        sol = solve_ivp(
+            dMdt,
+            (t_start_s, t_stop_s),
+            m_t,
+            method=method,
+            t_eval=np.unique(t_eval),
+            jac=A,
+            rtol=rtol,
+            atol=atol,
+        )
+        if not sol.success:
+            raise RuntimeError("Dynamic solver failed: " + sol.message)
+
+        masses[:, in_segment] = sol.y[
+            :, np.searchsorted(sol.t, output_times_s[in_segment])
+        ]
+        m_t = sol.y[:, -1]
+
+    return pd.DataFrame(masses, index=model.SpeciesList, columns=output_times_s)
+
+
+def interactions_eigendecomposition(model):
+    """Eigendecomposition of the matrix of interactions (A = V·diag(w)·V⁻¹). It is computed once per built system and kept on the model (interactions_eig attribute, keyed by the system hash)."""
+    cached = getattr(model, "interactions_eig", None)
+    if cached is not None and cached[0] == model.system_hash:
+        return cached[1:]
+
+    w, V = np.linalg.eig(model.interactions_matrix.toarray())
+    V_inv = np.linalg.inv(V)
+    model.interactions_eig = (model.system_hash, w, V, V_inv)
+
+    return w, V, V_inv
+
+
+def slowest_modes(model, n_modes=5, n_dominant=3):
+    """Slowest eigenmodes of the matrix of interactions, which set the time needed to reach the steady state: after a change of the emissions each mode decays as exp(-t/tau), with tau = -1/Re(eigenvalue) its e-folding time. The slowest modes are found with the ARPACK sparse eigensolver in shift-invert mode around 0, re-using the factorized matrix of interactions (no dense eigendecomposition of the whole system).
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    n_modes : number of slowest modes
+    n_dominant : number of species reported as dominant for each mode
+
+    Returns
+    -------
+    Dataframe with one row per mode (slowest first) with the columns eigenvalue_1_s, e_folding_time_s, e_folding_time_years, time_to_99_percent_years (time for the mode to decay to 1%, ln(100)·tau), dominant_species (species with the largest share of the eigenvector) and dominant_share (their share of the squared eigenvector norm)
+    """
+    cached = getattr(model, "interactions_modes", None)
+    if cached is not None and cached[:2] == (model.system_hash, n_modes):
+        w, V = cached[2:]
+    else:
+        # Shift-invert around 0: the largest eigenvalues of A^-1 are the slowest modes of A
+        inverse = LinearOperator(
+            model.interactions_matrix.shape,
+            matvec=lambda x: model.interactions_lu.solve(np.asarray(x, float).ravel()),
+            dtype=float,
+        )
+        w, V = eigs(
+            model.interactions_matrix, k=n_modes, sigma=0, OPinv=inverse, which="LM"
+        )
+        order = np.argsort(np.abs(w.real))
+        w, V = w[order], V[:, order]
+        model.interactions_modes = (model.system_hash, n_modes, w, V)
+
+    year_s = 365 * 24 * 60 * 60
+    tau_s = -1 / w.real
+    share = np.abs(V) ** 2 / (np.abs(V) ** 2).sum(axis=0)
+    dominant = np.argsort(-share, axis=0)[:n_dominant]
+
+    return pd.DataFrame(
+        {
+            "eigenvalue_1_s": w.real,
+            "e_folding_time_s": tau_s,
+            "e_folding_time_years": tau_s / year_s,
+            "time_to_99_percent_years": np.log(100) * tau_s / year_s,
+            "dominant_species": [
+                [model.SpeciesList[i] for i in dominant[:, m]] for m in range(len(w))
+            ],
+            "dominant_share": [list(share[dominant[:, m], m]) for m in range(len(w))],
+        },
+        index=pd.Index(range(len(w)), name="mode"),
+    )
+
+
+def solver_closed_form(
+    model, output_times_s, emission_schedule=None, initial_mass_g=None
+):
+    """Evaluates the mass of all species in time for piecewise constant emissions without stepping an integrator.
+
+    Within each segment of constant emissions E the solution is M(t) = M_ss + V·exp(w·(t - t_start))·V⁻¹·(M(t_start) - M_ss), where M_ss = -A⁻¹·E is the steady state of the segment (from the factorized matrix of interactions) and w, V the eigenvalues and eigenvectors of A. All output times of a segment are evaluated at once.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+    output_times_s : times (s) at which the mass of the species is returned
+    emission_schedule : None (constant emissions from model.emiss_dict_g_s) or list of (t_start_s, emissions) pairs of piecewise constant emissions (see emission_schedule_segments)
+    initial_mass_g : vector of mass per species at time 0 (default all zeros)
+
+    Returns
+    -------
+    Dataframe of mass (g) per species (rows) at each output time (columns)
+    """
+    if callable(emission_schedule):
+        raise ValueError(
+            "The closed form solution requires piecewise constant emissions"
+        )
+
+    output_times_s = np.asarray(output_times_s, dtype=float)
+    if np.any(output_times_s < 0) or np.any(np.diff(output_times_s) < 0):
+        raise ValueError("Output times must be positive and sorted")
+
+    w, V, V_inv = interactions_eigendecomposition(model)
+
+    n_species = len(model.SpeciesList)
+    if initial_mass_g is None:
+        m_t = np.zeros(n_species)
+    else:
+        m_t = np.asarray(initial_mass_g, dtype=float)
+
+    masses = np.zeros((n_species, len(output_times_s)))
+    masses[:, output_times_s == 0] = m_t[:, None]
+
+    def mass_at(tau_s, m_ss, modes_t0):
+        return (
+            m_ss[:, None] + (V @ (np.exp(np.outer(w, tau_s)) * modes_t0[:, None])).real
+        )
+
+    for t_start_s, t_stop_s, q_mass_g_s in emission_schedule_segments(
+        model, emission_schedule, output_times_s[-1]
+    ):
+        m_ss = model.interactions_lu.solve(-q_mass_g_s)
+        modes_t0 = V_inv @ (m_t - m_ss)
+
+        in_segment = (output_times_s > t_start_s) & (output_times_s <= t_stop_s)
+        masses[:, in_segment] = mass_at(
+            output_times_s[in_segment] - t_start_s, m_ss, modes_t0
+        )
+        m_t = mass_at(np.array([t_stop_s - t_start_s]), m_ss, modes_t0)[:, 0]
+
+    return pd.DataFrame(masses, index=model.SpeciesList, columns=output_times_s)
+
+
+def pulse_vector(model, pulse):
+    """Vector of a pulse emission (g per species). The pulse can be a species code (1 g of that species), a compartment name (1 g of the emitted MP form split equally over the size bins) or an emissions dictionary (same structure as model.emiss_dict_g_s, with the emitted mass in g)."""
+    if isinstance(pulse, dict):
+        return emission_vector(model, pulse)
+    elif pulse in model.SpeciesList:
+        b = np.zeros(len(model.SpeciesList))
+        b[model.SpeciesList.index(pulse)] = 1
+        return b
+    elif pulse in model.particle_compartmentCoding:
+        return emission_vector(
+            model,
+            {pulse: {size: 1 / len(model.size_codes) for size in model.size_codes}},
+        )
+    else:
+        raise ValueError("Unknown species or compartment: " + str(pulse))
+
+
+def krylov_expm_action(matrix, b, times_s, max_dimension=60, tol=1e-10):
+    """Action of the matrix exponential exp(matrix·t)·b for many times with a shift-and-invert Krylov method.
+
+    Polynomial Krylov methods (i.e. scipy expm_multiply) need a number of matrix products that grows with ||matrix||·t, which is prohibitive for the matrix of interactions (fastest rate constants ~1e4 s-1, time horizons of years). Here the Krylov subspace is built with (I - gamma·matrix)^-1 instead, whose convergence does not depend on the norm of the matrix: with the Arnoldi decomposition (I - gamma·matrix)^-1·V = V·H, exp(matrix·t)·b ~ ||b||·V·exp(t·(I - H^-1)/gamma)·e1. One shift gamma serves the times within two orders of magnitude, so the times are grouped in bands of two decades with one sparse LU factorization of (I - gamma·matrix) each.
+
+    Parameters
+    ----------
+    matrix : sparse matrix
+    b : vector
+    times_s : times (s), positive
+    max_dimension : maximum dimension of the Krylov subspace
+    tol : relative tolerance (change of the solution when the subspace grows)
+
+    Returns
+    -------
+    Array (len(b), len(times_s)) with exp(matrix·t)·b for each time
+    """
+    matrix = sparse.csc_matrix(matrix)
+    n = matrix.shape[0]
+    times_s = np.asarray(times_s, dtype=float)
+    result = np.zeros((n, len(times_s)))
+    result[:, times_s == 0] = b[:, None]
+    beta = np.linalg.norm(b)
+    if beta == 0:
+        return result
+
+    positive = times_s > 0
+    bands = np.floor(np.log10(times_s[positive]) / 2)
+    for band in np.unique(bands):
+        in_band = np.flatnonzero(positive)[bands == band]
+        band_times_s = times_s[in_band]
+        gamma = 10 ** (2 * band + 1) / 10
+        lu = splu(sparse.csc_matrix(sparse.identity(n) - gamma * matrix))
+
+        V = np.zeros((n, max_dimension + 1))
+        H = np.zeros((max_dimension + 1, max_dimension))
+        V[:, 0] = b / beta
+        previous = None
+        for j in range(max_dimension):
+            w = lu.solve(V[:, j])
+            # Arnoldi with reorthogonalization
+            for _ in range(2):
+                h = V[:, : j + 1].T @ w
+                w = w - V[:, : j + 1] @ h
+                H[: j + 1, j] += h
+            H[j + 1, j] = np.linalg.norm(w)
+            breakdown = H[j + 1, j] <= 1e-14 * np.abs(H[: j + 1, j]).max()
+            if not breakdown:
+                V[:, j + 1] = w / H[j + 1, j]
+
+            m = j + 1
+            if m % 5 == 0 or breakdown or m == max_dimension:
+                A_m = (np.eye(m) - np.linalg.inv(H[:m, :m])) / gamma
+                # Convergence checked at the first and last times of the band. Small subspaces can have spurious growing modes (overflow): those iterations are just not converged
+                with np.errstate(over="ignore", invalid="ignore"):
+                    check = (
+                        V[:, :m]
+                        @ expm(band_times_s[[0, -1], None, None] * A_m)[:, :, 0].T
+                    )
+                converged = np.isfinite(check).all() and (
+                    breakdown
+                    or (previous is not None and np.abs(check - previous).max() <= tol)
+                )
+                if converged:
+                    break
+                previous = check
+
+        with np.errstate(over="ignore", invalid="ignore"):
+            result[:, in_band] = (
+                beta * V[:, :m] @ expm(band_times_s[:, None, None] * A_m)[:, :, 0].T
+            )
+        if not np.isfinite(result[:, in_band]).all():
+            raise RuntimeError("Krylov matrix exponential did not converge")
+
+    return result
+
+
+def solver_impulse_response(model, pulse, output_times_s, method="krylov"):
+    """Mass of all species in time after a pulse emission at time 0 (no other emissions): M(t) = exp(A·t)·b, evaluated for all output times in one call.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+    pulse : species code, compartment name or emissions dictionary of the pulse (see pulse_vector)
+    output_times_s : times (s) at which the mass of the species is returned
+    method : "krylov" (shift-and-invert Krylov action of the matrix exponential on the sparse matrix of interactions, see krylov_expm_action) or "eigen" (eigendecomposition of the dense matrix of interactions, cached on the model)
+
+    Returns
+    -------
+    Dataframe of mass (g) per species (rows) at each output time (columns)
+    """
+    output_times_s = np.asarray(output_times_s, dtype=float)
+    if np.any(output_times_s < 0) or np.any(np.diff(output_times_s) < 0):
+        raise ValueError("Output times must be positive and sorted")
+    b = pulse_vector(model, pulse)
+
+    if method == "krylov":
+        masses = krylov_expm_action(model.interactions_matrix, b, output_times_s)
+    elif method == "eigen":
+        w, V, V_inv = interactions_eigendecomposition(model)
+        masses = (V @ (np.exp(np.outer(w, output_times_s)) * (V_inv @ b)[:, None])).real
+    else:
+        raise ValueError("Impulse response method must be krylov or eigen")
+
+    return pd.DataFrame(masses, index=model.SpeciesList, columns=output_times_s)
+
+
+def rate_factors_dict(rate_factors):
+    """Returns the rate constant factors as dictionary {(process, compartment name): factor}. Accepts that dictionary or a list of [process, compartment name, factor] triplets (JSON inputs)."""
+    if rate_factors is None:
+        return {}
+    if isinstance(rate_factors, dict):
+        return rate_factors
+    return {(process, comp): factor for process, comp, factor in rate_factors}
+
+
+def solver_periodic(model, period_s, seasons, output_times_s, rtol=1e-9):
+    """Periodic steady state of the system for seasonal emissions and rate constants: the mass of all species over one period once the transients have died out, found directly without integrating over many periods.
+
+    The period is divided in seasons with constant emissions E_k and matrix of interactions A_k. Within a season the mass evolves as M(t) = M_ss,k + exp(A_k·(t - t_k))·(M(t_k) - M_ss,k), with M_ss,k = -A_k^-1·E_k, so the mass after one period is M(T) = Φ·M(0) + c, with Φ the product of the season exponentials and c the mass after one period starting from zero. The periodic initial condition solves the linear system (I - Φ)·M(0) = c, solved with GMRES where each product with Φ is one period of matrix exponential actions (krylov_expm_action). The slowest modes of the system (centuries) make I - Φ close to singular, so the system is preconditioned with the rational approximation I - Φ ≈ -T·Ā·(I - T·Ā)^-1, using the factorized time averaged matrix Ā. This clusters the spectrum close to 1 and GMRES converges in a few iterations.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+    period_s : length of the period (s), i.e. one year
+    seasons : list of seasons, each a dictionary with the keys t_start_s (start of the season within the period, the first season starts at 0), emiss_dict_g_s (emissions dictionary or vector of emissions per species in g/s, default model.emiss_dict_g_s) and rate_factors (factors of the rate constants during the season as {(process, compartment name): factor} or list of [process, compartment name, factor], default none)
+    output_times_s : times within the period (0 to period_s) at which the mass of the species is returned
+    rtol : relative tolerance of the periodic initial condition
+
+    Returns
+    -------
+    Dataframe of mass (g) per species (rows) at each output time (columns)
+    """
+    output_times_s = np.asarray(output_times_s, dtype=float)
+    if np.any(output_times_s < 0) or np.any(output_times_s > period_s):
+        raise ValueError("Output times must be within the period")
+
+    seasons = sorted(seasons, key=lambda season: season["t_start_s"])
+    if seasons[0]["t_start_s"] != 0 or seasons[-1]["t_start_s"] >= period_s:
+        raise ValueError("Seasons must start at 0 and within the period")
+
+    n_species = len(model.SpeciesList)
+    t_starts = [season["t_start_s"] for season in seasons]
+    durations = np.diff(t_starts + [period_s])
+
+    matrices = []
+    steady_states = []
+    for season in seasons:
+        factors = rate_factors_dict(season.get("rate_factors"))
+        emissions = season.get("emiss_dict_g_s", model.emiss_dict_g_s)
+        q_mass_g_s = emissions_to_vector(model, emissions)
+        if factors:
+            matrix = model.interactions_matrix + interactions_update(
+                model.system_particle_object_list,
+                model.dict_comp,
+                factors,
+                model.rate_constants,
+            )
+            steady_states.append(splu(sparse.csc_matrix(matrix)).solve(-q_mass_g_s))
+        else:
+            matrix = model.interactions_matrix
+            steady_states.append(model.interactions_lu.solve(-q_mass_g_s))
+        matrices.append(sparse.csc_matrix(matrix))
+
+    def one_period(m_0, homogeneous):
+        m_t = m_0
+        for matrix, m_ss, duration in zip(matrices, steady_states, durations):
+            if homogeneous:
+                m_t = krylov_expm_action(matrix, m_t, [duration])[:, 0]
+            else:
+                m_t = m_ss + krylov_expm_action(matrix, m_t - m_ss, [duration])[:, 0]
+        return m_t
+
+    c = one_period(np.zeros(n_species), homogeneous=False)
+
+    # Preconditioner from the time averaged matrix of interactions
+    average_lu = splu(
+        sparse.csc_matrix(
+            sum(matrix * duration for matrix, duration in zip(matrices, durations))
+            / period_s
+        )
+    )
+    operator = LinearOperator(
+        (n_species, n_species), matvec=lambda v: v - one_period(v, homogeneous=True)
+    )
+    preconditioner = LinearOperator(
+        (n_species, n_species), matvec=lambda v: v - average_lu.solve(v) / period_s
+    )
+    m_0, info = gmres(
+        operator,
+        c,
+        x0=sum(m_ss * duration for m_ss, duration in zip(steady_states, durations))
+        / period_s,
+        rtol=rtol,
+        atol=0,
+        M=preconditioner,
+    )
+    if info != 0:
+        raise RuntimeError("Periodic steady state solver did not converge")
+
+    # Mass at the output times from the periodic initial condition
+    masses = np.zeros((n_species, len(output_times_s)))
+    m_t = m_0
+    for k, (matrix, m_ss, duration) in enumerate(
+        zip(matrices, steady_states, durations)
+    ):
+        in_season = (output_times_s >= t_starts[k]) & (
+            output_times_s < t_starts[k] + duration
+        )
+        masses[:, in_season] = m_ss[:, None] + krylov_expm_action(
+            matrix, m_t - m_ss, output_times_s[in_season] - t_starts[k]
+        )
+        masses[:, output_times_s == t_starts[k]] = m_t[:, None]
+        m_t = m_ss + krylov_expm_action(matrix, m_t - m_ss, [duration])[:, 0]
+    masses[:, output_times_s == period_s] = m_0[:, None]
+
+    return pd.DataFrame(masses, index=model.SpeciesList, columns=output_times_s)
@@ -0,0 +1,246 @@
+# This file contains the reduced order surrogate of the system of particles (balanced truncation of the matrix of interactions) for fast dynamic runs embedded in larger scenario loops
+
+from utopia.solver_steady_state import emission_vector
+import json
+import numpy as np
+from scipy import linalg
+
+
+class ReducedOrderModel:
+    """Reduced order surrogate of the system of particles: dx/dt = A·x + B·u, y = C·x + D·u, with u the emissions (g/s) of the input species, y the mass (g) of the outputs (compartments or species) and x the reduced states (time in seconds).
+
+    The error_bound attribute bounds the error of the outputs for any input at steady state: ||y - y_full|| ≤ error_bound·||u|| (2-norms). Its balanced truncation part also bounds the L2 norm of the error for time varying emissions starting from zero mass, the rest is the error of the steady state gain of the minimal realization measured against the full system (see balanced_reduction).
+    """
+
+    def __init__(
+        self,
+        A,
+        B,
+        C,
+        D,
+        state_projection,
+        input_species,
+        output_names,
+        hankel_singular_values,
+        error_bound,
+    ):
+        self.A = np.asarray(A, dtype=float)
+        self.B = np.asarray(B, dtype=float)
+        self.C = np.asarray(C, dtype=float)
+        self.D = np.asarray(D, dtype=float)
+        self.state_projection = np.asarray(state_projection, dtype=float)
+        self.input_species = list(input_species)
+        self.output_names = list(output_names)
+        self.hankel_singular_values = np.asarray(hankel_singular_values, dtype=float)
+        self.error_bound = float(error_bound)
+        self.n_states = self.A.shape[0]
+        self.discretizations = {}
+
+    def steady_state(self, u):
+        """Steady state outputs (g) for constant emissions u (g/s) of the input species."""
+        u = np.asarray(u, dtype=float)
+        return -self.C @ np.linalg.solve(self.A, self.B @ u) + self.D @ u
+
+    def reduce_state(self, mass_g):
+        """Reduced state from the mass (g) of all species in the order of SpeciesList, i.e. the initial mass of a dynamic run."""
+        return self.state_projection @ np.asarray(mass_g, dtype=float)
+
+    def discretize(self, dt_s):
+        """Exact discretization of the reduced system for time steps of dt_s seconds with constant emissions during each step: x(t + dt) = Ad·x(t) + Bd·u. The matrices are cached for each time step."""
+        if dt_s not in self.discretizations:
+            n, m = self.B.shape
+            augmented = np.zeros((n + m, n + m))
+            augmented[:n, :n] = self.A * dt_s
+            augmented[:n, n:] = self.B * dt_s
+            propagator = linalg.expm(augmented)
+            self.discretizations[dt_s] = (propagator[:n, :n], propagator[:n, n:])
+        return self.discretizations[dt_s]
+
+    def step(self, x, u, dt_s):
+        """Advances the reduced state x by dt_s seconds with the emissions u (g/s). Returns the new state and its outputs (g)."""
+        Ad, Bd = self.discretize(dt_s)
+        u = np.asarray(u, dtype=float)
+        x = Ad @ x + Bd @ u
+        return x, self.C @ x + self.D @ u
+
+    def simulate(self, inputs, dt_s, x0=None):
+        """Outputs (g) at the end of each time step of dt_s seconds for the emissions (g/s) of each step.
+
+        Parameters
+        ----------
+        inputs : array (steps, input species) of emissions during each time step
+        dt_s : time step (s)
+        x0 : initial reduced state (default zero mass, see reduce_state)
+
+        Returns
+        -------
+        Array (steps, outputs) of the outputs at the end of each time step
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        Ad, Bd = self.discretize(dt_s)
+        x = np.zeros(self.n_states) if x0 is None else np.asarray(x0, dtype=float)
+        states = np.empty((len(inputs), self.n_states))
+        forcing = inputs @ Bd.T
+        for k in range(len(inputs)):
+            x = Ad @ x + forcing[k]
+            states[k] = x
+        return states @ self.C.T + inputs @ self.D.T
+
+    def to_dict(self):
+        """Dictionary of the surrogate with plain lists (JSON serializable)."""
+        return {
+            "A": self.A.tolist(),
+            "B": self.B.tolist(),
+            "C": self.C.tolist(),
+            "D": self.D.tolist(),
+            "state_projection": self.state_projection.tolist(),
+            "input_species": self.input_species,
+            "output_names": self.output_names,
+            "hankel_singular_values": self.hankel_singular_values.tolist(),
+            "error_bound": self.error_bound,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def save(self, filename):
+        """Saves the surrogate to a JSON file."""
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a surrogate saved with save."""
+        with open(filename, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def gramian_factor(gramian):
+    """Square root factor L of a symmetric positive semidefinite gramian (gramian = L·L^T), from its eigendecomposition so that the round-off negative eigenvalues of the stiff system are set to zero instead of breaking a Cholesky factorization."""
+    w, V = np.linalg.eigh((gramian + gramian.T) / 2)
+    return V * np.sqrt(np.clip(w, 0, None))
+
+
+def balanced_reduction(
+    model,
+    n_states,
+    input_species=None,
+    outputs="compartment",
+    method="singular_perturbation",
+):
+    """Reduced order surrogate of the system of particles by balanced truncation of the matrix of interactions.
+
+    The controllability and observability gramians of (A, B, C) are computed from their Lyapunov equations and the states with non negligible Hankel singular values σ (the minimal realization) are transformed to balanced coordinates (square root method), ordered by σ. The first n_states balanced states are kept (n_states is capped at the number of states of the minimal realization). With method "truncation" the other states are dropped. With method "singular_perturbation" (default) they are set to their quasi steady state, which reproduces the steady state of the minimal realization. The gramians of the stiff matrix of interactions are only accurate up to round-off, so the minimal realization does not reproduce the steady state of the full system exactly: the error bound of the surrogate is 2·Σ σ of the discarded states (a priori bound against the minimal realization, for any input in the H-infinity norm) plus the measured error of the steady state gain of the minimal realization against the full system.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+    n_states : number of states of the surrogate (at most the number of states of the minimal realization)
+    input_species : list of species codes with emissions (default: all species of the emitted MP form, model.MP_form)
+    outputs : "compartment" (mass per compartment) or "species" (mass per species)
+    method : "singular_perturbation" or "truncation"
+
+    Returns
+    -------
+    ReducedOrderModel
+    """
+    A = model.interactions_matrix.toarray()
+    n_species = len(model.SpeciesList)
+    if not 0 < n_states <= n_species:
+        raise ValueError("Number of states must be between 1 and " + str(n_species))
+    if method not in ["singular_perturbation", "truncation"]:
+        raise ValueError("Reduction method must be singular_perturbation or truncation")
+
+    if input_species is None:
+        form = model.particle_forms_coding[model.MP_form]
+        input_species = [sp for sp in model.SpeciesList if sp[1] == form]
+    B = np.zeros((n_species, len(input_species)))
+    B[
+        [model.SpeciesList.index(sp) for sp in input_species], range(len(input_species))
+    ] = 1
+
+    if outputs == "compartment":
+        output_names = list(model.dict_comp.keys())
+        C = np.zeros((len(output_names), n_species))
+        for i, p in enumerate(model.system_particle_object_list):
+            C[output_names.index(p.Pcompartment.Cname), i] = 1
+    elif outputs == "species":
+        output_names = list(model.SpeciesList)
+        C = np.eye(n_species)
+    else:
+        raise ValueError("Outputs must be compartment or species")
+
+    # Square root balancing of the minimal realization: only the states with non negligible Hankel singular values (above the round-off of the gramians) are balanced, so that the scaling does not divide by values near machine zero
+    L_c = gramian_factor(linalg.solve_continuous_lyapunov(A, -B @ B.T))
+    L_o = gramian_factor(linalg.solve_continuous_lyapunov(A.T, -C.T @ C))
+    U, hankel, Vt = np.linalg.svd(L_o.T @ L_c)
+    n_minimal = int(np.sum(hankel > hankel[0] * n_species * np.finfo(float).eps))
+    scaling = 1 / np.sqrt(hankel[:n_minimal])
+    T = L_c @ Vt[:n_minimal].T * scaling
+    T_inv = (U[:, :n_minimal] * scaling).T @ L_o.T
+    A_b = T_inv @ A @ T
+    B_b = T_inv @ B
+    C_b = C @ T
+
+    r = min(n_states, n_minimal)
+    if method == "truncation" or r == n_minimal:
+        A_r, B_r, C_r = A_b[:r, :r], B_b[:r], C_b[:, :r]
+        D_r = np.zeros((C.shape[0], B.shape[1]))
+    else:
+        # Discarded states at quasi steady state: x2 = -A22^-1·(A21·x1 + B2·u)
+        X = np.linalg.solve(A_b[r:, r:], np.hstack([A_b[r:, :r], B_b[r:]]))
+        A_r = A_b[:r, :r] - A_b[:r, r:] @ X[:, :r]
+        B_r = B_b[:r] - A_b[:r, r:] @ X[:, r:]
+        C_r = C_b[:, :r] - C_b[:, r:] @ X[:, :r]
+        D_r = -C_b[:, r:] @ X[:, r:]
+
+    # Error of the steady state gain of the minimal realization against the full system (round-off of the gramians of the stiff system), measured from the factorized matrix of interactions
+    gain_full = -C @ np.asarray(model.interactions_lu.solve(B)).reshape(B.shape)
+    gain_minimal = -C_b @ np.linalg.solve(A_b, B_b)
+    projection_error = np.linalg.norm(gain_minimal - gain_full, 2)
+
+    return ReducedOrderModel(
+        A=A_r,
+        B=B_r,
+        C=C_r,
+        D=D_r,
+        state_projection=T_inv[:r],
+        input_species=input_species,
+        output_names=output_names,
+        hankel_singular_values=hankel,
+        error_bound=2 * hankel[r:n_minimal].sum() + projection_error,
+    )
+
+
+def reduced_order_steady_state_error(model, surrogate, emiss_dict_g_s=None):
+    """Error of the steady state outputs of the surrogate against the full steady state solution (as in solve_ODES_SS) and its bound for the given emissions.
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    surrogate : ReducedOrderModel of the model
+    emiss_dict_g_s : emissions dictionary (default model.emiss_dict_g_s)
+
+    Returns
+    -------
+    error : 2-norm of the error of the steady state outputs (g)
+    bound : error bound of the surrogate for these emissions (g)
+    """
+    if emiss_dict_g_s is None:
+        emiss_dict_g_s = model.emiss_dict_g_s
+    q_mass_g_s = emission_vector(model, emiss_dict_g_s)
+    mass_g = model.interactions_lu.solve(-q_mass_g_s)
+    u = q_mass_g_s[[model.SpeciesList.index(sp) for sp in surrogate.input_species]]
+    if not np.allclose(u.sum(), q_mass_g_s.sum()):
+        raise ValueError("Emissions to species that are not inputs of the surrogate")
+
+    if surrogate.output_names == list(model.SpeciesList):
+        y_full = mass_g
+    else:
+        y_full = np.zeros(len(surrogate.output_names))
+        for p, m in zip(model.system_particle_object_list, mass_g):
+            y_full[surrogate.output_names.index(p.Pcompartment.Cname)] += m
+
+    error = np.linalg.norm(surrogate.steady_state(u) - y_full)
+    return error, surrogate.error_bound * np.linalg.norm(u)
@@ -0,0 +1,244 @@
+# This file contains the functions that estimate the local sensitivity of the steady state results to every rate constant of the system using the adjoint of the matrix of interactions
+
+from utopia.preprocessing.fill_interactions_df import interaction_entries
+from utopia.solver_steady_state import (
+    emission_vector,
+    factorize_interactions,
+    species_scaling_vectors,
+)
+import copy
+import pandas as pd
+import numpy as np
+from scipy.sparse.linalg import SuperLU
+
+# Compartments outside of the system boundaries for the overall exposure indicators (see Exposure_indicators_calculation)
+comp_outBoundaries = ["Ocean_Column_Water", "Sediment_Ocean"]
+
+
+def persistence_loss_terms(compartment):
+    """Loss flows of the overall persistence (mass) for the species of a compartment as {(process, position): coefficient}: the loss flow is coefficient·k·mass."""
+    if compartment in comp_outBoundaries:
+        return {}
+    return {("k_discorporation", 0): 1}
+
+
+def residence_time_loss_terms(compartment):
+    """Loss flows of the overall residence time (mass) for the species of a compartment as {(process, position): coefficient}, following the system losses of Exposure_indicators_calculation."""
+    if compartment in ["Beaches_Deep_Soil", "Background_Soil", "Impacted_Soil"]:
+        # Exposure_indicators_calculation adds the discorporation flows of the deep soils twice (deep soils branch and general branch)
+        return {("k_discorporation", 0): 2, ("k_sequestration_deep_soils", 0): 1}
+    elif compartment in ["Sediment_Freshwater", "Sediment_Coast"]:
+        return {("k_discorporation", 0): 1, ("k_burial", 0): 1}
+    elif compartment == "Ocean_Mixed_Water":
+        # Net flow out of the system to the deep ocean (mixing down minus mixing up and rising from the Ocean Column Water)
+        return {("k_discorporation", 0): 1, ("k_settling", 0): 1, ("k_mixing", 1): 1}
+    elif compartment == "Ocean_Column_Water":
+        return {("k_mixing", 0): -1, ("k_rising", 0): -1}
+    elif compartment == "Sediment_Ocean":
+        return {}
+    else:
+        return {("k_discorporation", 0): 1}
+
+
+def adjoint_solve(model, rhs):
+    """Solves A^T·λ = rhs with the matrix of interactions A of the model. The cached sparse LU factorization of A (model.interactions_lu) is re-used with a transpose solve, the transpose of A is only factorized for the steady state methods that cannot solve with the transpose of their factorization.
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    rhs : right-hand side vector or 2-D array with one right-hand side per column
+
+    Returns
+    -------
+    Array with the solutions, same shape as rhs
+    """
+    if isinstance(model.interactions_lu, SuperLU):
+        return model.interactions_lu.solve(rhs, trans="T")
+    adjoint_lu = factorize_interactions(
+        model.interactions_matrix.T,
+        method=model.ss_method,
+        SpeciesList=model.SpeciesList,
+        **model.ss_options,
+    )
+    return np.asarray(adjoint_lu.solve(rhs)).reshape(np.shape(rhs))
+
+
+def rate_constant_sensitivities(model, emiss_dict_g_s=None):
+    """Derivatives of the overall mass residence time, the overall mass persistence and the mass in each compartment with respect to every rate constant entry of every particle, from one adjoint solve per output.
+
+    At steady state A·M = -E, so for any output J(M, k): dJ/dk = ∂J/∂k - λ^T·(dA/dk)·M, where λ solves A^T·λ = ∂J/∂M. A rate constant k of species j going to the recieving species r only changes column j of A (-k on the diagonal, +k in the rows of the recievers), therefore dJ/dk = ∂J/∂k + M_j·(λ_j - Σ_r λ_r).
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    emiss_dict_g_s : emissions dictionary (default model.emiss_dict_g_s)
+
+    Returns
+    -------
+    Tidy dataframe with one row per rate constant entry and output and the columns species, process, position (index of the rate constant within the list of rate constants of the process), recieving_compartment (None for losses out of the system), output, rate_constant, derivative (dOutput/dk) and elasticity ((dOutput/dk)·k/Output)
+    """
+    if emiss_dict_g_s is None:
+        emiss_dict_g_s = model.emiss_dict_g_s
+
+    particles = model.system_particle_object_list
+    n_species = len(particles)
+    surfComp_list = [c for c in model.dict_comp if "Surface" in c]
+    compartments = list(model.dict_comp.keys())
+    species_comp = [p.Pcompartment.Cname for p in particles]
+
+    mass_g = model.interactions_lu.solve(-emission_vector(model, emiss_dict_g_s))
+    entries = list(interaction_entries(particles, surfComp_list, model.rate_constants))
+    sp_idx = np.array([e[0] for e in entries])
+    k = np.array([e[3] for e in entries], dtype=float)
+
+    # Overall indicators: J = (w·M)/(l·M) (in years), with w the species inside the system boundaries and l the loss rates of each species
+    in_bounds = np.array([c not in comp_outBoundaries for c in species_comp], float)
+    year_s = 365 * 86400
+    outputs = {}
+    for name, loss_terms in [
+        ("residence_time_years", residence_time_loss_terms),
+        ("persistence_years", persistence_loss_terms),
+    ]:
+        coefficients = np.array(
+            [loss_terms(species_comp[e[0]]).get((e[1], e[2]), 0) for e in entries],
+            dtype=float,
+        )
+        loss_rate = np.bincount(sp_idx, coefficients * k, minlength=n_species)
+        total_mass = in_bounds @ mass_g
+        total_loss = loss_rate @ mass_g
+        value = total_mass / total_loss / year_s
+        gradient = (
+            in_bounds / total_loss - total_mass * loss_rate / total_loss**2
+        ) / year_s
+        explicit = -total_mass / total_loss**2 * coefficients * mass_g[sp_idx] / year_s
+        outputs[name] = (value, gradient, explicit)
+
+    for comp in compartments:
+        in_comp = np.array([c == comp for c in species_comp], dtype=float)
+        outputs["mass_g_" + comp] = (
+            in_comp @ mass_g,
+            in_comp,
+            np.zeros(len(entries)),
+        )
+
+    # One adjoint solve per output (all outputs at once as a multiple right-hand side)
+    gradients = np.column_stack([o[1] for o in outputs.values()])
+    adjoints = adjoint_solve(model, gradients)
+
+    # Sum of the adjoints of the recieving species of each entry
+    recieved = np.zeros((len(entries), len(outputs)))
+    for i, e in enumerate(entries):
+        for rec_idx in e[4]:
+            recieved[i] += adjoints[rec_idx]
+    implicit = mass_g[sp_idx, None] * (adjoints[sp_idx] - recieved)
+
+    recieving_compartment = [
+        (
+            ", ".join(dict.fromkeys(species_comp[r] for r in e[4]))
+            if len(e[4]) > 0
+            else None
+        )
+        for e in entries
+    ]
+
+    tables = []
+    for i, (name, (value, gradient, explicit)) in enumerate(outputs.items()):
+        derivative = explicit + implicit[:, i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            elasticity = derivative * k / value
+        tables.append(
+            pd.DataFrame(
+                {
+                    "species": [model.SpeciesList[j] for j in sp_idx],
+                    "process": [e[1] for e in entries],
+                    "position": [e[2] for e in entries],
+                    "recieving_compartment": recieving_compartment,
+                    "output": name,
+                    "rate_constant": k,
+                    "derivative": derivative,
+                    "elasticity": elasticity,
+                }
+            )
+        )
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def input_uncertainty_propagation(model, input_moments, relative_step=1e-4):
+    """Approximate standard deviation of the steady state mass and number of particles in each compartment from the means and variances of the model data inputs (first order moment propagation), as a fast alternative to the Monte Carlo analysis (run_mc_analysis).
+
+    The outputs are linearized at the means of the inputs: Var(y) ≈ Σ_p (dy/dp)²·Var(p), assuming independent inputs. The directional derivative of the steady state for each input follows from A·M = -E: dM/dp = -A^-1·(dE/dp + (dA/dp)·M), where dA/dp and dE/dp are central differences of the assembled matrix of interactions and emissions. Only the assembly is repeated for each input; all derivatives are then obtained at once from one back-substitution with the factorized matrix of interactions.
+
+    Parameters
+    ----------
+    model : utopiaModel
+    input_moments : dictionary {data input name: (mean, variance)} of the uncertain numeric data inputs, i.e. {"t_half_deg_free": (4584, 1000**2), "FI": (0.5, 0.1**2)}
+    relative_step : step of the central differences relative to the mean of each input
+
+    Returns
+    -------
+    Dataframe indexed by compartment with the columns mass_g, mass_g_std, number_of_particles and number_of_particles_std
+    """
+    for name, (mean, variance) in input_moments.items():
+        if name not in model.data or isinstance(model.data[name], (str, dict)):
+            raise ValueError(f"'{name}' is not a numeric data input of the model")
+        if variance < 0:
+            raise ValueError(f"Negative variance for '{name}'")
+
+    # Linearization point: the model at the means of the inputs
+    data = copy.deepcopy(model.data)
+    data.update({name: mean for name, (mean, variance) in input_moments.items()})
+    if data != model.data:
+        model = type(model)(config=model.config, data=data)
+    model.build_system()
+
+    particles = model.system_particle_object_list
+    q_mass_g_s = emission_vector(model, model.emiss_dict_g_s)
+    mass_g = model.interactions_lu.solve(-q_mass_g_s)
+    particle_mass_g, _ = species_scaling_vectors(particles)
+
+    rhs = []
+    d_particle_mass = []
+    for name, (mean, variance) in input_moments.items():
+        step = relative_step * abs(mean) if mean != 0 else relative_step
+        assembled = []
+        for value in [mean + step, mean - step]:
+            perturbed = type(model)(config=model.config, data={**data, name: value})
+            perturbed.assemble_system()
+            perturbed.set_emissions()
+            assembled.append(
+                (
+                    perturbed.interactions_matrix,
+                    emission_vector(perturbed, perturbed.emiss_dict_g_s),
+                    species_scaling_vectors(perturbed.system_particle_object_list)[0],
+                )
+            )
+        (A_plus, E_plus, pm_plus), (A_minus, E_minus, pm_minus) = assembled
+        dA = (A_plus - A_minus) / (2 * step)
+        dE = (E_plus - E_minus) / (2 * step)
+        rhs.append(-(dE + dA @ mass_g))
+        d_particle_mass.append((pm_plus - pm_minus) / (2 * step))
+
+    # Directional derivatives of the steady state for all inputs (multiple right-hand side)
+    rhs = np.column_stack(rhs)
+    d_mass = np.asarray(model.interactions_lu.solve(rhs)).reshape(rhs.shape)
+    d_number = d_mass / particle_mass_g[:, None] - (mass_g / particle_mass_g**2)[
+        :, None
+    ] * np.column_stack(d_particle_mass)
+    variances = np.array([variance for mean, variance in input_moments.values()])
+
+    compartments = list(model.dict_comp.keys())
+    species_comp = np.array([p.Pcompartment.Cname for p in particles])
+    results = {}
+    for comp in compartments:
+        in_comp = species_comp == comp
+        results[comp] = {
+            "mass_g": mass_g[in_comp].sum(),
+            "mass_g_std": np.sqrt(d_mass[in_comp].sum(axis=0) ** 2 @ variances),
+            "number_of_particles": (mass_g / particle_mass_g)[in_comp].sum(),
+            "number_of_particles_std": np.sqrt(
+                d_number[in_comp].sum(axis=0) ** 2 @ variances
+            ),
+        }
+
+    return pd.DataFrame.from_dict(results, orient="index")
@@ -1,8 +1,19 @@
 # This file contains the function that solves the steady state ODEs for the system of particles
 
-from utopia.helpers import mass_to_num, num_to_mass
+from utopia.helpers import num_to_mass
+from utopia.preprocessing.fill_interactions_df import interactions_update
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import (
+    splu,
+    spilu,
+    onenormest,
+    LinearOperator,
+    gmres,
+    bicgstab,
+)
 
 
 def solver_SS(model):
@@ -13,168 +24,860 @@ def solver_SS(model):
     for compartment in model.emiss_dict_g_s.keys():
         for size_bin in model.emiss_dict_g_s[compartment].keys():
 
-            sp_imputs.append(
-                size_bin
-                + model.particle_forms_coding[model.MP_form]
-                + str(model.particle_compartmentCoding[compartment])
-                + "_"
-                + model.boxName
-            )
+            sp_imputs.append(emission_species_code(model, compartment, size_bin))
             q_mass_g_s.append(model.emiss_dict_g_s[compartment][size_bin])
 
     input_flows_g_s = dict(zip(sp_imputs, q_mass_g_s))
 
+    # Emissions in particle number from the mass of one particle of each emitted species
+    particle_mass_g, _ = species_scaling_vectors(model.system_particle_object_list)
+    species_index = {sp: i for i, sp in enumerate(model.SpeciesList)}
     q_num_s = [
-        mass_to_num(v, p.Pvolume_m3, p.Pdensity_kg_m3) if v != 0 else 0
-        for k, v in zip(input_flows_g_s.keys(), input_flows_g_s.values())
-        for p in model.system_particle_object_list
-        if k == p.Pcode
+        v / particle_mass_g[species_index[k]] if v != 0 else 0
+        for k, v in input_flows_g_s.items()
     ]
 
     input_flows_num_s = dict(zip(sp_imputs, q_num_s))
 
+    if model.spm_depletion:
+        # Nonlinear steady state: the heteroaggregation rate constants depend on the SPM particles left free by the heteroaggregated MPs
+        def nonlinear_solver(q_mass_g_s):
+            mass_g, model.spm_depletion_trace = solver_SS_spm_depletion(
+                model, q_mass_g_s
+            )
+            return mass_g
+
+    else:
+        nonlinear_solver = None
+
     R, PartMass_t0 = solve_ODES_SS(
         system_particle_object_list=model.system_particle_object_list,
         q_num_s=0,
         input_flows_g_s=input_flows_g_s,
-        interactions_df=model.interactions_df,
+        interactions_df=model.interactions_matrix,
+        lu=model.interactions_lu,
+        nonlinear_solver=nonlinear_solver,
     )
     return R, PartMass_t0, input_flows_g_s, input_flows_num_s
 
 
-def solve_ODES_SS(
-    system_particle_object_list, q_num_s, input_flows_g_s, interactions_df
-):
-    SpeciesList = [p.Pcode for p in system_particle_object_list]
+def spm_free_fraction_terms(model):
+    """Linear terms of the fraction of free SPM particles in each compartment with heteroaggregation: f_c = 1 - s_c·M, where s_c[i] = 1/(m_i·V_c·N_c) for the heteroaggregated species i of the compartment (one SPM particle per heteroaggregated MP particle), with m_i the mass of the MP particle, V_c the volume of the compartment and N_c the SPM number concentration.
+
+    Parameters
+    ----------
+    model : utopiaModel with the system built (model.build_system())
+
+    Returns
+    -------
+    Dictionary {compartment name: s_c vector}
+    """
+    particles = model.system_particle_object_list
+    particle_mass_g, compartment_volume_m3 = species_scaling_vectors(particles)
+    species_comp = np.array([p.Pcompartment.Cname for p in particles])
+    heteroaggregated = np.array([p.Pcode[1] in ["B", "D"] for p in particles])
+
+    terms = {}
+    for comp_name, comp in model.dict_comp.items():
+        if "heteroaggregation" not in comp.processess or not comp.SPM_mgL:
+            continue
+        model.spm.calc_numConc(concMass_mg_L=float(comp.SPM_mgL), concNum_part_L=0)
+        in_comp = heteroaggregated & (species_comp == comp_name)
+        terms[comp_name] = np.where(
+            in_comp,
+            1 / (particle_mass_g * compartment_volume_m3 * model.spm.concNum_part_m3),
+            0,
+        )
+    return terms
+
+
+def solver_SS_spm_depletion(model, q_mass_g_s, rtol=1e-10, max_iterations=50):
+    """Nonlinear steady state where the heteroaggregation rate constants are proportional to the SPM particles not yet occupied by heteroaggregated MPs, instead of assuming an SPM number concentration unaffected by the MP attachment (only valid at low emission loads).
+
+    With H_c the heteroaggregation part of the matrix of interactions in compartment c and f_c(M) the fraction of free SPM (spm_free_fraction_terms, clipped to [0, 1]), the steady state solves F(M) = A·M + Σ_c (f_c(M) - 1)·H_c·M + E = 0 by Newton iterations starting from the linear solution. The Jacobian J = A + Σ_c (f_c - 1)·H_c + Σ_c (H_c·M)·∇f_c^T only differs from A in the heteroaggregating columns plus one rank one term per compartment, so each step is solved with the cached factorization of A through a Sherman-Morrison-Woodbury update (as in solver_SS_low_rank). The back-substitutions A^-1·H_c are done once, so each iteration only needs one back-substitution and a small dense solve and the matrix is never refactorized.
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    q_mass_g_s : vector of emissions per species (g/s)
+    rtol : tolerance on the norm of the residual F(M) relative to the norm of the emissions
+    max_iterations : maximum number of Newton iterations
+
+    Returns
+    -------
+    mass_g : steady state mass per species (g)
+    trace : dataframe with one row per iteration and the columns iteration, residual (relative norm of F(M)), step (relative norm of the Newton step) and min_free_spm_fraction
+    """
+    n_species = len(model.SpeciesList)
+    heteroaggregation = interactions_update(
+        model.system_particle_object_list,
+        model.dict_comp,
+        {("k_heteroaggregation", None): 2},
+        model.rate_constants,
+    )
+    cols = np.flatnonzero(np.diff(heteroaggregation.indptr))
+    H = heteroaggregation[:, cols].toarray()
+    # Back-substitutions with the factorized matrix, re-used by all the iterations
+    Y = np.asarray(model.interactions_lu.solve(H)).reshape(H.shape)
+
+    terms = spm_free_fraction_terms(model)
+    compartments = list(terms.keys())
+    S = np.array([terms[c] for c in compartments])
+    species_comp = [
+        model.system_particle_object_list[j].Pcompartment.Cname for j in cols
+    ]
+    col_comp = np.array([compartments.index(c) for c in species_comp])
+    comp_cols = [col_comp == k for k in range(len(compartments))]
+
+    norm_q = np.linalg.norm(q_mass_g_s)
+    mass_g = model.interactions_lu.solve(-q_mass_g_s)
+    # Species not reached by the emissions in the linear solution are not reached either when the SPM is depleted (the heteroaggregation rates can only decrease), so they are kept at zero mass instead of gathering round-off from the dense updates
+    reached = mass_g != 0
+    trace = []
+    for iteration in range(max_iterations + 1):
+        occupied = S @ mass_g
+        free_fraction = np.clip(1 - occupied, 0, 1)
+        scale = free_fraction[col_comp] - 1
+        residual_vector = (
+            model.interactions_matrix @ mass_g + H @ (scale * mass_g[cols]) + q_mass_g_s
+        )
+        residual = np.linalg.norm(residual_vector) / norm_q
+        if residual <= rtol:
+            trace.append((iteration, residual, 0.0, free_fraction.min()))
+            break
+        if iteration == max_iterations:
+            raise RuntimeError(
+                "SPM depletion steady state did not converge after %d iterations (residual %.3g)"
+                % (max_iterations, residual)
+            )
 
-    # Set initial mass of particles to 0
-    # Set SS mass of particles to =???
-    if sum(input_flows_g_s.values()) != 0:
-        # set mass of particles for all particles in the system as zero
-        m_t0 = []
-        for p in system_particle_object_list:
-            p.Pmass_g_t0 = 0
-            m_t0.append(p.Pmass_g_t0)
-
-        # dataframe of mass of particles at time 0
-        PartMass_t0 = pd.DataFrame({"species": SpeciesList, "mass_g": m_t0})
-        PartMass_t0 = PartMass_t0.set_index("species")
-
-        # Set emissions
-        for sp_imput in input_flows_g_s.keys():
-            PartMass_t0.at[sp_imput, "mass_g"] = -input_flows_g_s[sp_imput]
-
-        # Input vector
-        inputVector = PartMass_t0["mass_g"].to_list()
-
-        matrix = interactions_df.to_numpy()
-
-        SteadyStateResults = np.linalg.solve(matrix, inputVector)
-
-        Results = pd.DataFrame({"species": SpeciesList, "mass_g": SteadyStateResults})
-
-        R = Results.set_index("species")
-        for p in system_particle_object_list:
-            p.Pmass_g_SS = R.loc[p.Pcode]["mass_g"]
-
-        # Convert results in mass to particle number and add to the particle objects
-        for p in system_particle_object_list:
-            if "SPM" in p.Pname:
-                if "BF" in p.Pname:
-                    p.Pnum_SS = mass_to_num(
-                        mass_g=p.Pmass_g_SS,
-                        volume_m3=p.parentMP.parentMP.Pvolume_m3,
-                        density_kg_m3=p.parentMP.parentMP.Pdensity_kg_m3,
-                    )
-                else:
-                    p.Pnum_SS = mass_to_num(
-                        mass_g=p.Pmass_g_SS,
-                        volume_m3=p.parentMP.Pvolume_m3,
-                        density_kg_m3=p.parentMP.Pdensity_kg_m3,
-                    )
+        # Woodbury update of the Jacobian: J = A + U·W^T
+        active = (occupied > 0) & (occupied < 1)
+        # A^-1·H_c·M from the stored back-substitutions
+        Z_rank_one = np.column_stack(
+            [
+                Y[:, comp_cols[k]] @ mass_g[cols[comp_cols[k]]]
+                for k in range(len(compartments))
+            ]
+        )
+        Z = np.hstack([Y * scale, Z_rank_one[:, active]])
+        W = np.vstack([np.eye(n_species)[cols], -S[active]])
+        x = model.interactions_lu.solve(-residual_vector)
+        capacitance = np.eye(Z.shape[1]) + W @ Z
+        step = np.where(reached, x - Z @ np.linalg.solve(capacitance, W @ x), 0)
+
+        mass_g = mass_g + step
+        trace.append(
+            (
+                iteration,
+                residual,
+                np.linalg.norm(step) / np.linalg.norm(mass_g),
+                free_fraction.min(),
+            )
+        )
+
+    trace = pd.DataFrame(
+        trace, columns=["iteration", "residual", "step", "min_free_spm_fraction"]
+    )
+    return mass_g, trace
+
+
+def emission_species_code(model, compartment, size_bin):
+    """Code of the species that receives the emissions of a size bin to a compartment (MP form selected in model.MP_form), as in model.SpeciesList."""
+    return (
+        size_bin
+        + model.particle_forms_coding[model.MP_form]
+        + str(model.particle_compartmentCoding[compartment])
+        + "_"
+        + model.boxName
+    )
+
+
+def emissions_num_to_mass(model, emiss_dict_num_s):
+    """Converts an emissions dictionary in particles/s (same structure as model.emiss_dict_g_s) into the equivalent emissions dictionary in g/s using the mass of one particle of each emitted species (MP form selected in model.MP_form)."""
+    particle_mass_g, _ = species_scaling_vectors(model.system_particle_object_list)
+    species_index = {sp: i for i, sp in enumerate(model.SpeciesList)}
+    emiss_dict_g_s = {}
+    for compartment in emiss_dict_num_s.keys():
+        emiss_dict_g_s[compartment] = {}
+        for size_bin, q_num_s in emiss_dict_num_s[compartment].items():
+            sp_imput = emission_species_code(model, compartment, size_bin)
+            emiss_dict_g_s[compartment][size_bin] = (
+                q_num_s * particle_mass_g[species_index[sp_imput]]
+            )
+
+    return emiss_dict_g_s
+
+
+def emission_vector(model, emiss_dict_g_s):
+    """Converts an emissions dictionary (same structure as model.emiss_dict_g_s) into the vector of emissions (g/s) of all species in the order of model.SpeciesList. Emissions are made to the MP form selected in model.MP_form."""
+    species_index = {sp: i for i, sp in enumerate(model.SpeciesList)}
+    q_mass_g_s = np.zeros(len(model.SpeciesList))
+    for compartment in emiss_dict_g_s.keys():
+        for size_bin in emiss_dict_g_s[compartment].keys():
+            sp_imput = emission_species_code(model, compartment, size_bin)
+            q_mass_g_s[species_index[sp_imput]] = emiss_dict_g_s[compartment][size_bin]
+
+    return q_mass_g_s
+
+
+def species_scaling_vectors(system_particle_object_list):
+    """Per species vectors to convert the mass results into particle number and concentrations: mass of one particle (g) and volume of the compartment where the species is (m3). For heteroaggregated (SPM) species the particle number refers to the MP particles, so the volume and density of the parent MP (the parent free MP for biofouled ones) are used."""
+    particle_mass_g = []
+    compartment_volume_m3 = []
+    for p in system_particle_object_list:
+        if "SPM" in p.Pname:
+            if "BF" in p.Pname:
+                mp = p.parentMP.parentMP
             else:
-                p.Pnum_SS = mass_to_num(
-                    mass_g=p.Pmass_g_SS,
-                    volume_m3=p.Pvolume_m3,
-                    density_kg_m3=p.Pdensity_kg_m3,
+                mp = p.parentMP
+        else:
+            mp = p
+        particle_mass_g.append(num_to_mass(1, mp.Pvolume_m3, mp.Pdensity_kg_m3))
+        compartment_volume_m3.append(float(p.Pcompartment.Cvolume_m3))
+
+    return np.array(particle_mass_g), np.array(compartment_volume_m3)
+
+
+def solver_SS_scenarios(model, emissions, unit="mass"):
+    """Solves the steady state for several emission scenarios at once using the factorized matrix of interactions (one multi right-hand side back-substitution).
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    emissions : list of emission dictionaries (same structure as model.emiss_dict_g_s) or 2-D array of emissions with shape (scenarios, species) following the order of model.SpeciesList
+    unit : unit of the emissions, "mass" (g/s) or "number" (particles/s)
+
+    Returns
+    -------
+    Dataframe indexed by (scenario, species) with the steady state mass, number of particles and concentrations of each species in each scenario
+    """
+    if isinstance(emissions, (list, tuple)) and all(
+        isinstance(e, dict) for e in emissions
+    ):
+        q_mass_g_s = np.column_stack([emission_vector(model, e) for e in emissions])
+    else:
+        q_mass_g_s = np.asarray(emissions, dtype=float).T
+        if q_mass_g_s.ndim != 2 or q_mass_g_s.shape[0] != len(model.SpeciesList):
+            raise ValueError(
+                "Emissions array must have shape (scenarios, species) with "
+                + str(len(model.SpeciesList))
+                + " species"
+            )
+
+    particle_mass_g, compartment_volume_m3 = species_scaling_vectors(
+        model.system_particle_object_list
+    )
+    if unit == "number":
+        q_mass_g_s = q_mass_g_s * particle_mass_g[:, None]
+    elif unit != "mass":
+        raise ValueError("Emissions unit must be mass or number")
+
+    mass_g = model.interactions_lu.solve(-q_mass_g_s)
+    number = mass_g / particle_mass_g[:, None]
+
+    n_scenarios = q_mass_g_s.shape[1]
+    index = pd.MultiIndex.from_product(
+        [range(n_scenarios), model.SpeciesList], names=["scenario", "species"]
+    )
+    return pd.DataFrame(
+        {
+            "mass_g": mass_g.T.ravel(),
+            "number_of_particles": number.T.ravel(),
+            "concentration_g_m3": (mass_g / compartment_volume_m3[:, None]).T.ravel(),
+            "concentration_num_m3": (number / compartment_volume_m3[:, None]).T.ravel(),
+        },
+        index=index,
+    )
+
+
+def solver_SS_stream(
+    model, emissions, chunk_size=1000, unit="mass", aggregate="compartment"
+):
+    """Generator that solves the steady state for a stream of emission scenarios (i.e. an emission inventory per facility read row by row) in chunks, so that memory stays bounded regardless of the length of the inventory. Each chunk of scenarios is solved as one multi right-hand side back-substitution with the factorized matrix of interactions.
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    emissions : iterable of emission scenarios. Each scenario is an emissions dictionary (same structure as model.emiss_dict_g_s), a dictionary of emissions per species (same structure as input_flows_g_s in solver_SS, i.e. {"eA0_Utopia": 100}) or a vector of emissions per species following the order of model.SpeciesList
+    chunk_size : number of scenarios solved together
+    unit : unit of the emissions, "mass" (g/s) or "number" (particles/s)
+    aggregate : "compartment" to yield the steady state summed per compartment or "species" to yield it per species
+
+    Yields
+    ------
+    Dataframe per chunk indexed by scenario (position in the stream) with the steady state mass (g) per compartment or species as columns
+    """
+    if unit not in ["mass", "number"]:
+        raise ValueError("Emissions unit must be mass or number")
+    if aggregate not in ["compartment", "species"]:
+        raise ValueError("Results must be aggregated by compartment or species")
+
+    n_species = len(model.SpeciesList)
+    species_index = {sp: i for i, sp in enumerate(model.SpeciesList)}
+    particle_mass_g, _ = species_scaling_vectors(model.system_particle_object_list)
+
+    if aggregate == "compartment":
+        compartments = list(model.dict_comp.keys())
+        species_comp = [
+            compartments.index(p.Pcompartment.Cname)
+            for p in model.system_particle_object_list
+        ]
+        aggregation = sparse.csr_matrix(
+            (np.ones(n_species), (species_comp, range(n_species))),
+            shape=(len(compartments), n_species),
+        )
+        columns = compartments
+    else:
+        aggregation = None
+        columns = model.SpeciesList
+
+    q_mass_g_s = np.zeros((n_species, chunk_size))
+    start = 0
+    filled = 0
+    for scenario in emissions:
+        if isinstance(scenario, dict) and all(
+            isinstance(v, dict) for v in scenario.values()
+        ):
+            q_mass_g_s[:, filled] = emission_vector(model, scenario)
+        elif isinstance(scenario, dict):
+            q_mass_g_s[:, filled] = 0
+            for sp_imput, q in scenario.items():
+                q_mass_g_s[species_index[sp_imput], filled] = q
+        else:
+            q = np.asarray(scenario, dtype=float)
+            if q.shape != (n_species,):
+                raise ValueError(
+                    "Emissions vector must have one value per species ("
+                    + str(n_species)
+                    + ")"
                 )
+            q_mass_g_s[:, filled] = q
+        filled += 1
 
-        # Add to Results dataframe
-        for p in system_particle_object_list:
-            R.loc[p.Pcode, "number_of_particles"] = p.Pnum_SS
-        ### Estimate SS concentration and add to particles
-        for p in system_particle_object_list:
-            p.C_g_m3_SS = p.Pmass_g_SS / float(p.Pcompartment.Cvolume_m3)
-            R.loc[p.Pcode, "concentration_g_m3"] = p.C_g_m3_SS
-            p.C_num_m3_SS = p.Pnum_SS / float(p.Pcompartment.Cvolume_m3)
-            R.loc[p.Pcode, "concentration_num_m3"] = p.C_num_m3_SS
-
-    elif (
-        q_num_s != 0
-    ):  # By default the inputs are always given in mass this piece of code only needed if inputs given in particle numbers but this is has to be included in the imputs sections and updated to reflect the same structure as the mass inputs (list of inputs and not a single value)
-        # Set number of particles for all particles in the system as zero
-        N_t0 = []
-        for p in system_particle_object_list:
-            p.Pnumber = 0
-            N_t0.append(p.Pnumber)
-
-        # dataframe of number of particles at time 0
-        PartNum_t0 = pd.DataFrame({"species": SpeciesList, "number_of_particles": N_t0})
-        PartNum_t0 = PartNum_t0.set_index("species")
-
-        # Set emissions
-        PartNum_t0.at[sp_imput, "number_of_particles"] = -q_num_s
-
-        # Input vector
-        inputVector = PartNum_t0["number_of_particles"].to_list()
-        matrix = interactions_df.to_numpy()
-
-        SteadyStateResults = np.linalg.solve(matrix, inputVector)
-
-        Results = pd.DataFrame(
-            {"species": SpeciesList, "number_of_particles": SteadyStateResults}
+        if filled == chunk_size:
+            yield stream_chunk_results(
+                model, q_mass_g_s, particle_mass_g, unit, aggregation, columns, start
+            )
+            start += filled
+            filled = 0
+
+    if filled > 0:
+        yield stream_chunk_results(
+            model,
+            q_mass_g_s[:, :filled],
+            particle_mass_g,
+            unit,
+            aggregation,
+            columns,
+            start,
         )
 
-        # Assign steady state (SS) results to paticles in particle number
-
-        R = Results.set_index("species")
-        for p in system_particle_object_list:
-            p.Pnum_SS = R.loc[p.Pcode]["number_of_particles"]
-
-        # Convert results in particle number to mass and add to the particle objects
-        for p in system_particle_object_list:
-            if "SPM" in p.Pname:
-                if "BF" in p.Pname:
-                    p.Pmass_g_SS = num_to_mass(
-                        number=p.Pnum_SS,
-                        volume_m3=p.parentMP.parentMP.Pvolume_m3,
-                        density_kg_m3=p.parentMP.parentMP.Pdensity_kg_m3,
-                    )
-                else:
-                    p.Pmass_g_SS = num_to_mass(
-                        number=p.Pnum_SS,
-                        volume_m3=p.parentMP.Pvolume_m3,
-                        density_kg_m3=p.parentMP.Pdensity_kg_m3,
-                    )
+
+def stream_chunk_results(
+    model, q_mass_g_s, particle_mass_g, unit, aggregation, columns, start
+):
+    """Steady state mass of one chunk of emission scenarios of solver_SS_stream as dataframe indexed by scenario."""
+    if unit == "number":
+        q_mass_g_s = q_mass_g_s * particle_mass_g[:, None]
+    mass_g = np.asarray(model.interactions_lu.solve(-q_mass_g_s)).reshape(
+        q_mass_g_s.shape
+    )
+    if aggregation is not None:
+        mass_g = aggregation @ mass_g
+    return pd.DataFrame(
+        mass_g.T,
+        index=pd.RangeIndex(start, start + q_mass_g_s.shape[1], name="scenario"),
+        columns=columns,
+    )
+
+
+def solver_SS_low_rank(model, factors, emiss_dict_g_s=None):
+    """Steady state after multiplying some rate constants by a factor, obtained from the factorized matrix of interactions with a low rank (Sherman-Morrison-Woodbury) update instead of reassembling and refactorizing the matrix.
+
+    Changing the rate constants of r species changes r columns of the matrix: A' = A + U·E^T, where U holds the changed columns and E selects them. Then A'^-1·b = x - A^-1·U·(I + E^T·A^-1·U)^-1·E^T·x with x = A^-1·b, which needs r back-substitutions and a r x r dense solve.
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    factors : dictionary {(process, compartment name): factor} of the rate constants to modify (compartment None modifies the process in all compartments), i.e. {("k_burial", "Sediment_Freshwater"): 2}
+    emiss_dict_g_s : emissions dictionary (default model.emiss_dict_g_s)
+
+    Returns
+    -------
+    Dataframe indexed by species with the steady state mass, number of particles and concentrations
+    """
+    if emiss_dict_g_s is None:
+        emiss_dict_g_s = model.emiss_dict_g_s
+
+    delta = interactions_update(
+        model.system_particle_object_list,
+        model.dict_comp,
+        factors,
+        model.rate_constants,
+    )
+    cols = np.flatnonzero(np.diff(delta.indptr))
+
+    mass_g = model.interactions_lu.solve(-emission_vector(model, emiss_dict_g_s))
+    if len(cols) > 0:
+        U = delta[:, cols].toarray()
+        Z = np.asarray(model.interactions_lu.solve(U)).reshape(U.shape)
+        capacitance = np.eye(len(cols)) + Z[cols, :]
+        mass_g = mass_g - Z @ np.linalg.solve(capacitance, mass_g[cols])
+
+    particle_mass_g, compartment_volume_m3 = species_scaling_vectors(
+        model.system_particle_object_list
+    )
+    number = mass_g / particle_mass_g
+    R = pd.DataFrame(
+        {
+            "mass_g": mass_g,
+            "number_of_particles": number,
+            "concentration_g_m3": mass_g / compartment_volume_m3,
+            "concentration_num_m3": number / compartment_volume_m3,
+        },
+        index=pd.Index(model.SpeciesList, name="species"),
+    )
+    return R
+
+
+def particle_age_moments(model, emiss_dict_g_s=None):
+    """Mean and variance of the age (time since emission) of the mass of each species and compartment at steady state, from the moments of the age distribution obtained with repeated back-substitutions on the factorized matrix of interactions.
+
+    At steady state the mass of age a is exp(A·a)·E, so the age moments are M = -A^-1·E, M1 = A^-2·E = -A^-1·M and M2 = -2·A^-3·E = -2·A^-1·M1. The mean age is M1/M and the variance M2/M - (M1/M)^2 (per compartment the moments of its species are added up first).
+
+    Parameters
+    ----------
+    model : utopiaModel with the factorized system built (model.build_system())
+    emiss_dict_g_s : emissions dictionary (default model.emiss_dict_g_s)
+
+    Returns
+    -------
+    species_age : dataframe indexed by species with the columns Compartment, mass_g, mean_age_years, age_variance_years2 and age_std_years
+    compartment_age : dataframe indexed by compartment with the same columns (except Compartment)
+    """
+    if emiss_dict_g_s is None:
+        emiss_dict_g_s = model.emiss_dict_g_s
+
+    year_s = 365 * 24 * 60 * 60
+    lu = model.interactions_lu
+    mass_g = lu.solve(-emission_vector(model, emiss_dict_g_s))
+    moment_1 = -lu.solve(mass_g) / year_s
+    moment_2 = -2 * lu.solve(moment_1) / year_s
+
+    moments = pd.DataFrame(
+        {
+            "Compartment": [
+                p.Pcompartment.Cname for p in model.system_particle_object_list
+            ],
+            "mass_g": mass_g,
+            "moment_1": moment_1,
+            "moment_2": moment_2,
+        },
+        index=pd.Index(model.SpeciesList, name="species"),
+    )
+    compartment_moments = moments.groupby("Compartment", sort=False)[
+        ["mass_g", "moment_1", "moment_2"]
+    ].sum()
+
+    tables = []
+    for df in [moments, compartment_moments]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            df["mean_age_years"] = df["moment_1"] / df["mass_g"]
+            df["age_variance_years2"] = (
+                df["moment_2"] / df["mass_g"] - df["mean_age_years"] ** 2
+            )
+            df["age_std_years"] = np.sqrt(df["age_variance_years2"].clip(lower=0))
+        tables.append(df.drop(columns=["moment_1", "moment_2"]))
+
+    return tables[0], tables[1]
+
+
+def factorize_interactions(interactions_df, method="LU", SpeciesList=None, **options):
+    """Factorization of the matrix of interactions. Accepts the interactions dataframe or a scipy sparse matrix and returns an object whose solve method gives the steady state for any input vector (or 2-D array of input vectors).
+
+    method : "LU" (sparse LU of the whole matrix, SuperLU object), "SCC" (block triangular solver over the strongly connected components of the species graph, BlockTriangularSolver object), "mixed_precision" (equilibrated single precision LU with iterative refinement in double precision, MixedPrecisionSolver object) or "krylov" (preconditioned iterative solver for large multi-box systems, KrylovSolver object)
+    SpeciesList : species codes of the rows of the matrix (taken from the index of the interactions dataframe when not given), used to find the box of each species for the block Jacobi preconditioner
+    options : keyword arguments of the solver object (i.e. rtol of KrylovSolver)
+    """
+    if sparse.issparse(interactions_df):
+        matrix = sparse.csc_matrix(interactions_df)
+    else:
+        matrix = sparse.csc_matrix(interactions_df.to_numpy())
+        if SpeciesList is None:
+            SpeciesList = list(interactions_df.index)
+
+    if method == "LU":
+        return splu(matrix, **options)
+    elif method == "SCC":
+        return BlockTriangularSolver(matrix)
+    elif method == "mixed_precision":
+        return MixedPrecisionSolver(matrix, **options)
+    elif method == "krylov":
+        if SpeciesList is not None and "boxes" not in options:
+            options["boxes"] = [sp.split("_")[1] for sp in SpeciesList]
+        return KrylovSolver(matrix, **options)
+    else:
+        raise ValueError("Steady state method not implemented: " + str(method))
+
+
+def strongly_connected_blocks(matrix):
+    """Strongly connected components of the species graph (species j linked to species i when matrix[i, j] != 0) in topological order: the species of a block only receive mass from their own block and from the blocks before it.
+
+    Returns
+    -------
+    List of arrays with the indexes of the species of each block
+    """
+    matrix = sparse.csr_matrix(matrix)
+    n_blocks, labels = connected_components(matrix, directed=True, connection="strong")
+
+    # Condensed graph of the blocks (edge from the emitting block to the recieving block)
+    coo = matrix.tocoo()
+    between = labels[coo.row] != labels[coo.col]
+    edges = set(zip(labels[coo.col][between], labels[coo.row][between]))
+    n_upstream = np.zeros(n_blocks, dtype=int)
+    downstream = [[] for _ in range(n_blocks)]
+    for emitter, reciever in edges:
+        n_upstream[reciever] += 1
+        downstream[emitter].append(reciever)
+
+    # Topological sort (Kahn's algorithm)
+    order = []
+    ready = [b for b in range(n_blocks) if n_upstream[b] == 0]
+    while ready:
+        block = ready.pop()
+        order.append(block)
+        for reciever in downstream[block]:
+            n_upstream[reciever] -= 1
+            if n_upstream[reciever] == 0:
+                ready.append(reciever)
+
+    members = [[] for _ in range(n_blocks)]
+    for i, label in enumerate(labels):
+        members[label].append(i)
+
+    return [np.array(members[b]) for b in order]
+
+
+class BlockTriangularSolver:
+    """Steady state solver that exploits the mostly one-directional transport between compartments. The species are grouped in strongly connected components and the matrix of interactions, permuted in topological order of the components, is block lower triangular. Each diagonal block is factorized on its own (single species blocks are just divided by their diagonal term) and the blocks are solved by forward substitution.
+
+    The blocks attribute holds the species indexes of each block in solution order.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.shape = self.matrix.shape
+        self.blocks = strongly_connected_blocks(self.matrix)
+        # Rows of each block (coupling to the upstream blocks) and factorization of its diagonal block
+        self.block_rows = []
+        self.block_lu = []
+        for block in self.blocks:
+            rows = self.matrix[block]
+            self.block_rows.append(rows)
+            if len(block) == 1:
+                self.block_lu.append(rows[0, block[0]])
             else:
-                p.Pmass_g_SS = num_to_mass(
-                    number=p.Pnum_SS,
-                    volume_m3=p.Pvolume_m3,
-                    density_kg_m3=p.Pdensity_kg_m3,
-                )
+                self.block_lu.append(splu(sparse.csc_matrix(rows[:, block])))
+
+    def solve(self, rhs):
+        """Solves matrix·x = rhs for a vector or a 2-D array (species, n) of right-hand sides."""
+        rhs = np.asarray(rhs, dtype=float)
+        x = np.zeros(rhs.shape)
+        for block, rows, lu in zip(self.blocks, self.block_rows, self.block_lu):
+            # x is still zero for the species of this block and of the downstream blocks, so only the upstream mass is subtracted
+            block_rhs = rhs[block] - rows @ x
+            if len(block) == 1:
+                x[block] = block_rhs / lu
+            else:
+                x[block] = lu.solve(block_rhs)
+
+        return x
 
-        # Add to Results dataframe
-        for p in system_particle_object_list:
-            R.loc[p.Pcode, "mass_g"] = p.Pmass_g_SS
+    def coupled_species_groups(self, SpeciesList):
+        """Returns the groups of species (codes from SpeciesList) that are mutually coupled (strongly connected blocks of more than one species) in solution order."""
+        return [
+            [SpeciesList[i] for i in block] for block in self.blocks if len(block) > 1
+        ]
 
-        ### Estimate SS concentration and add to particles
-        for p in system_particle_object_list:
-            p.C_g_m3_SS = p.Pmass_g_SS / float(p.Pcompartment.Cvolume_m3)
-            R.loc[p.Pcode, "concentration_g_m3"] = p.C_g_m3_SS
-            p.C_num_m3_SS = p.Pnum_SS / float(p.Pcompartment.Cvolume_m3)
-            R.loc[p.Pcode, "concentration_num_m3"] = p.C_num_m3_SS
 
+def solve_ODES_SS(
+    system_particle_object_list,
+    q_num_s,
+    input_flows_g_s,
+    interactions_df,
+    lu=None,
+    nonlinear_solver=None,
+):
+    """Solves the steady state mass of all species and derives the particle number and concentrations from it (mass and particle number results come out of the same solve).
+
+    Parameters
+    ----------
+    system_particle_object_list : list of particle objects of the system
+    q_num_s : emissions in particles/s as dictionary {species: particles/s}, only used when input_flows_g_s has no emissions
+    input_flows_g_s : emissions in g/s as dictionary {species: g/s}
+    interactions_df : matrix of interactions (dataframe or scipy sparse matrix)
+    lu : factorization of interactions_df (from factorize_interactions), re-used when given
+    nonlinear_solver : function returning the steady state mass from the vector of emissions (g/s), used instead of lu for nonlinear steady states (i.e. solver_SS_spm_depletion)
+
+    Returns
+    -------
+    R : dataframe of steady state results (mass_g, number_of_particles, concentration_g_m3 and concentration_num_m3) indexed by species
+    PartMass_t0 : dataframe of the input vector (minus the emissions in g/s) indexed by species
+    """
+    if lu is None:
+        lu = factorize_interactions(interactions_df)
+
+    SpeciesList = [p.Pcode for p in system_particle_object_list]
+    species_index = {sp: i for i, sp in enumerate(SpeciesList)}
+
+    # Per species mass of one particle (parent MP for heteroaggregates) and compartment volume to convert between mass, particle number and concentrations
+    particle_mass_g, compartment_volume_m3 = species_scaling_vectors(
+        system_particle_object_list
+    )
+
+    q_mass_g_s = np.zeros(len(SpeciesList))
+    for sp_imput, q in input_flows_g_s.items():
+        q_mass_g_s[species_index[sp_imput]] = q
+    if not q_mass_g_s.any() and isinstance(q_num_s, dict):
+        # Emissions given in particle number: converted to mass so that the same system is solved
+        for sp_imput, q in q_num_s.items():
+            q_mass_g_s[species_index[sp_imput]] = (
+                q * particle_mass_g[species_index[sp_imput]]
+            )
+    if not q_mass_g_s.any():
+        raise ValueError("No particles have been input to the system")
+
+    # Set initial mass of particles to 0
+    for p in system_particle_object_list:
+        p.Pmass_g_t0 = 0
+
+    # dataframe of the input vector (emissions)
+    PartMass_t0 = pd.DataFrame(
+        {"mass_g": -q_mass_g_s}, index=pd.Index(SpeciesList, name="species")
+    )
+
+    if nonlinear_solver is None:
+        mass_g = lu.solve(-q_mass_g_s)
     else:
-        print("ERROR: No particles have been input to the system")
+        mass_g = nonlinear_solver(q_mass_g_s)
+    number = mass_g / particle_mass_g
+
+    R = pd.DataFrame(
+        {
+            "mass_g": mass_g,
+            "number_of_particles": number,
+            "concentration_g_m3": mass_g / compartment_volume_m3,
+            "concentration_num_m3": number / compartment_volume_m3,
+        },
+        index=pd.Index(SpeciesList, name="species"),
+    )
+
+    # Add the steady state results to the particle objects
+    for p, m, n, c_m, c_n in zip(
+        system_particle_object_list,
+        mass_g,
+        number,
+        R["concentration_g_m3"],
+        R["concentration_num_m3"],
+    ):
+        p.Pmass_g_SS = m
+        p.Pnum_SS = n
+        p.C_g_m3_SS = c_m
+        p.C_num_m3_SS = c_n
 
     return R, PartMass_t0
+
+
+class MixedPrecisionSolver:
+    """Steady state solver with a single precision (float32) sparse LU factorization and iterative refinement of the solution to double precision accuracy.
+
+    The rate constants of the matrix of interactions span from ~1e-20 to ~1e4 s-1, so the matrix is first equilibrated: rows and then columns are scaled by powers of 2 (no rounding errors) so that their largest entry is ~1. The factorization of the equilibrated matrix takes half the memory of the double precision one, which matters for batch runs, and the residuals of the refinement are computed with the original double precision matrix.
+
+    After each solve the residual attribute holds the achieved normwise relative backward error of the equilibrated system (||b - A·x|| / (||A||·||x|| + ||b||), infinity norms, largest over all right-hand sides) and iterations the number of refinement steps. condition_estimate is the 1-norm condition number estimate of the equilibrated matrix.
+    """
+
+    def __init__(self, matrix, tol=1e-14, max_iterations=20):
+        self.matrix = sparse.csc_matrix(matrix, dtype=float)
+        self.shape = self.matrix.shape
+        self.tol = tol
+        self.max_iterations = max_iterations
+
+        abs_matrix = abs(self.matrix)
+        self.row_scale = 2.0 ** np.round(
+            -np.log2(abs_matrix.max(axis=1).toarray().ravel())
+        )
+        abs_matrix = sparse.diags(self.row_scale) @ abs_matrix
+        self.col_scale = 2.0 ** np.round(
+            -np.log2(abs_matrix.max(axis=0).toarray().ravel())
+        )
+        scaled = (
+            sparse.diags(self.row_scale) @ self.matrix @ sparse.diags(self.col_scale)
+        )
+        self.lu = splu(sparse.csc_matrix(scaled, dtype=np.float32))
+        self.scaled_norm = abs(scaled).sum(axis=1).max()
+
+        inverse = LinearOperator(
+            self.shape,
+            matvec=lambda v: self.lu.solve(np.asarray(v, dtype=np.float32)),
+            rmatvec=lambda v: self.lu.solve(np.asarray(v, dtype=np.float32), trans="T"),
+            dtype=np.float32,
+        )
+        self.condition_estimate = onenormest(scaled) * onenormest(inverse)
+
+        self.residual = None
+        self.iterations = 0
+
+    def _correction(self, residual):
+        scaled_residual = (
+            self.row_scale.reshape((-1,) + (1,) * (residual.ndim - 1)) * residual
+        )
+        correction = self.lu.solve(scaled_residual.astype(np.float32)).astype(float)
+        return self.col_scale.reshape((-1,) + (1,) * (residual.ndim - 1)) * correction
+
+    def _backward_error(self, rhs, x, residual):
+        # Backward error of the equilibrated system (row scaled residual and rhs, column unscaled solution, scaled matrix with infinity norm ~1)
+        shape = (-1,) + (1,) * (residual.ndim - 1)
+        row_scale = self.row_scale.reshape(shape)
+        scaled_x = x / self.col_scale.reshape(shape)
+        return np.max(
+            np.abs(row_scale * residual).max(axis=0)
+            / (
+                self.scaled_norm * np.abs(scaled_x).max(axis=0)
+                + np.abs(row_scale * rhs).max(axis=0)
+            )
+        )
+
+    def solve(self, rhs):
+        """Solves matrix·x = rhs for a vector or a 2-D array (species, n) of right-hand sides."""
+        rhs = np.asarray(rhs, dtype=float)
+        x = self._correction(rhs)
+        residual = rhs - self.matrix @ x
+        backward_error = self._backward_error(rhs, x, residual)
+        iterations = 0
+        while backward_error > self.tol and iterations < self.max_iterations:
+            x_new = x + self._correction(residual)
+            residual_new = rhs - self.matrix @ x_new
+            backward_error_new = self._backward_error(rhs, x_new, residual_new)
+            iterations += 1
+            if not backward_error_new < backward_error:
+                # Refinement stagnated (the equilibrated matrix is too ill conditioned for the single precision factorization)
+                break
+            x, residual, backward_error = x_new, residual_new, backward_error_new
+
+        self.residual = backward_error
+        self.iterations = iterations
+
+        return x
+
+
+class KrylovSolver:
+    """Iterative steady state solver (GMRES or BiCGSTAB) for large systems (i.e. multi-box configurations with tens of thousands of species) where a direct factorization of the whole matrix of interactions is too expensive.
+
+    Two preconditioners are available: "ilu" (incomplete LU of the whole matrix with drop tolerance drop_tol and fill factor fill_factor) and "block_jacobi" (exact LU of the diagonal block of each box, the interactions between boxes are left to the iterations). Each solve starts from the given initial guess x0 or, when not given, from the last solution (warm start for re-runs with similar emissions). After each solve the iterations attribute holds the number of iterations.
+
+    Parameters
+    ----------
+    matrix : matrix of interactions
+    krylov_method : "gmres" or "bicgstab"
+    preconditioner : "ilu", "block_jacobi" or None
+    rtol, atol : relative and absolute tolerances of the residual
+    maxiter : maximum number of iterations
+    boxes : box name of each species (needed for the block Jacobi preconditioner)
+    drop_tol, fill_factor : options of the incomplete LU preconditioner
+    """
+
+    def __init__(
+        self,
+        matrix,
+        krylov_method="gmres",
+        preconditioner="ilu",
+        rtol=1e-10,
+        atol=0.0,
+        maxiter=1000,
+        boxes=None,
+        drop_tol=1e-4,
+        fill_factor=10,
+    ):
+        if krylov_method not in ["gmres", "bicgstab"]:
+            raise ValueError("Krylov method must be gmres or bicgstab")
+        self.matrix = sparse.csc_matrix(matrix, dtype=float)
+        self.shape = self.matrix.shape
+        self.krylov_method = krylov_method
+        self.rtol = rtol
+        self.atol = atol
+        self.maxiter = maxiter
+
+        if preconditioner == "ilu":
+            ilu = spilu(self.matrix, drop_tol=drop_tol, fill_factor=fill_factor)
+            self.preconditioner = LinearOperator(self.shape, ilu.solve)
+        elif preconditioner == "block_jacobi":
+            if boxes is None:
+                raise ValueError("The block Jacobi preconditioner needs the boxes")
+            boxes = np.asarray(boxes)
+            self.blocks = [np.flatnonzero(boxes == box) for box in dict.fromkeys(boxes)]
+            self.block_lu = [
+                splu(sparse.csc_matrix(self.matrix[block][:, block]))
+                for block in self.blocks
+            ]
+            self.preconditioner = LinearOperator(self.shape, self._block_jacobi)
+        elif preconditioner is None:
+            self.preconditioner = None
+        else:
+            raise ValueError("Preconditioner not implemented: " + str(preconditioner))
+
+        self.last_solution = None
+        self.iterations = 0
+
+    def _block_jacobi(self, v):
+        v = np.asarray(v).ravel()
+        x = np.zeros(self.shape[0])
+        for block, lu in zip(self.blocks, self.block_lu):
+            x[block] = lu.solve(v[block])
+        return x
+
+    def _solve_vector(self, rhs, x0):
+        iterations = [0]
+
+        def count(_):
+            iterations[0] += 1
+
+        solver = gmres if self.krylov_method == "gmres" else bicgstab
+        options = {"callback_type": "pr_norm"} if self.krylov_method == "gmres" else {}
+        x, info = solver(
+            self.matrix,
+            rhs,
+            x0=x0,
+            rtol=self.rtol,
+            atol=self.atol,
+            maxiter=self.maxiter,
+            M=self.preconditioner,
+            callback=count,
+            **options
+        )
+        if info != 0:
+            raise RuntimeError(
+                "Krylov solver did not converge ("
+                + self.krylov_method
+                + ", info "
+                + str(info)
+                + ")"
+            )
+        self.iterations += iterations[0]
+        return x
+
+    def solve(self, rhs, x0=None):
+        """Solves matrix·x = rhs for a vector or a 2-D array (species, n) of right-hand sides. Each right-hand side starts from x0, or from the previous solution when x0 is not given."""
+        rhs = np.asarray(rhs, dtype=float)
+        self.iterations = 0
+        columns = rhs.reshape(self.shape[0], -1)
+        x = np.zeros(columns.shape)
+        for i in range(columns.shape[1]):
+            if x0 is not None:
+                guess = np.asarray(x0, dtype=float).reshape(columns.shape)[:, i]
+            else:
+                guess = self.last_solution
+            x[:, i] = self._solve_vector(columns[:, i], guess)
+            self.last_solution = x[:, i]
+
+        return x.reshape(rhs.shape)
@@ -1,4 +1,5 @@
 import copy
+import hashlib
 import string
 import json
 import pandas as pd
@@ -10,7 +11,12 @@ from pathlib import Path
 from utopia.preprocessing.objects_generation import *
 from utopia.preprocessing.generate_rate_constants import *
 from utopia.preprocessing.fill_interactions_df import *
+from utopia.preprocessing.rc_settling import HydrodynamicsCache
+from utopia.helpers import generate_fsd_matrix
 from utopia.solver_steady_state import *
+from utopia.solver_dynamic import *
+from utopia.solver_sensitivity import *
+from utopia.solver_reduced_order import *
 
 import json
 
@@ -50,6 +56,9 @@ class utopiaModel:
         self.particles_df = self.generate_particles_dataframe()
         self.generate_coding_dictionaries()
 
+        # Settling velocities shared by the rate constants of the hydrodynamic processes (cleared when the rate constant inputs change)
+        self.hydrodynamics_cache = HydrodynamicsCache(g=g_m_s2)
+
     @staticmethod
     def load_json_file(filepath):
         base_path = os.path.dirname(__file__)
@@ -89,7 +98,6 @@ class utopiaModel:
             "t_frag_gen_FreeSurfaceWater",
             "biof_frag_factor",
             "heter_frag_factor",
-            "emiss_dict_g_s",
         ]
 
         required_config_keys = [
@@ -106,7 +114,16 @@ class utopiaModel:
         ]
 
         self.check_required_keys(data, required_data_keys, "data")
+        if "emiss_dict_g_s" not in data and "emiss_dict_num_s" not in data:
+            raise KeyError(
+                "Missing required keys in data: emiss_dict_g_s (or emiss_dict_num_s)"
+            )
         self.check_required_keys(config, required_config_keys, "config")
+        if config["solver"] == "Dynamic":
+            self.check_required_keys(config, ["output_times_s"], "config")
+        if config["solver"] == "Periodic":
+            self.check_required_keys(config, ["period_s", "output_times_s"], "config")
+            self.check_required_keys(data, ["seasons"], "data")
 
         # Type and value checks
         if not isinstance(data["MPdensity_kg_m3"], (int, float)):
@@ -213,6 +230,11 @@ class utopiaModel:
             self.comp_input_file_name, "Cname"
         )
         self.solver = self.config["solver"]
+        # Method to factorize the matrix of interactions for the steady state solution ("LU", "SCC", "mixed_precision" or "krylov") and its options (i.e. tolerances of the krylov solver)
+        self.ss_method = self.config.get("ss_method", "LU")
+        self.ss_options = self.config.get("ss_options", {})
+        # Nonlinear steady state where heteroaggregation depletes the SPM available for further MP attachment (only relevant at high emission loads)
+        self.spm_depletion = self.config.get("spm_depletion", False)
         self.compartment_types = self.config["compartment_types"]
 
         # Derived environmental parameters
@@ -221,8 +243,12 @@ class utopiaModel:
         )
         self.spm_radius_um = self.radius_algae_m * 1e6
 
-        # Emission scenario
-        self.emiss_dict_g_s = self.data["emiss_dict_g_s"]
+        # Optional schedule of piecewise constant emissions of dynamic runs: list of [t_start_s, emissions dictionary] pairs (see run_dynamic)
+        self.emission_schedule = self.data.get("emission_schedule")
+
+        # Emission scenario (in g/s or, when given as emiss_dict_num_s, in particles/s. Emissions in particle number are converted to mass once the particles are generated, unless emiss_dict_g_s is also given)
+        self.emiss_dict_num_s = self.data.get("emiss_dict_num_s")
+        self.emiss_dict_g_s = self.data.get("emiss_dict_g_s")
 
     def generate_particles_dataframe(self):
         """Generates the microplastics input DataFrame from Utopia model attributes."""
@@ -305,8 +331,65 @@ class utopiaModel:
             v: k for k, v in self.particle_compartmentCoding.items()
         }
 
-    def run(self):
-        """Runs the UTOPIA model with the configured parameters."""
+    # Model attributes that determine the particles, rate constants and matrix of interactions (emissions are not included)
+    rate_constant_inputs = [
+        "MPdensity_kg_m3",
+        "MP_composition",
+        "shape",
+        "big_bin_diameter_um",
+        "dimensionX_um",
+        "dimensionY_um",
+        "dimensionZ_um",
+        "N_sizeBins",
+        "FI",
+        "t_half_deg_free",
+        "t_frag_gen_FreeSurfaceWater",
+        "heter_deg_factor",
+        "biof_deg_factor",
+        "factor_deepWater_soilSurface",
+        "factor_sediment",
+        "biof_frag_factor",
+        "heter_frag_factor",
+        "vol_algal_cell_m3",
+        "spm_density_kg_m3",
+        "comp_input_file_name",
+        "comp_interactFile_name",
+        "boxName",
+        "MPforms_list",
+        "compartment_types",
+    ]
+
+    def rate_constants_hash(self):
+        """Returns a hash of the model inputs that determine the rate constants, used as key of the cached factorization of the matrix of interactions."""
+        inputs = {name: getattr(self, name) for name in self.rate_constant_inputs}
+        inputs["particles_df"] = self.particles_df.to_dict(orient="list")
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def build_system(self):
+        """Generates the model objects, rate constants, matrix of interactions and its LU factorization. The factorized system is kept on the model and re-used as long as the rate constant inputs do not change, so re-runs that only change the emissions just need a back-substitution."""
+        key = self.rate_constants_hash()
+        if getattr(self, "system_hash", None) == key:
+            if self.system_owner != id(self):
+                # The model was copied (i.e. copy.copy) after being built: give it its own particle objects so that the results of both models are not overwritten
+                self.system_particle_object_list = copy.deepcopy(
+                    self.system_particle_object_list
+                )
+                self.system_owner = id(self)
+            if self.interactions_lu_method != (self.ss_method, self.ss_options):
+                self.factorize_system()
+            self.set_emissions()
+            return
+
+        self.assemble_system()
+        self.factorize_system()
+
+        self.system_hash = key
+        self.system_owner = id(self)
+        self.set_emissions()
+
+    def assemble_system(self):
+        """Generates the model objects, rate constants and matrix of interactions without factorizing it."""
         # Generate model objects based on model configuration and input data
         # print("Running UTOPIA model with configured parameters...")
         (
@@ -318,17 +401,51 @@ class utopiaModel:
         ) = generate_objects(self)
         # print("Generated model objects.")
 
+        # Fragment size distribution matrix (depends on the fragmentation style FI and the number of size bins)
+        self.fsd_matrix = generate_fsd_matrix(self.FI, self.N_sizeBins)
+
         # Estimate rate contants for all processess for each particle in the system
+        self.hydrodynamics_cache.check_inputs(self.rate_constants_hash())
         generate_rate_constants(self)
         # print("Generated rate constants for model particles.")
 
-        # Build matrix of interactions
-        self.interactions_df = fillInteractions_fun_OOP(
+        # Build matrix of interactions (sparse, only non-zero interactions along the compartment connexions are assembled)
+        self.interactions_matrix = fillInteractions_sparse(
             system_particle_object_list=self.system_particle_object_list,
             SpeciesList=self.SpeciesList,
             dict_comp=self.dict_comp,
+            rate_constants=self.rate_constants,
         )
         # print("Built matrix of interactions.")
+
+    def set_emissions(self):
+        """Converts the emissions given in particle number (emiss_dict_num_s) into the emissions in mass (emiss_dict_g_s) used by the solvers and the results processing. The conversion is only done when emiss_dict_g_s is not given or still holds a previous conversion that is out of date (the particles or the number emissions changed), so emissions in mass set on the model (i.e. on a copy of the model) are never overwritten. Nothing is done when the emissions are given in mass."""
+        if self.emiss_dict_num_s is None:
+            return
+        key = (getattr(self, "system_hash", None), copy.deepcopy(self.emiss_dict_num_s))
+        converted = getattr(self, "emissions_num_conversion", None)
+        if self.emiss_dict_g_s is None or (
+            converted is not None
+            and self.emiss_dict_g_s is converted[1]
+            and converted[0] != key
+        ):
+            self.emiss_dict_g_s = emissions_num_to_mass(self, self.emiss_dict_num_s)
+            self.emissions_num_conversion = (key, self.emiss_dict_g_s)
+
+    def factorize_system(self):
+        """Factorizes the matrix of interactions with the configured steady state method (ss_method) and options (ss_options)."""
+        self.interactions_lu = factorize_interactions(
+            self.interactions_matrix,
+            method=self.ss_method,
+            SpeciesList=self.SpeciesList,
+            **self.ss_options,
+        )
+        self.interactions_lu_method = (self.ss_method, copy.deepcopy(self.ss_options))
+
+    def run(self):
+        """Runs the UTOPIA model with the configured parameters."""
+        self.build_system()
+
         # Solve system of ODEs
         if self.solver == "SteadyState":
 
@@ -336,6 +453,20 @@ class utopiaModel:
                 solver_SS(self)
             )
             # print("Solved system of ODEs for steady state.")
+        elif self.solver == "Dynamic":
+            self.run_dynamic(
+                self.config["output_times_s"],
+                emission_schedule=self.emission_schedule,
+                method=self.config.get("dynamic_method", "BDF"),
+            )
+            return
+        elif self.solver == "Periodic":
+            self.run_periodic(
+                self.config["period_s"],
+                self.data["seasons"],
+                self.config["output_times_s"],
+            )
+            return
         else:
             raise ValueError("Solver not implemented yet")
 
@@ -345,6 +476,251 @@ class utopiaModel:
                 print("negative values in the solution for " + idx)
             else:
                 pass
+        if (self.R["mass_g"] < 0).any() and hasattr(
+            self.interactions_lu, "condition_estimate"
+        ):
+            print(
+                "relative residual of the solution: "
+                + str(self.interactions_lu.residual)
+                + ", condition number estimate: "
+                + str(self.interactions_lu.condition_estimate)
+            )
+
+    def run_dynamic(
+        self, output_times_s, emission_schedule=None, initial_mass_g=None, method="BDF"
+    ):
+        """Solves the model in time (dM/dt = A·M + E(t)) either integrating with a stiff implicit solver that uses the sparse matrix of interactions as Jacobian or, for piecewise constant emissions, evaluating the closed form solution from the eigendecomposition of the matrix of interactions.
+
+        Parameters
+        ----------
+        output_times_s : times (s) at which the mass of each species is reported
+        emission_schedule : None (constant emissions from emiss_dict_g_s), list of (t_start_s, emissions dictionary) pairs of piecewise constant emissions or function of time returning an emissions dictionary
+        initial_mass_g : vector of mass per species at time 0 (default all zeros)
+        method : "BDF" or "Radau" (stiff integrators) or "eigen" (closed form evaluation, only for piecewise constant emissions)
+
+        Returns
+        -------
+        Dataframe of mass (g) per species at each output time, also stored in the R_dynamic attribute
+        """
+        self.build_system()
+        if method == "eigen":
+            self.R_dynamic = solver_closed_form(
+                self,
+                output_times_s,
+                emission_schedule=emission_schedule,
+                initial_mass_g=initial_mass_g,
+            )
+        else:
+            self.R_dynamic = solver_dynamic(
+                self,
+                output_times_s,
+                emission_schedule=emission_schedule,
+                initial_mass_g=initial_mass_g,
+                method=method,
+            )
+        return self.R_dynamic
+
+    def particle_age(self, emiss_dict_g_s=None):
+        """Mean and variance of the age (time since emission) of the particles of each species and compartment at steady state, from the moments of the age distribution (two extra back-substitutions with the factorized matrix of interactions, no dynamic simulation).
+
+        Parameters
+        ----------
+        emiss_dict_g_s : emissions dictionary (default emiss_dict_g_s)
+
+        Returns
+        -------
+        species_age : dataframe indexed by species with the columns Compartment, mass_g, mean_age_years, age_variance_years2 and age_std_years
+        compartment_age : dataframe indexed by compartment with the same columns (except Compartment)
+        """
+        self.build_system()
+        return particle_age_moments(self, emiss_dict_g_s=emiss_dict_g_s)
+
+    def steady_state_timescales(self, n_modes=5, n_dominant=3):
+        """Time scales to reach the steady state from the slowest eigenmodes of the matrix of interactions (sparse eigensolver re-using the factorized matrix, cheap enough to run after every build). The slowest e-folding time is the time scale to reach the steady state (99% after ~4.6 e-folding times).
+
+        Parameters
+        ----------
+        n_modes : number of slowest modes
+        n_dominant : number of species reported as dominant for each mode
+
+        Returns
+        -------
+        Dataframe with one row per mode with the eigenvalue, e-folding time (s and years), time to decay to 1% and the dominant species of the mode
+        """
+        self.build_system()
+        return slowest_modes(self, n_modes=n_modes, n_dominant=n_dominant)
+
+    def impulse_response(self, species_or_compartment, times, method="krylov"):
+        """Mass of all species in time after a unit pulse emission (i.e. how fast a spill clears from a compartment).
+
+        Parameters
+        ----------
+        species_or_compartment : species code (1 g pulse of that species), compartment name (1 g pulse of the MP form emitted (MP_form) split equally over the size bins) or emissions dictionary with the mass of the pulse (g)
+        times : times (s) after the pulse at which the mass is returned
+        method : "krylov" (shift-and-invert Krylov action of the matrix exponential on the sparse matrix of interactions) or "eigen" (closed form from the eigendecomposition of the dense matrix of interactions)
+
+        Returns
+        -------
+        Dataframe of mass (g) per species (rows) at each time (columns)
+        """
+        self.build_system()
+        return solver_impulse_response(
+            self, species_or_compartment, times, method=method
+        )
+
+    def run_periodic(self, period_s, seasons, output_times_s):
+        """Solves the periodic steady state of the model for seasonal emissions and rate constants (i.e. the yearly cycle reached after the transients have died out) without integrating over many periods.
+
+        Parameters
+        ----------
+        period_s : length of the period (s)
+        seasons : list of seasons, each a dictionary with the keys t_start_s (start of the season within the period, the first season starts at 0), emiss_dict_g_s (emissions dictionary of the season, default emiss_dict_g_s) and rate_factors (factors of the rate constants during the season as {(process, compartment name): factor} or list of [process, compartment name, factor], default none)
+        output_times_s : times within the period at which the mass of each species is reported
+
+        Returns
+        -------
+        Dataframe of mass (g) per species at each output time, also stored in the R_periodic attribute
+        """
+        self.build_system()
+        self.R_periodic = solver_periodic(self, period_s, seasons, output_times_s)
+        return self.R_periodic
+
+    def reduced_order_model(
+        self,
+        n_states,
+        input_species=None,
+        outputs="compartment",
+        method="singular_perturbation",
+    ):
+        """Reduced order surrogate of the model with n_states states (balanced truncation of the matrix of interactions) for fast dynamic runs, i.e. embedded in long scenario loops. The surrogate can be saved to and loaded from JSON files (ReducedOrderModel.save and ReducedOrderModel.load).
+
+        Parameters
+        ----------
+        n_states : number of states of the surrogate (capped at the number of non negligible Hankel singular values)
+        input_species : list of species codes with emissions (default: all species of the emitted MP form)
+        outputs : "compartment" (mass per compartment) or "species" (mass per species)
+        method : "singular_perturbation" (steady state of the balanced minimal realization) or "truncation"
+
+        Returns
+        -------
+        ReducedOrderModel. Its steady_state_error and steady_state_error_bound attributes hold the error of the steady state outputs against the full solution for emiss_dict_g_s and its bound (None when the emissions are not inputs of the surrogate)
+        """
+        self.build_system()
+        surrogate = balanced_reduction(
+            self,
+            n_states,
+            input_species=input_species,
+            outputs=outputs,
+            method=method,
+        )
+        try:
+            (
+                surrogate.steady_state_error,
+                surrogate.steady_state_error_bound,
+            ) = reduced_order_steady_state_error(self, surrogate)
+        except ValueError:
+            surrogate.steady_state_error = None
+            surrogate.steady_state_error_bound = None
+        return surrogate
+
+    def run_scenarios(self, emissions, unit="mass"):
+        """Solves the steady state for many emission scenarios against the same environment and microplastic at once, re-using the factorized matrix of interactions.
+
+        Parameters
+        ----------
+        emissions : list of emission dictionaries (same structure as emiss_dict_g_s) or 2-D array of emissions with shape (scenarios, species) following the order of SpeciesList
+        unit : unit of the emissions, "mass" (g/s) or "number" (particles/s)
+
+        Returns
+        -------
+        Dataframe indexed by (scenario, species) with the columns mass_g, number_of_particles, concentration_g_m3 and concentration_num_m3
+        """
+        self.build_system()
+        return solver_SS_scenarios(self, emissions, unit=unit)
+
+    def run_stream(
+        self, emissions, chunk_size=1000, unit="mass", aggregate="compartment"
+    ):
+        """Solves the steady state for a stream of emission scenarios of any length (i.e. an emission inventory read row by row) in chunks of multi right-hand side back-substitutions with the factorized matrix of interactions, keeping the memory bounded.
+
+        Parameters
+        ----------
+        emissions : iterable of emission scenarios, each an emissions dictionary (same structure as emiss_dict_g_s), a dictionary of emissions per species (same structure as input_flows_g_s) or a vector of emissions per species following the order of SpeciesList
+        chunk_size : number of scenarios solved together
+        unit : unit of the emissions, "mass" (g/s) or "number" (particles/s)
+        aggregate : "compartment" or "species"
+
+        Returns
+        -------
+        Generator of dataframes, one per chunk, indexed by scenario with the steady state mass (g) per compartment or species as columns
+        """
+        self.build_system()
+        return solver_SS_stream(
+            self, emissions, chunk_size=chunk_size, unit=unit, aggregate=aggregate
+        )
+
+    def run_rate_changes(self, factors, emiss_dict_g_s=None):
+        """Steady state of the model after multiplying some rate constants by a factor (one-at-a-time sensitivity analysis). The matrix of interactions is neither reassembled nor refactorized: the change is applied as a low rank update of the cached factorization and the model itself is not modified.
+
+        Parameters
+        ----------
+        factors : dictionary {(process, compartment name): factor}, i.e. {("k_burial", "Sediment_Freshwater"): 1.1}. Use None as compartment name to modify the process in all compartments
+        emiss_dict_g_s : emissions dictionary (default emiss_dict_g_s)
+
+        Returns
+        -------
+        Dataframe indexed by species with the columns mass_g, number_of_particles, concentration_g_m3 and concentration_num_m3
+        """
+        self.build_system()
+        return solver_SS_low_rank(self, factors, emiss_dict_g_s=emiss_dict_g_s)
+
+    def sensitivity_analysis(self, emiss_dict_g_s=None):
+        """Local sensitivity of the overall mass residence time, the overall mass persistence and the mass in each compartment to every rate constant of the system, computed with the adjoint of the matrix of interactions (one back-substitution per output instead of one model run per rate constant).
+
+        Parameters
+        ----------
+        emiss_dict_g_s : emissions dictionary (default emiss_dict_g_s)
+
+        Returns
+        -------
+        Tidy dataframe with the columns species, process, position, recieving_compartment, output, rate_constant, derivative (dOutput/dk) and elasticity ((dOutput/dk)·k/Output)
+        """
+        self.build_system()
+        return rate_constant_sensitivities(self, emiss_dict_g_s=emiss_dict_g_s)
+
+    def uncertainty_analysis(self, input_moments):
+        """Approximate standard deviation of the steady state mass and number of particles per compartment from the means and variances of the data inputs (first order moment propagation). Takes a few solves instead of the hundreds of model runs of the Monte Carlo analysis (run_mc_analysis), at the cost of assuming independent inputs and a linear response around the means.
+
+        Parameters
+        ----------
+        input_moments : dictionary {data input name: (mean, variance)}, i.e. {"t_half_deg_free": (4584, 1000**2), "FI": (0.5, 0.1**2)}
+
+        Returns
+        -------
+        Dataframe indexed by compartment with the columns mass_g, mass_g_std, number_of_particles and number_of_particles_std
+        """
+        return input_uncertainty_propagation(self, input_moments)
+
+    def coupled_species_groups(self):
+        """Returns the groups of species that are mutually coupled (strongly connected components of more than one species of the matrix of interactions) in topological order: the species of a group only recieve mass from their own group and the groups before it.
+
+        Returns
+        -------
+        List of lists of species codes
+        """
+        self.build_system()
+        return BlockTriangularSolver(self.interactions_matrix).coupled_species_groups(
+            self.SpeciesList
+        )
+
+    @property
+    def interactions_df(self):
+        """Dense dataframe view of the sparse matrix of interactions indexed by species code (rows: recieving species, columns: emitting species)."""
+        return pd.DataFrame(
+            self.interactions_matrix.toarray(),
+            index=self.SpeciesList,
+            columns=self.SpeciesList,
+        )
 
     def summarize(self):
         """Prints a summary of the model's key parameters."""
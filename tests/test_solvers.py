@@ -0,0 +1,761 @@
+import copy
+
+import numpy as np
+import pytest
+
+from utopia.utopia import utopiaModel
+from utopia.helpers import generate_fsd_matrix
+from utopia.solver_steady_state import (
+    emission_species_code,
+    emission_vector,
+    factorize_interactions,
+    spm_free_fraction_terms,
+)
+from utopia.solver_dynamic import interactions_eigendecomposition, solver_closed_form
+from utopia.solver_reduced_order import ReducedOrderModel
+from utopia.preprocessing.fill_interactions_df import (
+    fillInteractions_fun_OOP,
+    fillInteractions_sparse,
+    interactions_update,
+)
+from utopia.preprocessing.rc_settling import (
+    calculate_settling_velocity,
+    calculate_settling_velocity_arrays,
+    HydrodynamicsCache,
+)
+from utopia.preprocessing.dry_deposition_MS import (
+    ReynoldsNumberFromStokes,
+    kineticCstdrySettlingNewtonSphere,
+    get_settling,
+    get_settling_arrays,
+)
+from utopia.results_processing.process_results import ResultsProcessor
+from utopia.results_processing.emission_fractions_calculation import (
+    estimate_emission_fractions,
+)
+from utopia.preprocessing.generate_rate_constants import (
+    generate_rate_constants_per_particle,
+)
+
+
+@pytest.fixture(scope="module")
+def model():
+    config_data = utopiaModel.load_json_file("data/default_config.json")
+    data_data = utopiaModel.load_json_file("data/default_data.json")
+    model = utopiaModel(config=config_data, data=data_data)
+    model.run()
+    return model
+
+
+def test_sparse_interactions_match_dense(model):
+    dense = fillInteractions_fun_OOP(
+        model.system_particle_object_list, model.SpeciesList, model.dict_comp
+    ).to_numpy()
+    matrix = fillInteractions_sparse(
+        model.system_particle_object_list, model.SpeciesList, model.dict_comp
+    )
+    assert matrix.nnz < dense.size / 10
+    np.testing.assert_allclose(matrix.toarray(), dense, rtol=1e-12, atol=0)
+
+
+def test_sparse_solve_matches_dense_solve(model):
+    inputVector = np.zeros(len(model.SpeciesList))
+    for species, q in model.input_flows_g_s.items():
+        inputVector[model.SpeciesList.index(species)] = -q
+    expected = np.linalg.solve(model.interactions_df.to_numpy(), inputVector)
+    np.testing.assert_allclose(model.R["mass_g"].to_numpy(), expected, rtol=1e-8)
+
+
+def test_rerun_with_new_emissions_reuses_factorization():
+    model = utopiaModel(config=None, data=None)
+    model.run()
+    lu = model.interactions_lu
+    particles = model.system_particle_object_list
+    mass_g = model.R["mass_g"].copy()
+
+    new_model = copy.copy(model)
+    new_model.emiss_dict_g_s = copy.deepcopy(model.emiss_dict_g_s)
+    new_model.emiss_dict_g_s["Ocean_Surface_Water"]["e"] = 0
+    new_model.emiss_dict_g_s["Air"]["c"] = 10
+    new_model.run()
+
+    assert new_model.interactions_lu is lu
+    assert new_model.system_particle_object_list is not particles
+    # The results of the original model are not overwritten by the copy
+    np.testing.assert_array_equal([p.Pmass_g_SS for p in particles], mass_g.to_numpy())
+
+    data = copy.deepcopy(model.data)
+    data["emiss_dict_g_s"] = new_model.emiss_dict_g_s
+    fresh_model = utopiaModel(config=None, data=data)
+    fresh_model.run()
+    np.testing.assert_allclose(
+        new_model.R["mass_g"].to_numpy(), fresh_model.R["mass_g"].to_numpy()
+    )
+
+    # Changing a rate constant input rebuilds the system
+    new_model.t_half_deg_free = 100
+    new_model.run()
+    assert new_model.interactions_lu is not lu
+
+
+def test_run_scenarios_matches_single_runs(model):
+    other_emissions = copy.deepcopy(model.emiss_dict_g_s)
+    other_emissions["Ocean_Surface_Water"]["e"] = 0
+    other_emissions["Impacted_Soil_Surface"]["d"] = 5
+    results = model.run_scenarios([model.emiss_dict_g_s, other_emissions])
+
+    assert results.shape == (2 * len(model.SpeciesList), 4)
+    scenario_0 = results.loc[0]
+    for column in model.R.columns:
+        np.testing.assert_allclose(
+            scenario_0[column].to_numpy(), model.R[column].to_numpy(), rtol=1e-10
+        )
+
+    emissions_array = np.zeros((1, len(model.SpeciesList)))
+    emissions_array[0, model.SpeciesList.index("dA14_Utopia")] = 5
+    np.testing.assert_allclose(
+        model.run_scenarios(emissions_array).loc[0, "mass_g"].to_numpy(),
+        results.loc[1, "mass_g"].to_numpy(),
+    )
+
+
+def test_dynamic_solver_reaches_steady_state(model):
+    year_s = 365 * 24 * 60 * 60
+    times = np.array([0, 1, 100, 1e5]) * year_s
+    R_dynamic = model.run_dynamic(times)
+    assert (R_dynamic[0] == 0).all()
+    np.testing.assert_allclose(
+        R_dynamic[times[-1]].to_numpy(), model.R["mass_g"].to_numpy(), rtol=1e-6
+    )
+
+    # Stopping the emissions after one year: the mass decays
+    no_emissions = {"Ocean_Surface_Water": {"e": 0}}
+    R_stop = model.run_dynamic(
+        times, emission_schedule=[(0, model.emiss_dict_g_s), (year_s, no_emissions)]
+    )
+    np.testing.assert_allclose(R_stop[times[1]], R_dynamic[times[1]], rtol=1e-6)
+    assert R_stop[times[2]].sum() < R_stop[times[1]].sum()
+
+
+def test_dynamic_run_from_config_with_emission_schedule(model):
+    year_s = 365 * 24 * 60 * 60
+    times = [0, year_s, 100 * year_s]
+    schedule = [[0, model.emiss_dict_g_s], [year_s, {"Ocean_Surface_Water": {"e": 0}}]]
+    config = copy.deepcopy(model.config)
+    config.update({"solver": "Dynamic", "output_times_s": times})
+    data = copy.deepcopy(model.data)
+    data["emission_schedule"] = schedule
+    dynamic_model = utopiaModel(config=config, data=data)
+    dynamic_model.run()
+
+    R_stop = model.run_dynamic(times, emission_schedule=schedule)
+    np.testing.assert_allclose(
+        dynamic_model.R_dynamic.to_numpy(), R_stop.to_numpy(), rtol=1e-12
+    )
+    assert R_stop[times[2]].sum() < R_stop[times[1]].sum()
+
+    # The results processing needs a steady state run
+    with pytest.raises(ValueError, match="R_dynamic"):
+        ResultsProcessor(dynamic_model)
+
+
+def test_closed_form_matches_integration(model):
+    year_s = 365 * 24 * 60 * 60
+    times = np.array([0, 0.5, 10, 100, 1000]) * year_s
+    schedule = [(0, model.emiss_dict_g_s), (10 * year_s, {"Air": {"a": 0}})]
+    R_integrated = model.run_dynamic(times, emission_schedule=schedule)
+    R_closed_form = model.run_dynamic(times, emission_schedule=schedule, method="eigen")
+    for t in times[1:]:
+        np.testing.assert_allclose(
+            R_closed_form[t].to_numpy(),
+            R_integrated[t].to_numpy(),
+            rtol=0,
+            atol=1e-5 * R_integrated[t].abs().max(),
+        )
+
+    R_long = model.run_dynamic(np.linspace(0, 1e5, 2000) * year_s, method="eigen")
+    np.testing.assert_allclose(
+        R_long.iloc[:, -1].to_numpy(), model.R["mass_g"].to_numpy(), rtol=1e-6
+    )
+
+
+def test_scc_block_triangular_solver_matches_lu(model):
+    solver = factorize_interactions(model.interactions_matrix, method="SCC")
+    order = np.concatenate(solver.blocks)
+    assert sorted(order) == list(range(len(model.SpeciesList)))
+    # In solution order the matrix of interactions is block lower triangular
+    block_of = np.empty(len(order), dtype=int)
+    for b, block in enumerate(solver.blocks):
+        block_of[block] = b
+    coo = model.interactions_matrix.tocoo()
+    assert (block_of[coo.row] >= block_of[coo.col]).all()
+
+    rhs = -np.column_stack(
+        [emission_vector(model, model.emiss_dict_g_s), np.ones(len(order))]
+    )
+    np.testing.assert_allclose(
+        solver.solve(rhs), model.interactions_lu.solve(rhs), rtol=1e-9
+    )
+
+    groups = model.coupled_species_groups()
+    assert all(len(group) > 1 for group in groups)
+    assert len(groups) < len(model.SpeciesList)
+
+
+def test_mixed_precision_solver_refines_to_double_precision(model):
+    solver = factorize_interactions(model.interactions_matrix, method="mixed_precision")
+    assert solver.lu.L.dtype == np.float32
+
+    rhs = -emission_vector(model, model.emiss_dict_g_s)
+    expected = model.interactions_lu.solve(rhs)
+    mass_g = solver.solve(rhs)
+    assert solver.residual < 1e-14
+    assert solver.iterations >= 1
+    assert solver.condition_estimate > 1
+    np.testing.assert_allclose(mass_g, expected, rtol=0, atol=1e-10 * expected.max())
+
+
+def test_low_rank_rate_change_matches_rebuilt_matrix(model):
+    factors = {("k_burial", "Sediment_Freshwater"): 2.0, ("k_fragmentation", None): 0.5}
+    lu = model.interactions_lu
+    R_update = model.run_rate_changes(factors)
+    assert model.interactions_lu is lu
+
+    particles = copy.deepcopy(model.system_particle_object_list)
+    for p in particles:
+        for (process, compartment), factor in factors.items():
+            if compartment in [None, p.Pcompartment.Cname]:
+                rate = p.RateConstants[process]
+                if isinstance(rate, tuple):
+                    rate = rate[0]
+                if isinstance(rate, list):
+                    p.RateConstants[process] = [r * factor for r in rate]
+                else:
+                    p.RateConstants[process] = rate * factor
+    matrix = fillInteractions_sparse(particles, model.SpeciesList, model.dict_comp)
+    rhs = -emission_vector(model, model.emiss_dict_g_s)
+    expected = factorize_interactions(matrix).solve(rhs)
+    np.testing.assert_allclose(
+        R_update["mass_g"].to_numpy(), expected, rtol=0, atol=1e-10 * expected.max()
+    )
+
+    with pytest.raises(ValueError):
+        model.run_rate_changes({("k_burial", "Air"): 2.0})
+
+
+def test_adjoint_sensitivities_match_finite_differences(model):
+    S = model.sensitivity_analysis()
+    outputs = set(S["output"])
+    assert {"residence_time_years", "persistence_years"} <= outputs
+    assert "mass_g_Sediment_Freshwater" in outputs
+
+    # Scaling k_burial of all species in the freshwater sediment by (1 + h)
+    h = 1e-6
+    R_plus = model.run_rate_changes({("k_burial", "Sediment_Freshwater"): 1 + h})
+    R_minus = model.run_rate_changes({("k_burial", "Sediment_Freshwater"): 1 - h})
+    burial = S[
+        (S["process"] == "k_burial")
+        & S["species"].isin(
+            [
+                p.Pcode
+                for p in model.system_particle_object_list
+                if p.Pcompartment.Cname == "Sediment_Freshwater"
+            ]
+        )
+    ]
+    for comp in ["Sediment_Freshwater", "Bulk_Freshwater"]:
+        species = [
+            p.Pcode
+            for p in model.system_particle_object_list
+            if p.Pcompartment.Cname == comp
+        ]
+        finite_difference = (
+            R_plus.loc[species, "mass_g"].sum() - R_minus.loc[species, "mass_g"].sum()
+        ) / (2 * h)
+        rows = burial[burial["output"] == "mass_g_" + comp]
+        adjoint = (rows["derivative"] * rows["rate_constant"]).sum()
+        np.testing.assert_allclose(adjoint, finite_difference, rtol=1e-4)
+
+
+def test_krylov_solver_matches_lu(model):
+    rhs = -emission_vector(model, model.emiss_dict_g_s)
+    expected = model.interactions_lu.solve(rhs)
+    for options in [
+        {},
+        {"krylov_method": "bicgstab", "rtol": 1e-12},
+        {"preconditioner": "block_jacobi"},
+    ]:
+        solver = factorize_interactions(
+            model.interactions_matrix,
+            method="krylov",
+            SpeciesList=model.SpeciesList,
+            **options
+        )
+        np.testing.assert_allclose(
+            solver.solve(rhs), expected, rtol=0, atol=1e-8 * expected.max()
+        )
+        # Warm start from the previous solution
+        solver.solve(rhs)
+        assert solver.iterations == 0
+
+    solver = factorize_interactions(
+        model.interactions_matrix, method="krylov", preconditioner=None, maxiter=2
+    )
+    with pytest.raises(RuntimeError):
+        solver.solve(rhs)
+
+
+def test_emission_vector_matches_input_flows(model):
+    q_mass_g_s = emission_vector(model, model.emiss_dict_g_s)
+    for compartment, size_bins in model.emiss_dict_g_s.items():
+        for size_bin in size_bins:
+            species = emission_species_code(model, compartment, size_bin)
+            assert (
+                q_mass_g_s[model.SpeciesList.index(species)]
+                == model.input_flows_g_s[species]
+            )
+
+
+def number_emissions_model(model):
+    """Model with the emissions of model given in particle number."""
+    emiss_dict_num_s = copy.deepcopy(model.emiss_dict_g_s)
+    for compartment, size_bins in emiss_dict_num_s.items():
+        for size_bin in size_bins:
+            species = emission_species_code(model, compartment, size_bin)
+            size_bins[size_bin] = model.input_flows_num_s[species]
+    data = copy.deepcopy(model.data)
+    del data["emiss_dict_g_s"]
+    data["emiss_dict_num_s"] = emiss_dict_num_s
+    number_model = utopiaModel(config=model.config, data=data)
+    number_model.run()
+    return number_model
+
+
+def test_number_emissions_match_mass_emissions(model):
+    number_model = number_emissions_model(model)
+
+    for column in model.R.columns:
+        np.testing.assert_allclose(
+            number_model.R[column].to_numpy(), model.R[column].to_numpy(), rtol=1e-12
+        )
+
+    emissions = np.zeros((1, len(model.SpeciesList)))
+    emissions[0, model.SpeciesList.index("eA0_Utopia")] = model.input_flows_num_s[
+        "eA0_Utopia"
+    ]
+    R_number = model.run_scenarios(emissions, unit="number")
+    np.testing.assert_allclose(
+        R_number.loc[0, "number_of_particles"].to_numpy(),
+        model.R["number_of_particles"].to_numpy(),
+        rtol=1e-10,
+    )
+
+
+def test_emission_fractions_with_number_emissions(model):
+    number_model = number_emissions_model(model)
+    fractions = []
+    for m in [model, number_model]:
+        processor = ResultsProcessor(m)
+        processor.estimate_flows()
+        processor.generate_flows_dict()
+        processor.process_results()
+        fractions.append(estimate_emission_fractions(processor)[0]["y"])
+    np.testing.assert_allclose(fractions[1], fractions[0], rtol=1e-10)
+
+    # Mass emissions set on a copy of a model built with number emissions are kept
+    new_model = copy.copy(number_model)
+    new_model.emiss_dict_g_s = copy.deepcopy(model.emiss_dict_g_s)
+    new_model.emiss_dict_g_s["Air"]["a"] = 1
+    new_model.run()
+    assert new_model.emiss_dict_g_s["Air"]["a"] == 1
+    assert number_model.emiss_dict_g_s is not new_model.emiss_dict_g_s
+
+
+def test_slowest_modes_match_dense_eigenvalues(model):
+    modes = model.steady_state_timescales(n_modes=4)
+    dense = np.linalg.eigvals(model.interactions_matrix.toarray())
+    slowest = dense[np.argsort(np.abs(dense.real))[:4]].real
+    np.testing.assert_allclose(modes["eigenvalue_1_s"].to_numpy(), slowest, rtol=1e-8)
+    assert (modes["e_folding_time_years"].diff().dropna() <= 0).all()
+    assert all(len(species) == 3 for species in modes["dominant_species"])
+
+
+def test_particle_age_moments_match_dense_solution(model):
+    species_age, compartment_age = model.particle_age()
+    np.testing.assert_allclose(
+        species_age["mass_g"].to_numpy(), model.R["mass_g"].to_numpy(), rtol=1e-12
+    )
+    assert compartment_age["mass_g"].sum() == pytest.approx(model.R["mass_g"].sum())
+
+    # Moments of the age distribution exp(A·a)·E: -A^-1·E, A^-2·E and -2·A^-3·E
+    year_s = 365 * 24 * 60 * 60
+    A = model.interactions_matrix.toarray()
+    mass_g = np.linalg.solve(A, -emission_vector(model, model.emiss_dict_g_s))
+    moment_1 = -np.linalg.solve(A, mass_g) / year_s
+    moment_2 = -2 * np.linalg.solve(A, moment_1) / year_s
+    i = model.SpeciesList.index("eB1_Utopia")
+    mean_age = moment_1[i] / mass_g[i]
+    assert species_age["mean_age_years"].iloc[i] == pytest.approx(mean_age, rel=1e-8)
+    assert species_age["age_variance_years2"].iloc[i] == pytest.approx(
+        moment_2[i] / mass_g[i] - mean_age**2, rel=1e-6
+    )
+
+    # Independent check of the mean age with the eigendecomposition of A
+    w, V, V_inv = interactions_eigendecomposition(model)
+    modes = V_inv @ emission_vector(model, model.emiss_dict_g_s)
+    eig_mean_age = (V @ (modes / w**2)).real[i] / (V @ (-modes / w)).real[i] / year_s
+    assert species_age["mean_age_years"].iloc[i] == pytest.approx(
+        eig_mean_age, rel=1e-5
+    )
+
+
+def test_impulse_response_krylov_matches_eigendecomposition(model):
+    times = np.concatenate([[0], np.logspace(-1, 10, 60)])
+    R_krylov = model.impulse_response("Coast_Surface_Water", times)
+    R_eigen = model.impulse_response("Coast_Surface_Water", times, method="eigen")
+    assert R_krylov[0].sum() == pytest.approx(1)
+    np.testing.assert_allclose(R_krylov.to_numpy(), R_eigen.to_numpy(), atol=1e-6)
+    assert (np.diff(R_krylov.sum().to_numpy()) <= 1e-12).all()
+
+    R_species = model.impulse_response("eA3_Utopia", [0, 3600])
+    assert R_species.loc["eA3_Utopia", 0] == 1
+
+
+def test_periodic_steady_state_matches_eigendecomposition(model):
+    year_s = 365 * 24 * 60 * 60
+    times = np.linspace(0, year_s, 5)
+
+    # Constant emissions and rate constants give the steady state at all times
+    R_constant = model.run_periodic(year_s, [{"t_start_s": 0}], times)
+    for t in times:
+        np.testing.assert_allclose(
+            R_constant[t].to_numpy(),
+            model.R["mass_g"].to_numpy(),
+            rtol=1e-7,
+            atol=1e-9 * model.R["mass_g"].max(),
+        )
+
+    # Emissions during the first half of the year, faster fragmentation and no emissions during the second half
+    seasons = [
+        {"t_start_s": 0},
+        {
+            "t_start_s": year_s / 2,
+            "emiss_dict_g_s": {"Air": {"a": 0}},
+            "rate_factors": [["k_fragmentation", None, 3.0]],
+        },
+    ]
+    R_periodic = model.run_periodic(year_s, seasons, times)
+
+    A_1 = model.interactions_matrix.toarray()
+    A_2 = (
+        A_1
+        + interactions_update(
+            model.system_particle_object_list,
+            model.dict_comp,
+            {("k_fragmentation", None): 3.0},
+        ).toarray()
+    )
+    steady_state_1 = np.linalg.solve(A_1, -emission_vector(model, model.emiss_dict_g_s))
+    propagators = []
+    for A in [A_1, A_2]:
+        w, V = np.linalg.eig(A)
+        propagators.append(((V * np.exp(w * year_s / 2)) @ np.linalg.inv(V)).real)
+    c = propagators[1] @ (steady_state_1 - propagators[0] @ steady_state_1)
+    m_0 = np.linalg.solve(np.eye(len(c)) - propagators[1] @ propagators[0], c)
+    np.testing.assert_allclose(
+        R_periodic[0].to_numpy(), m_0, rtol=0, atol=1e-6 * m_0.max()
+    )
+    np.testing.assert_array_equal(R_periodic[0], R_periodic[year_s])
+
+    # Same periodic run from the config, whose results cannot be processed as a steady state run
+    config = copy.deepcopy(model.config)
+    config.update({"solver": "Periodic", "period_s": year_s, "output_times_s": times})
+    data = copy.deepcopy(model.data)
+    data["seasons"] = seasons
+    periodic_model = utopiaModel(config=config, data=data)
+    periodic_model.run()
+    np.testing.assert_array_equal(
+        periodic_model.R_periodic.to_numpy(), R_periodic.to_numpy()
+    )
+    with pytest.raises(ValueError, match="R_periodic"):
+        ResultsProcessor(periodic_model)
+
+
+def test_compartment_factor_overrides_process_factor(model):
+    factors = {("k_burial", "Sediment_Ocean"): 2, ("k_burial", None): 3}
+    delta = interactions_update(
+        model.system_particle_object_list, model.dict_comp, factors
+    ).diagonal()
+    for i, p in enumerate(model.system_particle_object_list):
+        if "burial" not in p.Pcompartment.processess:
+            assert delta[i] == 0
+            continue
+        factor = 2 if p.Pcompartment.Cname == "Sediment_Ocean" else 3
+        assert delta[i] == pytest.approx(-(factor - 1) * p.RateConstants["k_burial"])
+
+    # The process factor is matched even when every compartment is overridden
+    interactions_update(
+        model.system_particle_object_list,
+        model.dict_comp,
+        {
+            ("k_rising", c): 2
+            for c in model.dict_comp
+            if "rising" in model.dict_comp[c].processess
+        }
+        | {("k_rising", None): 3},
+    )
+
+
+def test_uncertainty_analysis_matches_finite_differences(model):
+    std = 50
+    uncertainty = model.uncertainty_analysis(
+        {"MPdensity_kg_m3": (model.data["MPdensity_kg_m3"], std**2)}
+    )
+    assert uncertainty["mass_g"].sum() == pytest.approx(model.R["mass_g"].sum())
+
+    # Central differences of full model runs
+    results = []
+    for step in [0.1, -0.1]:
+        data = dict(model.data)
+        data["MPdensity_kg_m3"] += step
+        perturbed = utopiaModel(config=model.config, data=data)
+        perturbed.run()
+        results.append(perturbed.R)
+    compartments = [p.Pcompartment.Cname for p in model.system_particle_object_list]
+    for column in ["mass_g", "number_of_particles"]:
+        derivative = (results[0][column] - results[1][column]).groupby(
+            compartments
+        ).sum() / 0.2
+        np.testing.assert_allclose(
+            uncertainty[column + "_std"],
+            (derivative * std).abs().loc[uncertainty.index],
+            rtol=1e-3,
+        )
+
+
+def test_spm_depletion_newton_solves_nonlinear_steady_state(model):
+    config = copy.deepcopy(model.config)
+    config["spm_depletion"] = True
+    data = copy.deepcopy(model.data)
+    data["emiss_dict_g_s"]["Ocean_Surface_Water"]["a"] = 1e10
+    depleted = utopiaModel(config=config, data=data)
+    depleted.run()
+
+    trace = depleted.spm_depletion_trace
+    assert len(trace) <= 8
+    assert trace["residual"].iloc[-1] <= 1e-10
+
+    # Residual of the steady state with the matrix of interactions at the converged free SPM fractions
+    mass_g = depleted.R["mass_g"].to_numpy()
+    free_fraction = {
+        comp: np.clip(1 - terms @ mass_g, 0, 1)
+        for comp, terms in spm_free_fraction_terms(depleted).items()
+    }
+    assert free_fraction["Ocean_Surface_Water"] < 0.01
+    matrix = depleted.interactions_matrix + interactions_update(
+        depleted.system_particle_object_list,
+        depleted.dict_comp,
+        {("k_heteroaggregation", comp): f for comp, f in free_fraction.items()},
+    )
+    emissions = emission_vector(depleted, depleted.emiss_dict_g_s)
+    assert np.abs(matrix @ mass_g + emissions).max() <= 1e-10 * emissions.max()
+    assert (mass_g >= 0).all()
+
+    # At the default emission load the SPM depletion is negligible
+    config["spm_depletion"] = True
+    low_load = utopiaModel(config=config, data=model.data)
+    low_load.run()
+    np.testing.assert_allclose(
+        low_load.R["mass_g"], model.R["mass_g"], rtol=1e-4, atol=1e-12
+    )
+
+
+def test_stream_solver_matches_scenarios(model):
+    rng = np.random.default_rng(0)
+    emitted = [
+        model.SpeciesList.index(sp)
+        for sp in ["eA0_Utopia", "cA3_Utopia", "aA16_Utopia"]
+    ]
+
+    def inventory(n):
+        for _ in range(n):
+            q = np.zeros(len(model.SpeciesList))
+            q[emitted] = rng.random(len(emitted))
+            yield q
+
+    chunks = list(model.run_stream(inventory(25), chunk_size=10, aggregate="species"))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert chunks[-1].index[0] == 20
+
+    rng = np.random.default_rng(0)
+    expected = model.run_scenarios(np.array(list(inventory(25))))["mass_g"]
+    streamed = np.concatenate([c.to_numpy() for c in chunks])
+    np.testing.assert_allclose(streamed.ravel(), expected.to_numpy(), rtol=1e-12)
+
+    by_compartment = next(model.run_stream([{"eA0_Utopia": 100}, model.emiss_dict_g_s]))
+    assert by_compartment.shape == (2, len(model.dict_comp))
+    np.testing.assert_allclose(
+        by_compartment.loc[1].sum(), model.R["mass_g"].sum(), rtol=1e-12
+    )
+
+
+def test_reduced_order_model_matches_full_system(model, tmp_path):
+    surrogate = model.reduced_order_model(20)
+    assert surrogate.n_states == 20
+    assert surrogate.steady_state_error <= surrogate.steady_state_error_bound
+    assert surrogate.steady_state_error <= 1e-6 * model.R["mass_g"].sum()
+
+    # The bound holds for large surrogates too (capped at the minimal realization)
+    for method in ["singular_perturbation", "truncation"]:
+        large = model.reduced_order_model(len(model.SpeciesList), method=method)
+        assert large.n_states < len(model.SpeciesList)
+        assert large.steady_state_error <= large.steady_state_error_bound
+
+    # Dynamic run of ten years with daily steps against the closed form solution of the full system
+    day_s = 24 * 60 * 60
+    u = np.zeros(len(surrogate.input_species))
+    u[surrogate.input_species.index("eA0_Utopia")] = 100
+    outputs = surrogate.simulate(np.tile(u, (3650, 1)), day_s)
+    times = day_s * np.arange(365, 3651, 365)
+    R_full = solver_closed_form(model, times)
+    compartments = [p.Pcompartment.Cname for p in model.system_particle_object_list]
+    full = R_full.groupby(compartments).sum().loc[surrogate.output_names]
+    np.testing.assert_allclose(
+        outputs[364::365], full.to_numpy().T, rtol=0, atol=1e-2 * full.sum().min()
+    )
+
+    surrogate.save(tmp_path / "surrogate.json")
+    loaded = ReducedOrderModel.load(tmp_path / "surrogate.json")
+    np.testing.assert_array_equal(
+        loaded.simulate(np.tile(u, (10, 1)), day_s), outputs[:10]
+    )
+
+
+def test_vectorized_rate_constants_match_per_particle(model):
+    vectorized = {p.Pcode: p.RateConstants for p in model.system_particle_object_list}
+    new_model = copy.copy(model)
+    new_model.system_particle_object_list = copy.deepcopy(
+        model.system_particle_object_list
+    )
+    generate_rate_constants_per_particle(new_model)
+    for particle in new_model.system_particle_object_list:
+        assert list(particle.RateConstants) == list(vectorized[particle.Pcode])
+        for process, k in particle.RateConstants.items():
+            np.testing.assert_allclose(
+                vectorized[particle.Pcode][process], k, rtol=1e-14, atol=0
+            )
+
+
+def test_settling_velocity_arrays_match_scalar_solver():
+    shape = np.repeat(["sphere", "fiber"], 12)
+    d_p = np.tile(np.repeat([1e-6, 1e-4, 1e-3, 2e-2], 3), 2)
+    rho_p = np.tile([900.0, 1580.0, 2500.0], 8)
+    rho_f = 1025.0
+    v_s, regime, Re = calculate_settling_velocity_arrays(
+        shape, d_p, rho_p, rho_f, 0.001, 9.81
+    )
+    assert set(regime) == {"Stokes", "Intermediate", "Newton"}
+    for i in range(len(shape)):
+        particle = type("Particle", (), {"Pshape": shape[i]})
+        expected = calculate_settling_velocity(
+            particle, d_p[i], rho_p[i], rho_f, 0.001, 9.81
+        )
+        np.testing.assert_allclose(v_s[i], expected, rtol=1e-9)
+    np.testing.assert_allclose(Re, rho_f * v_s * d_p / 0.001)
+
+
+def test_hydrodynamics_cache_serves_kernels_and_clears(model):
+    new_model = copy.copy(model)
+    new_model.system_particle_object_list = copy.deepcopy(
+        model.system_particle_object_list
+    )
+    new_model.hydrodynamics_cache = HydrodynamicsCache()
+    generate_rate_constants_per_particle(new_model)
+    stats = new_model.hydrodynamics_cache.stats()
+    # One computation per distinct particle and water type, SPM included
+    assert stats["misses"] == stats["size"] < len(model.SpeciesList) / 5
+    assert stats["hits"] > 10 * stats["misses"]
+
+    # Re-assembling with the same inputs only hits the cache, changing them clears it
+    cache = HydrodynamicsCache()
+    new_model.hydrodynamics_cache = cache
+    new_model.assemble_system()
+    first = cache.stats()
+    new_model.assemble_system()
+    assert cache.stats()["misses"] == first["misses"]
+    assert cache.stats()["hits"] == 2 * first["hits"] + first["misses"]
+    new_model.MPdensity_kg_m3 = 1100
+    new_model.assemble_system()
+    assert cache.stats() == first
+
+
+def test_air_settling_arrays_match_scalar_iteration():
+    d = np.repeat([5e-7, 5e-6, 5e-5, 5e-4, 5e-3], 2)
+    rho = np.tile([980.0, 2500.0], 5)
+    settling = get_settling_arrays(d, rho)
+    for i in range(len(d)):
+        Rep = ReynoldsNumberFromStokes(d[i], rho[i])
+        initial_Settling = kineticCstdrySettlingNewtonSphere(d[i], rho[i], Rep)
+        expected = get_settling(initial_Settling, d[i], rho[i], Rep)
+        np.testing.assert_allclose(settling[i], expected, rtol=1e-12)
+
+
+def test_rate_constant_table_matches_particle_rate_constants(model):
+    table = model.rate_constants
+    n_surface = len([c for c in model.dict_comp if "Surface" in c])
+    assert table.values.shape == (
+        len(model.SpeciesList),
+        len(table.processes),
+        n_surface,
+    )
+    for i, p in enumerate(model.system_particle_object_list):
+        assert table.rate_constants(i) == p.RateConstants
+    # The losses of each species are the diagonal of the matrix of interactions
+    np.testing.assert_array_equal(-table.total(), model.interactions_matrix.diagonal())
+    mixing_down = table.column("k_mixing", 1)
+    assert np.count_nonzero(mixing_down) == len(model.SpeciesList) // len(
+        model.dict_comp
+    )
+
+
+def test_fragmentation_block_for_more_size_bins(model):
+    fsd = generate_fsd_matrix(model.FI, 12)
+    np.testing.assert_array_equal(fsd[:5, :5], model.fsd_matrix)
+    np.testing.assert_allclose(fsd[1:].sum(axis=1), 1)
+    assert np.all(np.triu(fsd) == 0)
+
+    config = copy.deepcopy(model.config)
+    config["N_sizeBins"] = 8
+    new_model = utopiaModel(config=config, data=copy.deepcopy(model.data))
+    new_model.build_system()
+    assert len(new_model.SpeciesList) == len(model.SpeciesList) * 8 // 5
+    dense = fillInteractions_fun_OOP(
+        new_model.system_particle_object_list,
+        new_model.SpeciesList,
+        new_model.dict_comp,
+    ).to_numpy()
+    np.testing.assert_array_equal(new_model.interactions_matrix.toarray(), dense)
+
+
+def test_size_fraction_indicators_for_more_size_bins(model):
+    config = copy.deepcopy(model.config)
+    config["N_sizeBins"] = 8
+    data = copy.deepcopy(model.data)
+    # Emissions to the biggest size bin so that all the size bins have mass
+    for compartment, size_bins in data["emiss_dict_g_s"].items():
+        size_bins["h"] = sum(size_bins.values())
+        size_bins.update({"a": 0, "b": 0, "c": 0, "d": 0, "e": 0})
+    new_model = utopiaModel(config=config, data=data)
+    new_model.run()
+    processor = ResultsProcessor(new_model)
+    processor.estimate_flows()
+    processor.generate_flows_dict()
+    processor.process_results()
+    processor.estimate_exposure_indicators()
+
+    indicators = processor.processed_results["size_fraction_indicators"]
+    assert list(indicators["Size (um)"]) == list(new_model.size_dict.values())
+    for column in ["Pov (years)", "Tov (years)"]:
+        values = indicators[column].to_numpy(dtype=float)
+        assert len(values) == 8
+        assert np.all(np.isfinite(values)) and np.all(values > 0)